@@ -0,0 +1,217 @@
+# Analítica de devoluciones: número de devoluciones y tasa (devoluciones / compras) por
+# producto, por categoría (a través de tiene_categoria) y por motivo.
+#
+# Los conteos los calcula Dgraph con @groupby (por motivo, por De_producto y compras por
+# ha_comprado) y aquí se guardan como agregados materializados. model.registrar_devolucion
+# y model.registrar_compra los actualizan al escribir, así un dashboard lee números ya
+# calculados en lugar de recorrer todas las devoluciones. La reconstrucción completa periódica (iniciar) corrige lo que no
+# pasa por model, como las cargas de CSV.
+#
+# i.e.:
+#   agregados = analitica.AgregadosDevoluciones()
+#   agregados.construir(client)
+#   model.usar_agregados_devoluciones(agregados)
+#   agregados.por_categoria()
+import datetime
+import json
+import os
+import threading
+from collections import Counter
+
+import consultas
+
+
+PAGINA = 10000
+
+
+# Grupos de un bloque con @groupby: [{'@groupby': [{predicado: valor, 'count': n}, ...]}].
+def _grupos(data, bloque, predicado):
+    grupos = {}
+    for resultado in data.get(bloque, []):
+        for grupo in resultado.get('@groupby', []):
+            grupos[grupo[predicado]] = grupo['count']
+    return grupos
+
+
+def _tasa(devoluciones, compras):
+    return devoluciones / compras if compras else None
+
+
+class AgregadosDevoluciones:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._detener = threading.Event()
+        self._hilo = None
+        # Una devolución de un producto que no estaba en la última construcción sólo cuenta
+        # en el total y en su motivo hasta la siguiente.
+        self.pendiente = False
+        # Mientras hay construcciones en curso se anotan los deltas de registrar(): la
+        # construcción pudo leer el grafo antes que ellos, así que al cambiar los agregados se
+        # vuelven a aplicar los que llegaron después de su marca. Sólo cuenta doble uno cuyo
+        # commit entró antes de la lectura y cuyo registrar() llegó después de la marca.
+        self._construcciones = 0
+        self._deltas = []
+        self.limpiar()
+
+    def limpiar(self):
+        with self._lock:
+            self.productos = {}        # nombre -> {'categorias': [...], 'devoluciones': n, 'compras': n}
+            self.categorias = {}       # categoria -> {'devoluciones': n, 'compras': n}
+            self.motivos = Counter()   # motivo -> devoluciones
+            self.total = 0
+            self.fecha = None
+
+    @property
+    def listo(self):
+        return self.fecha is not None
+
+    def construir(self, client, pagina=PAGINA):
+        with self._lock:
+            self._construcciones += 1
+            marca = len(self._deltas)
+        try:
+            data, productos, categorias = self._leer(client, pagina)
+            # Se cambia todo a la vez para que los lectores nunca vean una mezcla.
+            with self._lock:
+                self.productos, self.categorias = productos, categorias
+                self.motivos = Counter(_grupos(data, 'por_motivo', 'motivo'))
+                self.total = data['total'][0]['count'] if data.get('total') else 0
+                self.fecha = datetime.datetime.now().isoformat(timespec='seconds')
+                self.pendiente = False
+                for nombreProducto, motivo in self._deltas[marca:]:
+                    if motivo is None:
+                        self._compra(nombreProducto)
+                    else:
+                        self._devolucion(nombreProducto, motivo)
+                return self.total
+        finally:
+            with self._lock:
+                self._construcciones -= 1
+                if not self._construcciones:
+                    self._deltas = []
+
+    def _leer(self, client, pagina):
+        txn = client.txn(read_only=True)
+        try:
+            data = consultas.query(txn, 'agregados_devoluciones')
+        finally:
+            txn.discard()
+        devoluciones = _grupos(data, 'por_producto', 'De_producto')
+        compras = _grupos(data, 'compras', 'ha_comprado')
+
+        productos, categorias = {}, {}
+        for nodo in consultas.paginar(client, 'productos_recomendacion', 'productos', pagina):
+            producto = productos[nodo.get('nombre')] = {
+                'categorias': [c['categoria'] for c in nodo.get('tiene_categoria', []) if 'categoria' in c],
+                'devoluciones': devoluciones.get(nodo['uid'], 0),
+                'compras': compras.get(nodo['uid'], 0),
+            }
+            for categoria in producto['categorias']:
+                suma = categorias.setdefault(categoria, {'devoluciones': 0, 'compras': 0})
+                suma['devoluciones'] += producto['devoluciones']
+                suma['compras'] += producto['compras']
+        return data, productos, categorias
+
+    # Refresco incremental por una devolución nueva.
+    def registrar(self, nombreProducto, motivo):
+        with self._lock:
+            if self._construcciones:
+                self._deltas.append((nombreProducto, motivo))
+            return self._devolucion(nombreProducto, motivo)
+
+    def registrar_compra(self, nombreProducto):
+        with self._lock:
+            if self._construcciones:
+                self._deltas.append((nombreProducto, None))
+            return self._compra(nombreProducto)
+
+    def _devolucion(self, nombreProducto, motivo):
+        with self._lock:
+            self.total += 1
+            self.motivos[motivo] += 1
+            producto = self.productos.get(nombreProducto)
+            if producto is None:
+                self.pendiente = True
+                return False
+            producto['devoluciones'] += 1
+            for categoria in producto['categorias']:
+                self.categorias[categoria]['devoluciones'] += 1
+            return True
+
+    def _compra(self, nombreProducto):
+        with self._lock:
+            producto = self.productos.get(nombreProducto)
+            if producto is None:
+                self.pendiente = True
+                return False
+            producto['compras'] += 1
+            for categoria in producto['categorias']:
+                self.categorias[categoria]['compras'] += 1
+            return True
+
+    #Lecturas: listas ordenadas de mayor a menor número de devoluciones.
+
+    def por_producto(self, n=None):
+        with self._lock:
+            filas = [
+                {'producto': nombre, 'devoluciones': p['devoluciones'], 'compras': p['compras'],
+                 'tasa': _tasa(p['devoluciones'], p['compras'])}
+                for nombre, p in self.productos.items() if p['devoluciones'] or p['compras']
+            ]
+        filas.sort(key=lambda f: -f['devoluciones'])
+        return filas[:n] if n else filas
+
+    def por_categoria(self):
+        with self._lock:
+            filas = [
+                {'categoria': nombre, 'devoluciones': c['devoluciones'], 'compras': c['compras'],
+                 'tasa': _tasa(c['devoluciones'], c['compras'])}
+                for nombre, c in self.categorias.items()
+            ]
+        filas.sort(key=lambda f: -f['devoluciones'])
+        return filas
+
+    # La tasa de un motivo es su parte del total de devoluciones.
+    def por_motivo(self):
+        with self._lock:
+            return [{'motivo': motivo, 'devoluciones': n, 'tasa': _tasa(n, self.total)}
+                    for motivo, n in self.motivos.most_common()]
+
+    def resumen(self, n=20):
+        with self._lock:
+            return {
+                'fecha': self.fecha,
+                'pendiente': self.pendiente,
+                'total': self.total,
+                'productos': self.por_producto(n),
+                'categorias': self.por_categoria(),
+                'motivos': self.por_motivo(),
+            }
+
+    # Escribe resumen() en un JSON para dashboards en otro proceso; nunca queda a medias.
+    def guardar(self, path, n=20):
+        temporal = path + '.tmp'
+        with open(temporal, 'w', encoding='utf-8') as f:
+            json.dump(self.resumen(n), f, indent=2, ensure_ascii=False)
+        os.replace(temporal, path)
+
+    # Reconstruye todo cada `intervalo` segundos en un hilo aparte (y escribe `path` si se da).
+    def iniciar(self, client, intervalo=3600, path=None):
+        def correr():
+            while not self._detener.is_set():
+                try:
+                    self.construir(client)
+                    if path:
+                        self.guardar(path)
+                except Exception as e:
+                    print(f"Error al construir la analítica de devoluciones: {e}")
+                self._detener.wait(intervalo)
+
+        self._detener.clear()
+        self._hilo = threading.Thread(target=correr, name='AgregadosDevoluciones', daemon=True)
+        self._hilo.start()
+
+    def detener(self):
+        self._detener.set()
+        if self._hilo is not None:
+            self._hilo.join()
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+# Benchmark de la carga y de las queries de model.py contra un Dgraph real (o contra
+# dgraph_memoria con --memoria, para medir el lado del cliente sin servidor). Toma el tiempo
+# de cada loader (filas/s) y de cada función de lectura (p50/p95/p99 y llamadas/s), y la
+# memoria máxima del proceso (peak RSS). El resultado se guarda en JSON para comparar
+# corridas con --comparar.
+#
+# i.e.:
+#   python3 generar_datos.py --usuarios 100000 --out datos_100k
+#   python3 benchmark.py --datos datos_100k --drop --out base.json
+#   python3 benchmark.py --datos datos_100k --sin-carga --comparar base.json
+#   python3 benchmark.py --datos datos_100k --memoria --latencia-ms 2 --hilos 16
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import random
+import resource
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import model
+from dgraph_memoria import ClienteMemoria, DgraphMemoria
+from pool import PoolClientes
+
+
+# Funciones de lectura que se miden; todas reciben (client, username).
+QUERIES = [
+    model.search_users,
+    model.favoritos_del_usuario,
+    model.devoluciones_por_usuario,
+    model.recomendaciones_por_categoria,
+]
+MUESTRA_USUARIOS = 10000
+
+
+# En Linux ru_maxrss está en KB.
+def rss_max_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def percentiles(muestras):
+    if not muestras:
+        return {}
+    muestras = sorted(muestras)
+
+    def p(q):
+        return 1000 * muestras[min(len(muestras) - 1, int(q * len(muestras)))]
+
+    return {
+        'p50_ms': p(0.50),
+        'p95_ms': p(0.95),
+        'p99_ms': p(0.99),
+        'promedio_ms': 1000 * sum(muestras) / len(muestras),
+        'max_ms': 1000 * muestras[-1],
+    }
+
+
+# Las funciones de model imprimen los resultados; en el benchmark no interesa.
+@contextlib.contextmanager
+def sin_salida():
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+# Igual que create_data, pero tomando el tiempo de cada loader.
+def medir_carga(client, datos_dir, chunk_size=model.CHUNK_SIZE, columnar=False):
+    conexiones = model.conexiones_de(client)
+    uidmap = model.abrir_uidmap(os.path.join(datos_dir, model.UIDMAP_PATH))
+    resultados = {}
+    try:
+        uids = {}
+        for nombre, loader, archivo in model.loaders_nodos(columnar):
+            etiqueta = f'{nombre}_columnar' if columnar else loader.__name__
+            inicio = time.perf_counter()
+            with sin_salida():
+                uids[nombre] = loader(os.path.join(datos_dir, archivo), chunk_size, conexiones, uidmap=uidmap)
+            segundos = time.perf_counter() - inicio
+            filas = len(uids[nombre])
+            resultados[etiqueta] = {'filas': filas, 'segundos': segundos, 'filas_s': filas / segundos}
+            print(f"{etiqueta}: {filas} nodos en {segundos:.2f}s")
+
+        for loader, archivo, origen, destino in model.RELACIONES:
+            inicio = time.perf_counter()
+            with sin_salida():
+                aristas = loader(os.path.join(datos_dir, archivo), uids[origen], uids[destino], conexiones=conexiones)
+            segundos = time.perf_counter() - inicio
+            resultados[loader.__name__] = {'filas': aristas, 'segundos': segundos, 'filas_s': aristas / segundos}
+            print(f"{loader.__name__}: {aristas} aristas en {segundos:.2f}s")
+    finally:
+        uidmap.close()
+    return resultados
+
+
+# Muestra uniforme de usernames del CSV sin cargarlo completo (reservoir sampling).
+def muestra_usuarios(datos_dir, n=MUESTRA_USUARIOS, seed=0):
+    rng = random.Random(seed)
+    muestra = []
+    for i, row in enumerate(model.leer_csv(os.path.join(datos_dir, 'User.csv'))):
+        if i < n:
+            muestra.append(row['username'])
+        else:
+            j = rng.randint(0, i)
+            if j < n:
+                muestra[j] = row['username']
+    return muestra
+
+
+# Llama `funcion(client, username)` `llamadas` veces con `hilos` en paralelo. Antes se
+# vacían los caches de model para medir las queries y no el cache, salvo con `con_cache`.
+def medir_query(client, funcion, usernames, llamadas, hilos=1, con_cache=False, seed=0):
+    if not con_cache:
+        model.uid_cache.clear()
+        model.resultados_cache.clear()
+    rng = random.Random(seed)
+    argumentos = [rng.choice(usernames) for _ in range(llamadas)]
+    errores = []
+
+    def llamar(username):
+        inicio = time.perf_counter()
+        try:
+            funcion(client, username)
+        except Exception as e:
+            errores.append(repr(e))
+        return time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    with sin_salida(), ThreadPoolExecutor(max_workers=hilos) as executor:
+        muestras = list(executor.map(llamar, argumentos))
+    segundos = time.perf_counter() - inicio
+    return dict(percentiles(muestras), llamadas=llamadas, hilos=hilos, errores=len(errores),
+                segundos=segundos, llamadas_s=llamadas / segundos)
+
+
+# Cambio relativo contra una corrida anterior: latencias (p95) y throughput.
+def comparar(actual, anterior):
+    for seccion, metrica in (('carga', 'filas_s'), ('queries', 'llamadas_s'), ('queries', 'p95_ms')):
+        for nombre, valores in actual.get(seccion, {}).items():
+            antes = anterior.get(seccion, {}).get(nombre, {}).get(metrica)
+            if antes:
+                cambio = 100 * (valores[metrica] - antes) / antes
+                print(f"{seccion}.{nombre}.{metrica}: {antes:.2f} -> {valores[metrica]:.2f} ({cambio:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de carga y queries de model.py.')
+    parser.add_argument('--datos', default='.', help='Directorio con los CSV (i.e. de generar_datos.py)')
+    parser.add_argument('--alphas', default=os.getenv('DGRAPH_ALPHAS') or os.getenv('DGRAPH_URI', 'localhost:9080'),
+                        help='Alphas separados por coma')
+    parser.add_argument('--conexiones', type=int, default=1, help='Canales gRPC por Alpha')
+    parser.add_argument('--drop', action='store_true', help='drop_all (vuelve a aplicar el schema) antes de cargar')
+    parser.add_argument('--sin-carga', action='store_true', help='Sólo medir las queries')
+    parser.add_argument('--llamadas', type=int, default=1000, help='Llamadas por función de lectura')
+    parser.add_argument('--hilos', type=int, default=1, help='Llamadas concurrentes')
+    parser.add_argument('--con-cache', action='store_true', help='No vaciar los caches de model antes de cada función')
+    parser.add_argument('--out', default='benchmark.json', help='Archivo JSON de resultados')
+    parser.add_argument('--comparar', help='JSON de una corrida anterior')
+    parser.add_argument('--columnar', action='store_true', help='Cargar los nodos por columnas (columnar.py)')
+    parser.add_argument('--memoria', action='store_true', help='Usar dgraph_memoria en lugar de un Dgraph real')
+    parser.add_argument('--latencia-ms', type=float, default=0.0, help='Latencia por llamada con --memoria')
+    args = parser.parse_args()
+
+    resultado = {
+        'fecha': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': sys.version.split()[0],
+        'plataforma': platform.platform(),
+        'args': vars(args),
+    }
+    db = None
+    if args.memoria:
+        db = DgraphMemoria(latencia=args.latencia_ms / 1000)
+        client = contextlib.nullcontext(ClienteMemoria(db))
+        args.drop = True
+    else:
+        client = PoolClientes(args.alphas, args.conexiones)
+    with client as client:
+        if args.drop:
+            with sin_salida():
+                model.drop_all(client)
+        if not args.sin_carga:
+            resultado['carga'] = medir_carga(client, args.datos, columnar=args.columnar)
+            resultado['rss_carga_mb'] = rss_max_mb()
+
+        usernames = muestra_usuarios(args.datos)
+        resultado['queries'] = {}
+        for funcion in QUERIES:
+            resultado['queries'][funcion.__name__] = medidas = medir_query(
+                client, funcion, usernames, args.llamadas, args.hilos, args.con_cache)
+            print(f"{funcion.__name__}: p50 {medidas['p50_ms']:.2f}ms, p95 {medidas['p95_ms']:.2f}ms, "
+                  f"p99 {medidas['p99_ms']:.2f}ms, {medidas['llamadas_s']:.1f} llamadas/s")
+    resultado['rss_max_mb'] = rss_max_mb()
+    if db is not None:
+        resultado['llamadas'] = dict(db.llamadas)
+        print(f"Llamadas a dgraph_memoria: {dict(db.llamadas)}")
+
+    with open(args.out, 'w', encoding='utf-8') as out:
+        json.dump(resultado, out, indent=2)
+    print(f"Resultados en {args.out} (peak RSS {resultado['rss_max_mb']:.1f} MB)")
+
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as f:
+            comparar(resultado, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
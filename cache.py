@@ -0,0 +1,115 @@
+# Cache LRU con expiración (TTL) y contadores de hits/misses, seguro entre hilos.
+import json
+import threading
+import time
+from collections import OrderedDict
+
+
+# Con `max_bytes` también se limita la suma de los tamaños que se pasan a put().
+class LRUCache:
+    def __init__(self, maxsize=10000, ttl=300, max_bytes=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.bytes = 0
+        self._datos = OrderedDict()
+        self._lock = threading.Lock()
+
+    # Regresa `default` si la llave no está o ya expiró.
+    def get(self, llave, default=None):
+        with self._lock:
+            entrada = self._datos.get(llave)
+            if entrada is None or entrada[1] < time.monotonic():
+                if entrada is not None:
+                    self._quitar(llave)
+                self.misses += 1
+                return default
+            self._datos.move_to_end(llave)
+            self.hits += 1
+            return entrada[0]
+
+    def put(self, llave, valor, tamano=0):
+        with self._lock:
+            self._quitar(llave)
+            self._datos[llave] = (valor, time.monotonic() + self.ttl, tamano)
+            self.bytes += tamano
+            while len(self._datos) > self.maxsize or (self.max_bytes is not None and self.bytes > self.max_bytes):
+                _, (_, _, tamano_viejo) = self._datos.popitem(last=False)
+                self.bytes -= tamano_viejo
+
+    def _quitar(self, llave):
+        entrada = self._datos.pop(llave, None)
+        if entrada is not None:
+            self.bytes -= entrada[2]
+
+    def invalidate(self, llave):
+        with self._lock:
+            self._quitar(llave)
+
+    def clear(self):
+        with self._lock:
+            self._datos.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'size': len(self._datos),
+                'bytes': self.bytes,
+            }
+
+    def __len__(self):
+        with self._lock:
+            return len(self._datos)
+
+
+# Cache de resultados de lectura por username (i.e. el perfil de search_users) que las
+# escrituras invalidan. Para que una lectura que empezó antes de una escritura no guarde
+# un resultado viejo después de la invalidación, cada username cae en una franja con un
+# contador de versión: la lectura toma la versión antes de consultar y put() sólo guarda
+# si la versión no cambió. Las franjas mantienen acotada la memoria de las versiones.
+class CacheResultados:
+    def __init__(self, funciones, maxsize=10000, ttl=300, max_bytes=64 * 1024 * 1024, franjas=4096):
+        self.funciones = tuple(funciones)
+        self.cache = LRUCache(maxsize, ttl, max_bytes)
+        self._versiones = [0] * franjas
+        self._lock = threading.Lock()
+
+    def _franja(self, username):
+        return hash(username) % len(self._versiones)
+
+    def version(self, username):
+        with self._lock:
+            return self._versiones[self._franja(username)]
+
+    def get(self, funcion, username):
+        return self.cache.get((funcion, username))
+
+    # El tamaño del resultado se estima con su JSON.
+    def put(self, funcion, username, valor, version):
+        tamano = len(json.dumps(valor))
+        with self._lock:
+            if self._versiones[self._franja(username)] != version:
+                return False
+            self.cache.put((funcion, username), valor, tamano)
+            return True
+
+    def invalidar(self, username):
+        with self._lock:
+            self._versiones[self._franja(username)] += 1
+            for funcion in self.funciones:
+                self.cache.invalidate((funcion, username))
+
+    def clear(self):
+        with self._lock:
+            self._versiones = [v + 1 for v in self._versiones]
+            self.cache.clear()
+
+    def stats(self):
+        return self.cache.stats()
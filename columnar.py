@@ -0,0 +1,204 @@
+# Carga columnar de los CSV de nodos. En lugar de un dict por fila (csv.DictReader y
+# fila_usuario / fila_producto / ...), el CSV se lee en bloques de filas que se pasan a
+# columnas de numpy. Cada columna se valida y se convierte completa (precio a float, stock a
+# int, fechas ISO 8601) y las N-Quads de la mutación se arman directo de las columnas.
+#
+# Las filas inválidas (xid vacío, número de columnas distinto al encabezado, precio o stock
+# que no son números o son negativos, fechas mal formadas) no se mandan: se escriben en un
+# CSV de errores con su número de fila y el motivo.
+#
+# Requiere numpy; model.cargar_nodos_columnar lo usa con create_data(client, columnar=True).
+import csv
+import itertools
+from json.encoder import encode_basestring
+
+import numpy as np
+
+
+# Columnas de cada tipo de nodo: (columna del CSV, predicado, tipo). Son las mismas que
+# arman fila_usuario, fila_producto, fila_devolucion y fila_categoria en model.py.
+COLUMNAS = {
+    'User': [
+        ('user_id', 'xid', 'xid'),
+        ('username', 'username', 'texto'),
+        ('email', 'email', 'texto'),
+        ('phone', 'phone', 'texto'),
+        ('birthdate', 'birthdate', 'fecha'),
+        ('created_at', 'created_at', 'fecha'),
+    ],
+    'Producto': [
+        ('Productos_id', 'xid', 'xid'),
+        ('nombre', 'nombre', 'texto'),
+        ('precio', 'precio', 'float'),
+        ('descripcion', 'descripcion', 'texto'),
+        ('stock', 'stock', 'int'),
+    ],
+    'devolucion': [
+        ('devolucion_id', 'xid', 'xid'),
+        ('motivo', 'motivo', 'texto'),
+    ],
+    'Categoria': [
+        ('categoria', 'xid', 'xid'),
+        ('categoria', 'categoria', 'texto'),
+    ],
+}
+SUFIJOS = {'float': '"^^<xs:float>', 'int': '"^^<xs:int>', 'fecha': '"^^<xs:dateTime>'}
+
+
+# Convierte una columna (tupla de strings). Regresa (literales N-Quad, máscara de filas
+# inválidas). El texto va tal cual, como en fila_usuario y compañía. Los números y fechas se
+# convierten con un solo astype; sólo si falla se revisa valor por valor para saber cuáles
+# filas están mal.
+def _convertir(valores, tipo):
+    if tipo in ('xid', 'texto'):
+        invalidos = np.zeros(len(valores), dtype=bool)
+        if tipo == 'xid':
+            invalidos = np.char.str_len(np.char.strip(np.array(valores, dtype=str))) == 0
+        return list(map(encode_basestring, valores)), invalidos
+
+    valores = np.array(valores, dtype=str)
+    # Fechas sólo en UTC: la Z final se quita para validar y el literal queda como venía.
+    dtype, nulo, texto = {
+        'float': (np.float64, np.nan, valores),
+        'int': (np.int64, None, valores),
+        'fecha': ('datetime64[s]', np.datetime64('NaT'), np.char.rstrip(valores, 'Z')),
+    }[tipo]
+    try:
+        convertidos = texto.astype(dtype)
+        invalidos = np.zeros(len(valores), dtype=bool)
+    except ValueError:
+        convertidos, invalidos = _convertir_uno_por_uno(texto, dtype, nulo)
+
+    if tipo == 'fecha':
+        invalidos |= np.isnat(convertidos)
+        literales = valores
+    else:
+        if tipo == 'float':
+            invalidos |= ~np.isfinite(convertidos)
+        invalidos |= convertidos < 0
+        literales = convertidos.astype(str)
+    return np.char.add(np.char.add('"', literales), SUFIJOS[tipo]).tolist(), invalidos
+
+
+def _convertir_uno_por_uno(valores, dtype, nulo):
+    convertidos = np.zeros(len(valores), dtype=dtype)
+    invalidos = np.zeros(len(valores), dtype=bool)
+    for i, valor in enumerate(valores.tolist()):
+        try:
+            convertidos[i] = np.array(valor).astype(dtype)
+        except ValueError:
+            invalidos[i] = True
+            if nulo is not None:
+                convertidos[i] = nulo
+    return convertidos, invalidos
+
+
+# Filas válidas de un bloque, ya como literales N-Quad por predicado.
+class Bloque:
+    def __init__(self, tipo, xids, literales):
+        self.tipo = tipo
+        # Un xid repetido en el bloque es el mismo nodo, como con el blank node _:xid.
+        xids, self._nodo = np.unique(xids, return_inverse=True)
+        self.xids = xids.tolist()
+        self.literales = literales
+
+    def __len__(self):
+        return len(self._nodo)
+
+    # N-Quads del bloque; los nodos que ya existen (`existentes`, xid -> uid) se actualizan
+    # y el resto se crea con el blank node _:n<i>.
+    def nquads(self, existentes):
+        por_nodo = np.char.add('_:n', np.arange(len(self.xids)).astype(str)).astype(object)
+        if existentes:
+            for i, xid in enumerate(self.xids):
+                if xid in existentes:
+                    por_nodo[i] = f'<{existentes[xid]}>'
+        sujetos = por_nodo[self._nodo].tolist()
+        lineas = [zip(sujetos, itertools.repeat('<dgraph.type>'), itertools.repeat(encode_basestring(self.tipo)),
+                      itertools.repeat('.'))]
+        for predicado, literales in self.literales.items():
+            lineas.append(zip(sujetos, itertools.repeat(f'<{predicado}>'), literales, itertools.repeat('.')))
+        return '\n'.join(map(' '.join, itertools.chain.from_iterable(lineas)))
+
+    # xid -> uid de los nodos que creó la mutación (resp.uids usa las etiquetas sin _:).
+    def uids_creados(self, uids):
+        return {xid: uids[f'n{i}'] for i, xid in enumerate(self.xids) if f'n{i}' in uids}
+
+
+# Lee un CSV de nodos de `tipo` en bloques de `filas` filas. Itera Bloques con las filas
+# válidas y escribe las inválidas en `errores_path` (sólo se crea si hay alguna).
+class LectorColumnar:
+    def __init__(self, file_path, tipo, filas, errores_path):
+        self.file_path = file_path
+        self.tipo = tipo
+        self.filas = filas
+        self.errores_path = errores_path
+        self.rechazadas = 0
+        self._errores = None
+        self._archivo_errores = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._archivo_errores is not None:
+            self._archivo_errores.close()
+            self._archivo_errores = self._errores = None
+
+    def bloques(self):
+        with open(self.file_path, 'r', newline='') as file:
+            reader = csv.reader(file)
+            encabezado = next(reader, [])
+            faltantes = {c for c, _, _ in COLUMNAS[self.tipo]} - set(encabezado)
+            if faltantes:
+                raise ValueError(f"{self.file_path}: faltan las columnas {sorted(faltantes)}")
+            posiciones = [(encabezado.index(c), predicado, tipo) for c, predicado, tipo in COLUMNAS[self.tipo]]
+            inicio = 1
+            while True:
+                filas = list(itertools.islice(reader, self.filas))
+                if not filas:
+                    return
+                bloque = self._bloque(encabezado, filas, posiciones, inicio)
+                inicio += len(filas)
+                if len(bloque):
+                    yield bloque
+
+    def _bloque(self, encabezado, filas, posiciones, inicio):
+        motivos = np.full(len(filas), '', dtype=object)
+        largos = np.fromiter(map(len, filas), dtype=np.int64, count=len(filas))
+        completas = np.flatnonzero(largos == len(encabezado))
+        if len(completas) < len(filas):
+            motivos[largos != len(encabezado)] = f'se esperaban {len(encabezado)} columnas'
+            filas_completas = [filas[i] for i in completas]
+        else:
+            filas_completas = filas
+        columnas = list(zip(*filas_completas)) or [()] * len(encabezado)
+
+        literales = {}
+        invalidos = np.zeros(len(completas), dtype=bool)
+        for posicion, predicado, tipo in posiciones:
+            literales[predicado], malos = _convertir(columnas[posicion], tipo)
+            motivos[completas[malos & ~invalidos]] = f'{encabezado[posicion]} inválido'
+            invalidos |= malos
+
+        rechazadas = np.flatnonzero(motivos != '')
+        if len(rechazadas):
+            self._rechazar(encabezado, filas, rechazadas, motivos, inicio)
+        xids = np.array(columnas[posiciones[0][0]], dtype=str)
+        if invalidos.any():
+            validas = np.flatnonzero(~invalidos)
+            xids = xids[validas]
+            literales = {predicado: [valores[i] for i in validas] for predicado, valores in literales.items()}
+        return Bloque(self.tipo, xids, literales)
+
+    def _rechazar(self, encabezado, filas, rechazadas, motivos, inicio):
+        if self._errores is None:
+            self._archivo_errores = open(self.errores_path, 'w', newline='')
+            self._errores = csv.writer(self._archivo_errores)
+            self._errores.writerow(['fila', 'error'] + encabezado)
+        for i in rechazadas:
+            self._errores.writerow([inicio + i, motivos[i]] + filas[i])
+        self.rechazadas += len(rechazadas)
@@ -0,0 +1,479 @@
+# Registro de queries DQL con nombre. Las queries usan $variables en lugar de armarse con
+# f-strings, así el texto de cada query siempre es el mismo y un nombre con comillas no
+# rompe la query. El tiempo de cada query queda en metricas; ver estadisticas_queries().
+import json
+
+import metricas
+
+
+QUERIES = {
+    'search_user': """
+    query search_user($username: string) {
+        search_user(func: eq(username, $username)) @filter(type(User)) {
+            username
+            email
+            phone
+            birthdate
+            created_at
+            ha_comprado {
+                nombre
+                precio
+            }
+            tiene_favoritos {
+                nombre
+                precio
+            }
+            hizo_devolucion {
+                motivo
+                De_producto {
+                    nombre
+                    precio
+                }
+            }
+        }
+    }
+    """,
+
+    'uid_usuario': """
+    query uid_usuario($username: string) {
+        search_user(func: eq(username, $username)) @filter(type(User)) {
+            uid
+        }
+    }
+    """,
+
+    'uid_producto': """
+    query uid_producto($nombre: string) {
+        search_producto(func: eq(nombre, $nombre)) @filter(type(Producto)) {
+            uid
+        }
+    }
+    """,
+
+    'devoluciones_usuario': """
+    query devoluciones_usuario($username: string) {
+        devoluciones_usuario(func: eq(username, $username)) @filter(type(User)) {
+            username
+            hizo_devolucion @filter(type(devolucion)) {
+                motivo
+                De_producto @filter(type(Producto)) {
+                    nombre
+                    precio
+                }
+            }
+        }
+    }
+    """,
+
+    'favoritos_usuario': """
+    query favoritos_usuario($username: string) {
+        usuario_favoritos(func: eq(username, $username)) @filter(type(User)) {
+            username
+            tiene_favoritos @filter(type(Producto)) {
+                nombre
+                precio
+                descripcion
+                stock
+            }
+        }
+    }
+    """,
+
+    'recomendaciones_categoria': """
+    query recomendaciones_categoria($username: string) {
+        var(func: eq(username, $username)) @filter(type(User)) {
+            fav as tiene_favoritos @filter(type(Producto)) {
+                cat as tiene_categoria
+            }
+        }
+
+        recomendaciones(func: uid(cat)) @filter(type(Categoria)) {
+            categoria
+            recomendaciones: ~tiene_categoria @filter(type(Producto) AND NOT uid(fav)) (first: 2) {
+                uid
+                nombre
+                precio
+                descripcion
+                stock
+            }
+        }
+    }
+    """,
+
+    # Consultas paginadas por uid: $first nodos después de $after.
+    'productos_recomendacion': """
+    query productos_recomendacion($first: int, $after: string) {
+        productos(func: type(Producto), first: $first, after: $after) {
+            uid
+            nombre
+            precio
+            descripcion
+            stock
+            tiene_categoria {
+                categoria
+            }
+        }
+    }
+    """,
+
+    'interacciones_usuarios': """
+    query interacciones_usuarios($first: int, $after: string) {
+        usuarios(func: type(User), first: $first, after: $after) {
+            uid
+            username
+            tiene_favoritos {
+                uid
+            }
+            ha_comprado {
+                uid
+            }
+        }
+    }
+    """,
+
+    # Nodos con sus aristas salientes (sólo uids) para snapshot.py, paginados por uid.
+    'snapshot_User': """
+    query snapshot_User($first: int, $after: string) {
+        nodos(func: type(User), first: $first, after: $after) {
+            uid
+            xid
+            username
+            ha_comprado { uid }
+            tiene_favoritos { uid }
+            hizo_devolucion { uid }
+        }
+    }
+    """,
+
+    'snapshot_Producto': """
+    query snapshot_Producto($first: int, $after: string) {
+        nodos(func: type(Producto), first: $first, after: $after) {
+            uid
+            xid
+            nombre
+            descripcion
+            precio
+            stock
+            tiene_categoria { uid }
+        }
+    }
+    """,
+
+    'snapshot_Categoria': """
+    query snapshot_Categoria($first: int, $after: string) {
+        nodos(func: type(Categoria), first: $first, after: $after) {
+            uid
+            xid
+            categoria
+        }
+    }
+    """,
+
+    'snapshot_devolucion': """
+    query snapshot_devolucion($first: int, $after: string) {
+        nodos(func: type(devolucion), first: $first, after: $after) {
+            uid
+            xid
+            motivo
+            De_producto { uid }
+        }
+    }
+    """,
+
+    # Conteos de analitica.py: los calcula Dgraph con @groupby. Los grupos de por_producto y
+    # compras son uids de producto.
+    'agregados_devoluciones': """
+    {
+        total(func: type(devolucion)) {
+            count(uid)
+        }
+        por_motivo(func: type(devolucion)) @groupby(motivo) {
+            count(uid)
+        }
+        por_producto(func: type(devolucion)) @groupby(De_producto) {
+            count(uid)
+        }
+        compras(func: type(User)) @groupby(ha_comprado) {
+            count(uid)
+        }
+    }
+    """,
+
+    # Búsqueda fulltext de productos con rango de precio, paginada por uid ($first / $after).
+    'buscar_productos': """
+    query buscar_productos($texto: string, $min: float, $max: float, $first: int, $after: string) {
+        productos(func: anyoftext(nombre, $texto), first: $first, after: $after)
+            @filter(type(Producto) AND ge(precio, $min) AND le(precio, $max)) {
+            uid
+            nombre
+            precio
+            descripcion
+            stock
+        }
+    }
+    """,
+
+    'buscar_productos_todas': """
+    query buscar_productos_todas($texto: string, $min: float, $max: float, $first: int, $after: string) {
+        productos(func: alloftext(nombre, $texto), first: $first, after: $after)
+            @filter(type(Producto) AND ge(precio, $min) AND le(precio, $max)) {
+            uid
+            nombre
+            precio
+            descripcion
+            stock
+        }
+    }
+    """,
+
+    # Aristas de un usuario paginadas por uid ($first / $after), para usuarios con miles.
+    'favoritos_pagina': """
+    query favoritos_pagina($username: string, $first: int, $after: string) {
+        usuario(func: eq(username, $username)) @filter(type(User)) {
+            tiene_favoritos(first: $first, after: $after) {
+                uid
+                nombre
+                precio
+                descripcion
+                stock
+            }
+        }
+    }
+    """,
+
+    'compras_pagina': """
+    query compras_pagina($username: string, $first: int, $after: string) {
+        usuario(func: eq(username, $username)) @filter(type(User)) {
+            ha_comprado(first: $first, after: $after) {
+                uid
+                nombre
+                precio
+            }
+        }
+    }
+    """,
+
+    'devoluciones_pagina': """
+    query devoluciones_pagina($username: string, $first: int, $after: string) {
+        usuario(func: eq(username, $username)) @filter(type(User)) {
+            hizo_devolucion(first: $first, after: $after) {
+                uid
+                motivo
+                De_producto {
+                    nombre
+                    precio
+                }
+            }
+        }
+    }
+    """,
+
+    'conteos_usuario': """
+    query conteos_usuario($username: string) {
+        usuario(func: eq(username, $username)) @filter(type(User)) {
+            favoritos: count(tiene_favoritos)
+            compras: count(ha_comprado)
+            devoluciones: count(hizo_devolucion)
+        }
+    }
+    """,
+
+    # "También compraron" / "también en favoritos" de un producto, por las aristas reversas.
+    # Se recorren a lo más $fanout usuarios del producto (y $fanout productos de cada uno)
+    # para que un producto muy popular cueste lo mismo que uno normal; `veces` es cuántos de
+    # esos usuarios tienen también el otro producto, y Dgraph ordena y corta el top $first.
+    'tambien_compraron': """
+    query tambien_compraron($nombre: string, $fanout: int, $first: int) {
+        producto as var(func: eq(nombre, $nombre), first: 1) @filter(type(Producto)) {
+            usuarios as ~ha_comprado (first: $fanout)
+        }
+        var(func: uid(usuarios)) {
+            otros as ha_comprado (first: $fanout) @filter(NOT uid(producto))
+        }
+        var(func: uid(otros)) {
+            veces as count(~ha_comprado @filter(uid(usuarios)))
+        }
+        productos(func: uid(veces), orderdesc: val(veces), first: $first) {
+            uid
+            nombre
+            precio
+            veces: val(veces)
+        }
+    }
+    """,
+
+    'tambien_favoritos': """
+    query tambien_favoritos($nombre: string, $fanout: int, $first: int) {
+        producto as var(func: eq(nombre, $nombre), first: 1) @filter(type(Producto)) {
+            usuarios as ~tiene_favoritos (first: $fanout)
+        }
+        var(func: uid(usuarios)) {
+            otros as tiene_favoritos (first: $fanout) @filter(NOT uid(producto))
+        }
+        var(func: uid(otros)) {
+            veces as count(~tiene_favoritos @filter(uid(usuarios)))
+        }
+        productos(func: uid(veces), orderdesc: val(veces), first: $first) {
+            uid
+            nombre
+            precio
+            veces: val(veces)
+        }
+    }
+    """,
+
+    'registrar_compra': """
+    query registrar_compra($username: string, $nombre: string) {
+        u as var(func: eq(username, $username), first: 1) @filter(type(User))
+        p as var(func: eq(nombre, $nombre), first: 1) @filter(type(Producto))
+
+        usuario(func: uid(u)) {
+            uid
+            comprado: count(ha_comprado @filter(uid(p)))
+        }
+        producto(func: uid(p)) {
+            uid
+        }
+    }
+    """,
+
+    'registrar_devolucion': """
+    query registrar_devolucion($username: string, $nombre: string) {
+        u as var(func: eq(username, $username), first: 1) @filter(type(User))
+        p as var(func: eq(nombre, $nombre), first: 1) @filter(type(Producto))
+
+        usuario(func: uid(u)) {
+            uid
+        }
+        producto(func: uid(p)) {
+            uid
+        }
+    }
+    """,
+}
+
+
+# Queries por lote de usernames. DQL no acepta una lista como $variable, así que la lista
+# se pone en el texto como JSON (que escapa las comillas) en el lugar de {usernames}.
+QUERIES_LOTE = {
+    'search_user_lote': """
+    {{
+        usuarios(func: eq(username, {usernames})) @filter(type(User)) {{
+            username
+            email
+            phone
+            birthdate
+            created_at
+            ha_comprado {{
+                nombre
+                precio
+            }}
+            tiene_favoritos {{
+                nombre
+                precio
+            }}
+            hizo_devolucion {{
+                motivo
+                De_producto {{
+                    nombre
+                    precio
+                }}
+            }}
+        }}
+    }}
+    """,
+
+    'favoritos_usuario_lote': """
+    {{
+        usuarios(func: eq(username, {usernames})) @filter(type(User)) {{
+            username
+            tiene_favoritos @filter(type(Producto)) {{
+                nombre
+                precio
+                descripcion
+                stock
+            }}
+        }}
+    }}
+    """,
+
+    'devoluciones_usuario_lote': """
+    {{
+        usuarios(func: eq(username, {usernames})) @filter(type(User)) {{
+            username
+            hizo_devolucion @filter(type(devolucion)) {{
+                motivo
+                De_producto @filter(type(Producto)) {{
+                    nombre
+                    precio
+                }}
+            }}
+        }}
+    }}
+    """,
+}
+
+
+# Corre la query registrada `nombre` con sus variables (i.e. {'$username': 'user_1'}) y
+# regresa el JSON ya decodificado.
+def query(txn, nombre, variables=None):
+    res = metricas.llamar('query', nombre, txn.query, QUERIES[nombre], variables=variables)
+    return metricas.decodificar(nombre, res)
+
+
+# Corre una query de QUERIES_LOTE para los usernames dados y regresa los nodos de `usuarios`.
+def query_lote(txn, nombre, usernames):
+    texto = QUERIES_LOTE[nombre].format(usernames=json.dumps(list(usernames)))
+    res = metricas.llamar('query', nombre, txn.query, texto)
+    return metricas.decodificar(nombre, res).get('usuarios', [])
+
+
+# Igual que query() pero para upserts (query + mutaciones en un request). `texto` permite
+# mandar una query armada para un lote; si no se da se usa la registrada como `nombre`.
+def upsert(txn, nombre, variables, mutaciones, texto=None, commit_now=True):
+    request = txn.create_request(query=texto or QUERIES[nombre], variables=variables,
+                                 mutations=mutaciones, commit_now=commit_now)
+    return metricas.llamar('upsert', nombre, txn.do_request, request, bytes_request=request.ByteSize())
+
+
+# Recorre una query registrada paginada por uid ($first / $after) y regresa los nodos del
+# bloque `bloque` uno por uno. Con `arista` se pagina esa arista del primer nodo del bloque
+# (i.e. los favoritos de un usuario). Todas las páginas se leen en la misma transacción de
+# sólo lectura, así que ven el mismo estado del grafo.
+def paginar(client, nombre, bloque, pagina=10000, variables=None, arista=None):
+    despues = '0x0'
+    txn = client.txn(read_only=True)
+    try:
+        while True:
+            valores = dict(variables or {}, **{'$first': str(pagina), '$after': despues})
+            nodos = query(txn, nombre, valores).get(bloque, [])
+            if arista is not None:
+                nodos = nodos[0].get(arista, []) if nodos else []
+            yield from nodos
+            if len(nodos) < pagina:
+                return
+            despues = nodos[-1]['uid']
+    finally:
+        txn.discard()
+
+
+# Tiempo acumulado por query (y upsert) según el histograma dgraph_cliente_segundos de
+# metricas: número de llamadas, total y máximo. Ordenadas de la que más tiempo acumula a
+# la que menos.
+def estadisticas_queries():
+    datos = {}
+    for etiquetas, total, suma, maximo in metricas.registro.resumen('dgraph_cliente_segundos'):
+        if etiquetas['operacion'] not in ('query', 'upsert'):
+            continue
+        llamadas, acumulado, mayor = datos.get(etiquetas['plantilla'], (0, 0.0, 0.0))
+        datos[etiquetas['plantilla']] = (llamadas + total, acumulado + suma, max(mayor, maximo))
+    return [
+        {
+            'query': nombre,
+            'llamadas': llamadas,
+            'total_s': total,
+            'promedio_ms': 1000 * total / llamadas,
+            'max_ms': 1000 * maximo,
+        }
+        for nombre, (llamadas, total, maximo) in sorted(datos.items(), key=lambda d: -d[1][1])
+    ]
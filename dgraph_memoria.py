@@ -0,0 +1,1027 @@
+# Dgraph en memoria para probar model.py sin un servidor: implementa la parte de
+# pydgraph.DgraphClient / Txn que usa el proyecto (query, mutate con blank nodes, upserts
+# con @if, commit, discard, alter y schema {}), con aborts por conflicto y latencia
+# configurable por llamada. Sirve para medir round trips y concurrencia de la carga y de las
+# lecturas en una laptop o en CI.
+#
+# i.e.:
+#   db = DgraphMemoria(latencia=0.002)
+#   client = ClienteMemoria(db)
+#   model.set_schema(client)
+#   model.create_data(client)
+#   print(db.llamadas)
+#
+# El DQL que entiende es el que usan model.py y consultas.py: bloques con func eq / ge / le /
+# gt / lt / type / has / uid / anyoftext / alloftext, @filter con AND / OR / NOT, first /
+# offset / after / orderasc / orderdesc, aliases, variables de uid y de valor (`x as ...`,
+# uid(x), val(x)), count(pred), count(uid) y aristas reversas (~pred).
+#
+# Diferencias con Dgraph: las lecturas ven el último estado confirmado (no un snapshot del
+# inicio de la transacción) y una transacción no ve sus propias escrituras antes del commit.
+# Los conflictos se detectan por (uid, predicado) escritos y por (predicado, valor) de los
+# predicados con @upsert, como en Dgraph.
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import pydgraph
+from pydgraph.proto import api_pb2 as api
+
+import esquema
+
+
+TOKEN = re.compile(r'''
+    \s*(?:
+        (?P<cadena>"(?:[^"\\]|\\.)*")
+      | (?P<uid>0x[0-9a-fA-F]+)
+      | (?P<numero>-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?)
+      | (?P<variable>\$\w+)
+      | (?P<nombre>~?[A-Za-z_][\w.]*)
+      | (?P<simbolo>[{}()\[\]:,@=!+\-*/])
+    )''', re.X)
+NQUAD = re.compile(r'''
+    \s*(?P<sujeto><[^>]+>|_:\S+|uid\(\w+\))
+    \s+(?P<predicado><[^>]+>|\*)
+    \s+(?P<objeto><[^>]+>|_:\S+|uid\(\w+\)|\*|"(?:[^"\\]|\\.)*"(?:\^\^<[^>]+>)?(?:@\w+)?)
+    \s*\.\s*$''', re.X)
+PALABRA = re.compile(r'\w+')
+
+
+def _uid(n):
+    return hex(n)
+
+
+def _tokens_texto(texto):
+    return set(PALABRA.findall(str(texto).lower()))
+
+
+#Parser de DQL:
+
+def tokenizar(texto):
+    texto = re.sub(r'#[^\n]*', '', texto)
+    tokens = []
+    pos = 0
+    while True:
+        m = TOKEN.match(texto, pos)
+        if not m or m.end() == pos:
+            break
+        tipo = m.lastgroup
+        tokens.append((tipo, m.group(tipo)))
+        pos = m.end()
+    if texto[pos:].strip():
+        raise ValueError(f"DQL no soportado cerca de: {texto[pos:pos + 40]!r}")
+    return tokens
+
+
+class Bloque:
+    def __init__(self):
+        self.nombre = None      # nombre del bloque raíz, predicado o función (uid, count, val, math)
+        self.alias = None
+        self.var = None         # `x as ...`
+        self.args = {}          # func, first, offset, after, orderasc, orderdesc
+        self.filtro = None
+        self.groupby = None
+        self.campos = []
+        self.tipo = 'arista'    # raiz, arista, uid, count, val, math
+        self.arg = None         # count(pred) / val(x) / math(expr)
+
+
+class Parser:
+    def __init__(self, texto):
+        self.tokens = tokenizar(texto)
+        self.pos = 0
+
+    def ver(self, desplazamiento=0):
+        i = self.pos + desplazamiento
+        return self.tokens[i] if i < len(self.tokens) else (None, None)
+
+    def es(self, valor, desplazamiento=0):
+        return self.ver(desplazamiento)[1] == valor
+
+    def tomar(self, valor=None):
+        token = self.ver()
+        if token[0] is None or (valor is not None and token[1] != valor):
+            raise ValueError(f"DQL: se esperaba {valor!r} y llegó {token[1]!r}")
+        self.pos += 1
+        return token
+
+    def query(self):
+        declaraciones = {}
+        if self.es('query'):
+            self.tomar('query')
+            if self.ver()[0] == 'nombre':
+                self.tomar()
+            if self.es('('):
+                self.tomar('(')
+                while not self.es(')'):
+                    variable = self.tomar()[1]
+                    self.tomar(':')
+                    tipo = self.tomar()[1]
+                    if self.es('!'):
+                        self.tomar('!')
+                    defecto = None
+                    if self.es('='):
+                        self.tomar('=')
+                        defecto = self.valor()
+                    declaraciones[variable] = (tipo, defecto)
+                    if self.es(','):
+                        self.tomar(',')
+                self.tomar(')')
+        self.tomar('{')
+        bloques = []
+        while not self.es('}'):
+            bloques.append(self.bloque_raiz())
+        self.tomar('}')
+        return declaraciones, bloques
+
+    def bloque_raiz(self):
+        bloque = Bloque()
+        bloque.tipo = 'raiz'
+        if self.es('as', 1):
+            bloque.var = self.tomar()[1]
+            self.tomar('as')
+        bloque.nombre = self.tomar()[1]
+        self.argumentos_y_directivas(bloque)
+        if self.es('{'):
+            bloque.campos = self.campos()
+        return bloque
+
+    def argumentos_y_directivas(self, bloque):
+        while self.es('(') or self.es('@'):
+            if self.es('('):
+                self.tomar('(')
+                while not self.es(')'):
+                    llave = self.tomar()[1]
+                    self.tomar(':')
+                    bloque.args[llave] = self.funcion() if llave == 'func' else self.valor()
+                    if self.es(','):
+                        self.tomar(',')
+                self.tomar(')')
+            else:
+                self.tomar('@')
+                directiva = self.tomar()[1]
+                if directiva == 'filter':
+                    self.tomar('(')
+                    bloque.filtro = self.expresion()
+                    self.tomar(')')
+                elif directiva == 'groupby':
+                    self.tomar('(')
+                    bloque.groupby = [self.tomar()[1]]
+                    while self.es(','):
+                        self.tomar(',')
+                        bloque.groupby.append(self.tomar()[1])
+                    self.tomar(')')
+                else:
+                    raise ValueError(f"Directiva no soportada: @{directiva}")
+
+    def campos(self):
+        self.tomar('{')
+        campos = []
+        while not self.es('}'):
+            campos.append(self.campo())
+        self.tomar('}')
+        return campos
+
+    def campo(self):
+        campo = Bloque()
+        if self.es('as', 1):
+            campo.var = self.tomar()[1]
+            self.tomar('as')
+        if self.es(':', 1):
+            campo.alias = self.tomar()[1]
+            self.tomar(':')
+        nombre = self.tomar()[1]
+        campo.nombre = nombre
+        if nombre == 'uid' and not self.es('('):
+            campo.tipo = 'uid'
+        elif nombre == 'count' and self.es('('):
+            campo.tipo = 'count'
+            self.tomar('(')
+            contado = Bloque()
+            contado.nombre = self.tomar()[1]
+            self.argumentos_y_directivas(contado)
+            campo.arg = contado
+            self.tomar(')')
+        elif nombre == 'val' and self.es('('):
+            campo.tipo = 'val'
+            self.tomar('(')
+            campo.arg = self.tomar()[1]
+            self.tomar(')')
+        elif nombre == 'math' and self.es('('):
+            campo.tipo = 'math'
+            self.tomar('(')
+            campo.arg = self.aritmetica()
+            self.tomar(')')
+        else:
+            self.argumentos_y_directivas(campo)
+            if self.es('{'):
+                campo.campos = self.campos()
+        return campo
+
+    # math(): números, variables de valor, + - * / y paréntesis.
+    def aritmetica(self):
+        izquierda = self.termino()
+        while self.es('+') or self.es('-'):
+            operador = self.tomar()[1]
+            izquierda = (operador, izquierda, self.termino())
+        return izquierda
+
+    def termino(self):
+        izquierda = self.factor()
+        while self.es('*') or self.es('/'):
+            operador = self.tomar()[1]
+            izquierda = (operador, izquierda, self.factor())
+        return izquierda
+
+    def factor(self):
+        if self.es('('):
+            self.tomar('(')
+            valor = self.aritmetica()
+            self.tomar(')')
+            return valor
+        tipo, valor = self.tomar()
+        if tipo == 'numero':
+            return ('numero', float(valor))
+        return ('var', valor)
+
+    def expresion(self):
+        izquierda = self.conjuncion()
+        while self.es('OR') or self.es('or'):
+            self.tomar()
+            izquierda = ('OR', izquierda, self.conjuncion())
+        return izquierda
+
+    def conjuncion(self):
+        izquierda = self.negacion()
+        while self.es('AND') or self.es('and'):
+            self.tomar()
+            izquierda = ('AND', izquierda, self.negacion())
+        return izquierda
+
+    def negacion(self):
+        if self.es('NOT') or self.es('not'):
+            self.tomar()
+            return ('NOT', self.negacion())
+        if self.es('('):
+            self.tomar('(')
+            valor = self.expresion()
+            self.tomar(')')
+            return valor
+        return self.funcion()
+
+    def funcion(self):
+        nombre = self.tomar()[1]
+        self.tomar('(')
+        args = []
+        while not self.es(')'):
+            if (self.es('count') or self.es('len')) and self.es('(', 1):
+                envoltura = self.tomar()[1]
+                self.tomar('(')
+                args.append((envoltura, self.tomar()[1]))
+                self.tomar(')')
+            else:
+                args.append(self.valor())
+            if self.es(','):
+                self.tomar(',')
+        self.tomar(')')
+        return ('func', nombre, args)
+
+    def valor(self):
+        if self.es('['):
+            self.tomar('[')
+            valores = []
+            while not self.es(']'):
+                valores.append(self.valor())
+                if self.es(','):
+                    self.tomar(',')
+            self.tomar(']')
+            return ('lista', valores)
+        if self.es('val') and self.es('(', 1):
+            self.tomar('val')
+            self.tomar('(')
+            variable = self.tomar()[1]
+            self.tomar(')')
+            return ('val', variable)
+        tipo, valor = self.tomar()
+        if tipo == 'cadena':
+            return ('literal', json.loads(valor))
+        if tipo == 'numero':
+            return ('literal', float(valor) if any(c in valor for c in '.eE') else int(valor))
+        return (tipo, valor)
+
+
+#Almacenamiento:
+
+class DgraphMemoria:
+    def __init__(self, latencia=0.0, jitter=0.0, prob_abort=0.0, seed=None):
+        self.latencia = latencia
+        self.jitter = jitter
+        self.prob_abort = prob_abort
+        self.llamadas = Counter()
+        self._random = random.Random(seed)
+        self._lock = threading.RLock()
+        self._executor = None
+        # Como en Dgraph, los uids no se reinician con drop_all: un uid viejo nunca es de un nodo nuevo.
+        self._uids = itertools.count(1)
+        self.drop_all()
+
+    def drop_all(self):
+        with self._lock:
+            self.nodos = {}             # uid -> {predicado: valor | set(uids)}
+            self.reversas = {}          # predicado -> {uid destino: set(uids origen)}
+            self.indice = {}            # predicado -> {valor: set(uids)}
+            self.con = {}               # predicado -> set(uids que lo tienen)
+            self.predicados = {}        # predicado -> (definición normalizada, línea)
+            self.tipos = {}             # tipo -> (campos, texto)
+            self.escrituras = {}        # llave de conflicto -> commit ts
+            self.ts = 0
+
+    # Latencia de red simulada, fuera del lock para que las llamadas concurrentes se traslapen.
+    def esperar(self, operacion):
+        self.llamadas[operacion] += 1
+        if self.latencia or self.jitter:
+            time.sleep(max(0.0, self.latencia + self._random.uniform(-self.jitter, self.jitter)))
+
+    # Hilos que resuelven las async_query, como los de gRPC en el cliente real.
+    def executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix='dgraph_memoria')
+            return self._executor
+
+    def nuevo_uid(self):
+        with self._lock:
+            return next(self._uids)
+
+    def es_arista(self, predicado):
+        definicion = self.predicados.get(predicado.lstrip('~'))
+        return definicion is not None and definicion[0][0] == 'uid'
+
+    def es_upsert(self, predicado):
+        definicion = self.predicados.get(predicado)
+        return definicion is not None and definicion[0][4]
+
+    def alterar(self, operacion):
+        with self._lock:
+            if operacion.drop_all:
+                self.drop_all()
+                return
+            if operacion.drop_attr:
+                for uid in list(self.con.get(operacion.drop_attr, ())):
+                    self._quitar(uid, operacion.drop_attr, None)
+                self.predicados.pop(operacion.drop_attr, None)
+                return
+            predicados, tipos = esquema.parsear(operacion.schema)
+            self.predicados.update(predicados)
+            self.tipos.update(tipos)
+
+    def schema(self):
+        with self._lock:
+            predicados = []
+            for nombre, ((tipo, lista, tokenizer, reverse, upsert, count, lang), _) in sorted(self.predicados.items()):
+                p = {'predicate': nombre, 'type': tipo}
+                if tokenizer:
+                    p.update(index=True, tokenizer=list(tokenizer))
+                for llave, valor in (('list', lista), ('reverse', reverse), ('upsert', upsert), ('count', count), ('lang', lang)):
+                    if valor:
+                        p[llave] = True
+                predicados.append(p)
+            tipos = [{'name': nombre, 'fields': [{'name': f} for f in campos]}
+                     for nombre, (campos, _) in sorted(self.tipos.items())]
+        return {'schema': predicados, 'types': tipos}
+
+    # Aplica las escrituras de una transacción si nadie escribió sus llaves después de que empezó.
+    def confirmar(self, inicio_ts, escrituras):
+        with self._lock:
+            llaves = {llave for op in escrituras for llave in self._llaves(op)}
+            if any(self.escrituras.get(llave, 0) > inicio_ts for llave in llaves):
+                raise pydgraph.AbortedError()
+            if self.prob_abort and self._random.random() < self.prob_abort:
+                raise pydgraph.AbortedError()
+            self.ts += 1
+            for llave in llaves:
+                self.escrituras[llave] = self.ts
+            for op in escrituras:
+                self._aplicar(op)
+            return self.ts
+
+    def _llaves(self, op):
+        accion, uid, predicado, valor = op
+        if accion == 'borrar_nodo':
+            return [(uid, p) for p in self.nodos.get(uid, {})]
+        llaves = [(uid, predicado)]
+        if accion == 'set' and self.es_upsert(predicado):
+            llaves.append((predicado, valor))
+        return llaves
+
+    def _aplicar(self, op):
+        accion, uid, predicado, valor = op
+        if accion == 'borrar_nodo':
+            for p in list(self.nodos.get(uid, {})):
+                self._quitar(uid, p, None)
+            return
+        if accion == 'borrar':
+            self._quitar(uid, predicado, valor)
+            return
+        nodo = self.nodos.setdefault(uid, {})
+        self.con.setdefault(predicado, set()).add(uid)
+        if isinstance(valor, Arista):
+            nodo.setdefault(predicado, set()).add(valor.uid)
+            self.reversas.setdefault(predicado, {}).setdefault(valor.uid, set()).add(uid)
+        elif predicado == 'dgraph.type':
+            nodo.setdefault(predicado, set()).add(valor)
+            self.indice.setdefault(predicado, {}).setdefault(valor, set()).add(uid)
+        else:
+            anterior = nodo.get(predicado)
+            if anterior is not None:
+                self.indice[predicado][anterior].discard(uid)
+            nodo[predicado] = valor
+            self.indice.setdefault(predicado, {}).setdefault(valor, set()).add(uid)
+
+    # `valor` None borra todos los valores del predicado.
+    def _quitar(self, uid, predicado, valor):
+        nodo = self.nodos.get(uid)
+        if nodo is None or predicado not in nodo:
+            return
+        actual = nodo[predicado]
+        if isinstance(actual, set):
+            quitar = set(actual) if valor is None else {valor.uid if isinstance(valor, Arista) else valor}
+            for v in quitar & actual:
+                actual.discard(v)
+                if predicado == 'dgraph.type':
+                    self.indice[predicado][v].discard(uid)
+                else:
+                    self.reversas[predicado][v].discard(uid)
+            if actual:
+                return
+        elif valor is not None and actual != valor:
+            return
+        else:
+            self.indice[predicado][actual].discard(uid)
+        del nodo[predicado]
+        self.con[predicado].discard(uid)
+
+
+class Arista:
+    __slots__ = ('uid',)
+
+    def __init__(self, uid):
+        self.uid = uid
+
+
+#Evaluación de queries:
+
+# Tokenizers que sirven a cada función en la raíz; None = cualquier índice.
+DESIGUALDAD = {'exact', 'int', 'float', 'year', 'month', 'day', 'hour'}
+TOKENIZERS_RAIZ = {
+    'eq': None, 'ge': DESIGUALDAD, 'le': DESIGUALDAD, 'gt': DESIGUALDAD, 'lt': DESIGUALDAD,
+    'anyoftext': {'fulltext'}, 'alloftext': {'fulltext'},
+    'anyofterms': {'term'}, 'allofterms': {'term'},
+}
+
+
+class Evaluador:
+    def __init__(self, db, variables_gql):
+        self.db = db
+        self.gql = variables_gql
+        self.uids = {}      # variable -> set(uids)
+        self.valores = {}   # variable -> {uid: valor}
+
+    def correr(self, bloques):
+        resultado = {}
+        pendientes = list(bloques)
+        while pendientes:
+            listos = [b for b in pendientes if self._dependencias(b) <= self._definidas()]
+            if not listos:
+                raise ValueError(f"Variables sin definir en: {[b.nombre for b in pendientes]}")
+            for bloque in listos:
+                pendientes.remove(bloque)
+                salida = self.bloque_raiz(bloque)
+                if bloque.nombre != 'var':
+                    resultado[bloque.nombre] = salida
+        return resultado
+
+    def _definidas(self):
+        return set(self.uids) | set(self.valores)
+
+    def _dependencias(self, bloque):
+        usadas = set()
+        definidas = set()
+
+        def recorrer_expr(expr):
+            if not isinstance(expr, tuple):
+                return
+            if expr[0] == 'func':
+                if expr[1] == 'uid':
+                    usadas.update(a[1] for a in expr[2] if a[0] == 'nombre')
+                for a in expr[2]:
+                    if a[0] in ('len', 'val'):
+                        usadas.add(a[1])
+            elif expr[0] in ('val', 'var'):
+                usadas.add(expr[1])
+            else:
+                for parte in expr[1:]:
+                    recorrer_expr(parte)
+
+        def recorrer(b):
+            if b.var:
+                definidas.add(b.var)
+            for valor in b.args.values():
+                recorrer_expr(valor)
+            recorrer_expr(b.filtro)
+            if b.tipo == 'val':
+                usadas.add(b.arg)
+            elif b.tipo == 'math':
+                recorrer_expr(b.arg)
+            elif b.tipo == 'count':
+                recorrer(b.arg)
+            for campo in b.campos:
+                recorrer(campo)
+
+        recorrer(bloque)
+        return usadas - definidas
+
+    def valor(self, arg):
+        tipo, valor = arg
+        if tipo == 'variable':
+            return self.gql.get(valor)
+        if tipo == 'lista':
+            return [self.valor(v) for v in valor]
+        return valor
+
+    # Como en Dgraph, las variables de los campos quedan definidas aunque no se evalúe ningún
+    # nodo (i.e. una arista vacía), así los bloques que dependen de ellas corren vacíos.
+    def declarar(self, campos):
+        for campo in campos:
+            if campo.var:
+                if campo.tipo in ('count', 'val', 'math') or not (self.db.es_arista(campo.nombre)
+                                                                  or campo.nombre.startswith('~')):
+                    self.valores.setdefault(campo.var, {})
+                else:
+                    self.uids.setdefault(campo.var, set())
+            self.declarar(campo.campos)
+
+    def bloque_raiz(self, bloque):
+        self.declarar(bloque.campos)
+        uids = self.funcion_raiz(bloque.args['func'])
+        uids = self.paginar(bloque, self.filtrar(sorted(uids), bloque.filtro))
+        if bloque.var:
+            self.uids[bloque.var] = set(uids)
+        if bloque.groupby:
+            return [{'@groupby': self.agrupar(uids, bloque)}]
+        if any(c.tipo == 'count' and c.arg.nombre == 'uid' for c in bloque.campos):
+            campo = next(c for c in bloque.campos if c.tipo == 'count' and c.arg.nombre == 'uid')
+            return [{campo.alias or 'count': len(uids)}]
+        return self.campos(uids, bloque.campos)
+
+    def funcion_raiz(self, func):
+        _, nombre, args = func
+        self.revisar_indice(nombre, args)
+        if nombre == 'uid':
+            return self.uids_de(args)
+        if nombre == 'type':
+            return set(self.db.indice.get('dgraph.type', {}).get(self.valor(args[0]), ()))
+        if nombre == 'has':
+            return set(self.db.con.get(args[0][1], ()))
+        if nombre == 'eq' and args[0][0] == 'nombre':
+            valores = self.valor(args[1])
+            indice = self.db.indice.get(args[0][1], {})
+            uids = set()
+            for valor in valores if isinstance(valores, list) else [valores]:
+                for llave in (valor, _numero(valor)):
+                    uids |= indice.get(llave, set())
+            return uids
+        candidatos = set(self.db.nodos)
+        if args and args[0][0] == 'nombre':
+            candidatos = set(self.db.con.get(args[0][1], ()))
+        elif args and args[0][0] == 'count':
+            candidatos = set(self.db.nodos) if self._cumple_con_cero(func) else set(self.db.con.get(args[0][1], ()))
+        return {uid for uid in candidatos if self.cumple(uid, func)}
+
+    # Como Dgraph, en la raíz las comparaciones y las búsquedas de texto necesitan un índice
+    # del predicado que sirva para esa función (y count() necesita @count).
+    def revisar_indice(self, nombre, args):
+        if nombre not in TOKENIZERS_RAIZ or not args or args[0][0] == 'val':
+            return
+        tipo, predicado = args[0]
+        definicion = self.db.predicados.get(predicado.lstrip('~'))
+        if tipo == 'count':
+            if definicion is None or not definicion[0][5]:
+                raise ValueError(f"Need @count directive in schema for attr: {predicado.lstrip('~')}")
+            return
+        tokenizers = definicion[0][2] if definicion else ()
+        if not tokenizers:
+            raise ValueError(f"Predicate {predicado} is not indexed")
+        validos = TOKENIZERS_RAIZ[nombre]
+        if validos is not None and not set(tokenizers) & validos:
+            raise ValueError(f"Attribute {predicado} does not have a valid tokenizer for {nombre}")
+
+    def _cumple_con_cero(self, func):
+        _, nombre, args = func
+        return _comparar(nombre, 0, self.valor(args[1]))
+
+    def uids_de(self, args):
+        uids = set()
+        for tipo, valor in args:
+            if tipo == 'uid':
+                uids.add(int(valor, 16))
+            elif tipo == 'variable':
+                uids.add(int(self.gql[valor], 16))
+            elif valor in self.uids:
+                uids |= self.uids[valor]
+            else:
+                uids |= set(self.valores.get(valor, {}))
+        return uids
+
+    def filtrar(self, uids, filtro):
+        if filtro is None:
+            return uids
+        return [uid for uid in uids if self.cumple(uid, filtro)]
+
+    def cumple(self, uid, expr):
+        if expr[0] == 'AND':
+            return self.cumple(uid, expr[1]) and self.cumple(uid, expr[2])
+        if expr[0] == 'OR':
+            return self.cumple(uid, expr[1]) or self.cumple(uid, expr[2])
+        if expr[0] == 'NOT':
+            return not self.cumple(uid, expr[1])
+        _, nombre, args = expr
+        nodo = self.db.nodos.get(uid, {})
+        if nombre == 'uid':
+            return uid in self.uids_de(args)
+        if nombre == 'type':
+            return self.valor(args[0]) in nodo.get('dgraph.type', ())
+        if nombre == 'has':
+            return args[0][1] in nodo
+        if nombre in ('anyoftext', 'alloftext', 'anyofterms', 'allofterms'):
+            buscadas = _tokens_texto(self.valor(args[1]))
+            tokens = _tokens_texto(nodo.get(args[0][1], ''))
+            if nombre.startswith('any'):
+                return bool(buscadas & tokens)
+            return bool(buscadas) and buscadas <= tokens
+        if nombre in ('eq', 'ge', 'le', 'gt', 'lt'):
+            tipo, predicado = args[0]
+            if tipo == 'count':
+                actual = len(self.db.nodos.get(uid, {}).get(predicado, ())) if not predicado.startswith('~') \
+                    else len(self.db.reversas.get(predicado[1:], {}).get(uid, ()))
+            elif tipo == 'val':
+                actual = self.valores.get(predicado, {}).get(uid)
+            else:
+                actual = nodo.get(predicado)
+            if actual is None:
+                return False
+            esperado = self.valor(args[1])
+            if isinstance(esperado, list):
+                return any(_comparar(nombre, actual, e) for e in esperado)
+            return _comparar(nombre, actual, esperado)
+        raise ValueError(f"Función no soportada: {nombre}")
+
+    def paginar(self, bloque, uids):
+        args = bloque.args
+        for llave, reverso in (('orderasc', False), ('orderdesc', True)):
+            if llave in args:
+                clave = args[llave]
+                if clave[0] == 'val':
+                    valores = self.valores.get(clave[1], {})
+                    obtener = valores.get
+                else:
+                    obtener = lambda uid, p=clave[1]: self.db.nodos.get(uid, {}).get(p)
+                con_valor = [uid for uid in uids if obtener(uid) is not None]
+                sin_valor = [uid for uid in uids if obtener(uid) is None]
+                uids = sorted(con_valor, key=obtener, reverse=reverso) + sin_valor
+        if 'after' in args:
+            despues = int(str(self.valor(args['after'])), 16)
+            uids = [uid for uid in uids if uid > despues]
+        if 'offset' in args:
+            uids = uids[int(self.valor(args['offset'])):]
+        if 'first' in args:
+            uids = uids[:int(self.valor(args['first']))]
+        return uids
+
+    def hijos(self, uid, campo):
+        if campo.nombre.startswith('~'):
+            hijos = self.db.reversas.get(campo.nombre[1:], {}).get(uid, ())
+        else:
+            hijos = self.db.nodos.get(uid, {}).get(campo.nombre, ())
+        return self.paginar(campo, self.filtrar(sorted(hijos), campo.filtro))
+
+    def campos(self, uids, campos):
+        return [salida for salida in (self.nodo(uid, campos) for uid in uids) if salida]
+
+    def nodo(self, uid, campos):
+        salida = {}
+        nodo = self.db.nodos.get(uid, {})
+        for campo in campos:
+            nombre = campo.alias or campo.nombre
+            if campo.tipo == 'uid':
+                salida[nombre] = _uid(uid)
+            elif campo.tipo == 'count':
+                contado = campo.arg
+                n = len(self.hijos(uid, contado))
+                if campo.var:
+                    self.valores.setdefault(campo.var, {})[uid] = n
+                salida[campo.alias or f'count({contado.nombre})'] = n
+            elif campo.tipo == 'val':
+                valor = self.valores.get(campo.arg, {}).get(uid)
+                if valor is not None:
+                    salida[campo.alias or f'val({campo.arg})'] = valor
+            elif campo.tipo == 'math':
+                valor = self.math(uid, campo.arg)
+                if campo.var:
+                    self.valores.setdefault(campo.var, {})[uid] = valor
+                if campo.alias:
+                    salida[campo.alias] = valor
+            elif self.db.es_arista(campo.nombre) or isinstance(nodo.get(campo.nombre), set) and campo.nombre != 'dgraph.type' \
+                    or campo.nombre.startswith('~'):
+                hijos = self.hijos(uid, campo)
+                if campo.var:
+                    self.uids.setdefault(campo.var, set()).update(hijos)
+                if campo.campos:
+                    lista = self.campos(hijos, campo.campos)
+                    if lista:
+                        salida[nombre] = lista
+            elif campo.nombre in nodo:
+                valor = nodo[campo.nombre]
+                if campo.var:
+                    self.valores.setdefault(campo.var, {})[uid] = valor
+                salida[nombre] = sorted(valor) if isinstance(valor, set) else valor
+        return salida
+
+    def math(self, uid, expr):
+        if expr[0] == 'numero':
+            return expr[1]
+        if expr[0] == 'var':
+            return self.valores.get(expr[1], {}).get(uid, 0)
+        operador, a, b = expr
+        a, b = self.math(uid, a), self.math(uid, b)
+        return {'+': a + b, '-': a - b, '*': a * b, '/': a / b if b else 0.0}[operador]
+
+    def agrupar(self, uids, bloque):
+        # Con un predicado de lista el nodo cuenta en el grupo de cada valor, como en Dgraph.
+        grupos = {}
+        for uid in uids:
+            nodo = self.db.nodos.get(uid, {})
+            valores = []
+            for predicado in bloque.groupby:
+                valor = nodo.get(predicado)
+                if isinstance(valor, set):
+                    valores.append([_uid(v) for v in sorted(valor)] if predicado != 'dgraph.type' else sorted(valor))
+                else:
+                    valores.append([] if valor is None else [valor])
+            for llave in itertools.product(*valores):
+                grupos.setdefault(llave, []).append(uid)
+        salida = []
+        for llave, miembros in grupos.items():
+            grupo = dict(zip(bloque.groupby, llave))
+            for campo in bloque.campos:
+                if campo.tipo == 'count':
+                    grupo[campo.alias or 'count'] = len(miembros)
+            salida.append(grupo)
+        return salida
+
+    # Condición @if de una mutación: len(x) de variables y AND / OR / NOT.
+    def condicion(self, texto):
+        parser = Parser(texto.strip()[len('@if'):])
+        parser.tomar('(')
+        expr = parser.expresion()
+        return self._condicion(expr)
+
+    def _condicion(self, expr):
+        if expr[0] == 'AND':
+            return self._condicion(expr[1]) and self._condicion(expr[2])
+        if expr[0] == 'OR':
+            return self._condicion(expr[1]) or self._condicion(expr[2])
+        if expr[0] == 'NOT':
+            return not self._condicion(expr[1])
+        _, nombre, args = expr
+        variable = args[0][1]
+        actual = len(self.uids.get(variable, ()))
+        return _comparar(nombre, actual, self.valor(args[1]))
+
+
+def _numero(valor):
+    try:
+        return float(valor)
+    except (TypeError, ValueError):
+        return None
+
+
+def _comparar(funcion, actual, esperado):
+    if isinstance(actual, (int, float)) and not isinstance(esperado, (int, float)):
+        esperado = _numero(esperado)
+        if esperado is None:
+            return False
+    elif isinstance(actual, str) and not isinstance(esperado, str):
+        esperado = str(esperado)
+    if funcion == 'eq':
+        return actual == esperado
+    if funcion == 'ge':
+        return actual >= esperado
+    if funcion == 'le':
+        return actual <= esperado
+    if funcion == 'gt':
+        return actual > esperado
+    return actual < esperado
+
+
+#Cliente y transacciones:
+
+class ClienteMemoria:
+    def __init__(self, db=None):
+        self.db = db if db is not None else DgraphMemoria()
+
+    def txn(self, read_only=False, best_effort=False, **kwargs):
+        return TxnMemoria(self.db, read_only)
+
+    def alter(self, operacion, *args, **kwargs):
+        self.db.esperar('alter')
+        self.db.alterar(operacion)
+        return api.Payload()
+
+    def check_version(self, *args, **kwargs):
+        self.db.esperar('check_version')
+        return 'memoria'
+
+    def close(self):
+        pass
+
+
+class TxnMemoria:
+    def __init__(self, db, read_only=False):
+        self.db = db
+        self.read_only = read_only
+        self.inicio_ts = db.ts
+        self.escrituras = []
+        self.terminada = False
+
+    create_mutation = pydgraph.Txn.create_mutation
+
+    def create_request(self, query=None, variables=None, mutations=None, commit_now=None, resp_format='JSON'):
+        request = api.Request(read_only=self.read_only)
+        if query:
+            request.query = query
+        if variables:
+            for llave, valor in variables.items():
+                request.vars[llave] = valor
+        if mutations:
+            request.mutations.extend(mutations)
+        if commit_now:
+            request.commit_now = True
+        return request
+
+    def query(self, query, variables=None, **kwargs):
+        return self.do_request(self.create_request(query=query, variables=variables))
+
+    def async_query(self, query, variables=None, **kwargs):
+        return self.db.executor().submit(self.query, query, variables)
+
+    def mutate(self, mutation=None, set_obj=None, del_obj=None, set_nquads=None, del_nquads=None,
+               cond=None, commit_now=None, **kwargs):
+        mutation = self.create_mutation(mutation, set_obj, del_obj, set_nquads, del_nquads, cond)
+        return self.do_request(self.create_request(mutations=[mutation], commit_now=commit_now or mutation.commit_now))
+
+    def do_request(self, request, **kwargs):
+        if self.terminada:
+            raise pydgraph.errors.TransactionError('La transacción ya terminó.')
+        if request.mutations and self.read_only:
+            raise pydgraph.errors.TransactionError('Mutación en una transacción de sólo lectura.')
+        self.db.esperar('mutate' if request.mutations else 'query')
+        inicio = time.perf_counter_ns()
+        variables = self._variables(request)
+        evaluador = Evaluador(self.db, variables)
+        data = {}
+        with self.db._lock:
+            if request.query.strip().startswith('schema'):
+                data = self.db.schema()
+            elif request.query:
+                declaraciones, bloques = Parser(request.query).query()
+                for variable, (tipo, defecto) in declaraciones.items():
+                    if variable not in variables and defecto is not None:
+                        variables[variable] = evaluador.valor(defecto)
+                data = evaluador.correr(bloques)
+            uids = {}
+            for mutation in request.mutations:
+                if mutation.cond and not evaluador.condicion(mutation.cond):
+                    continue
+                self._mutar(mutation, evaluador, uids)
+        procesado = time.perf_counter_ns()
+        respuesta = api.Response(json=json.dumps(data).encode('utf-8'))
+        for blank, uid in uids.items():
+            respuesta.uids[blank] = _uid(uid)
+        respuesta.latency.processing_ns = procesado - inicio
+        respuesta.latency.encoding_ns = time.perf_counter_ns() - procesado
+        respuesta.latency.total_ns = time.perf_counter_ns() - inicio
+        if request.commit_now and request.mutations:
+            self.commit()
+        return respuesta
+
+    def _variables(self, request):
+        variables = dict(request.vars)
+        for llave, valor in variables.items():
+            numero = _numero(valor)
+            if numero is not None and not valor.startswith('0x'):
+                variables[llave] = int(numero) if numero.is_integer() and '.' not in valor and 'e' not in valor.lower() else numero
+        return variables
+
+    def _mutar(self, mutation, evaluador, blanks):
+        def resolver(termino, crear):
+            if termino.startswith('_:'):
+                blank = termino[2:]
+                if blank not in blanks:
+                    blanks[blank] = self.db.nuevo_uid()
+                return [blanks[blank]]
+            if termino.startswith('uid('):
+                uids = sorted(evaluador.uids.get(termino[4:-1], ()))
+                if not uids and crear:
+                    return [self.db.nuevo_uid()]
+                return uids
+            if termino.startswith('<'):
+                termino = termino[1:-1]
+            return [int(termino, 16)]
+
+        if mutation.set_json:
+            for objeto in _lista(json.loads(mutation.set_json)):
+                self._objeto(objeto, resolver)
+        for linea in mutation.set_nquads.decode('utf-8').splitlines():
+            if linea.strip():
+                self._nquad(linea, resolver, borrar=False)
+        if mutation.delete_json:
+            for objeto in _lista(json.loads(mutation.delete_json)):
+                for uid in resolver(objeto['uid'], False):
+                    for predicado, valor in objeto.items():
+                        if predicado != 'uid':
+                            self.escrituras.append(('borrar', uid, predicado, None if valor is None else _valor_json(valor, resolver)))
+        for linea in mutation.del_nquads.decode('utf-8').splitlines():
+            if linea.strip():
+                self._nquad(linea, resolver, borrar=True)
+
+    def _objeto(self, objeto, resolver):
+        uid = resolver(objeto['uid'], True)[0] if 'uid' in objeto else self.db.nuevo_uid()
+        for predicado, valor in objeto.items():
+            if predicado == 'uid':
+                continue
+            for v in _lista(valor):
+                if isinstance(v, dict):
+                    self.escrituras.append(('set', uid, predicado, Arista(self._objeto(v, resolver))))
+                else:
+                    self.escrituras.append(('set', uid, predicado, v))
+        return uid
+
+    def _nquad(self, linea, resolver, borrar):
+        m = NQUAD.match(linea)
+        if not m:
+            raise ValueError(f"N-Quad no soportado: {linea!r}")
+        sujetos = resolver(m.group('sujeto'), not borrar)
+        predicado = m.group('predicado').strip('<>')
+        objeto = m.group('objeto')
+        if objeto == '*':
+            valores = [None]
+        elif objeto.startswith('"'):
+            valores = [_literal(objeto)]
+        else:
+            valores = [Arista(uid) for uid in resolver(objeto, False)]
+        for sujeto in sujetos:
+            if borrar and predicado == '*':
+                self.escrituras.append(('borrar_nodo', sujeto, None, None))
+                continue
+            for valor in valores:
+                self.escrituras.append(('borrar' if borrar else 'set', sujeto, predicado, valor))
+
+    def commit(self):
+        if self.terminada:
+            raise pydgraph.errors.TransactionError('La transacción ya terminó.')
+        self.terminada = True
+        if self.escrituras:
+            self.db.esperar('commit')
+            self.db.confirmar(self.inicio_ts, self.escrituras)
+
+    def discard(self, *args, **kwargs):
+        self.terminada = True
+
+
+def _lista(valor):
+    return valor if isinstance(valor, list) else [valor]
+
+
+def _valor_json(valor, resolver):
+    if isinstance(valor, dict):
+        return Arista(resolver(valor['uid'], False)[0])
+    return valor
+
+
+def _literal(texto):
+    m = re.match(r'("(?:[^"\\]|\\.)*")(?:\^\^<([^>]+)>)?', texto)
+    valor = json.loads(m.group(1))
+    tipo = m.group(2)
+    if tipo in ('xs:int', 'xs:integer'):
+        return int(valor)
+    if tipo in ('xs:float', 'xs:double'):
+        return float(valor)
+    if tipo == 'xs:boolean':
+        return valor == 'true'
+    return valor
@@ -0,0 +1,146 @@
+# Manejo del schema: compara el schema deseado con el que tiene el cluster (query
+# `schema {}`) y sólo manda en el alter los predicados y tipos que cambiaron. Los índices
+# nuevos se construyen en segundo plano (run_in_background) y se espera a que terminen.
+#
+# Después de aplicarlo se guarda un hash del schema en el grafo (predicado version_schema),
+# así un arranque normal sólo lee ese marcador y no hace ningún alter.
+import hashlib
+import re
+import time
+
+import pydgraph
+
+import metricas
+
+
+PREDICADO = re.compile(r'^\s*([\w.~]+)\s*:\s*(\[?)\s*(\w+)\s*\]?\s*(.*?)\s*\.\s*$')
+TIPO = re.compile(r'type\s+(\w+)\s*\{([^}]*)\}', re.S)
+DIRECTIVA = re.compile(r'@(\w+)(?:\(([^)]*)\))?')
+ESPERA_TIMEOUT = 3600
+ESPERA_INTERVALO = 2
+
+
+def huella(schema):
+    return hashlib.sha1(' '.join(schema.split()).encode('utf-8')).hexdigest()
+
+
+# Regresa ({predicado: (definición normalizada, línea original)}, {tipo: (campos, texto)}).
+def parsear(schema):
+    tipos = {}
+    for m in TIPO.finditer(schema):
+        tipos[m.group(1)] = (tuple(sorted(m.group(2).split())), m.group(0))
+    predicados = {}
+    for linea in TIPO.sub('', schema).splitlines():
+        m = PREDICADO.match(linea)
+        if not m:
+            continue
+        nombre, lista, tipo, directivas = m.groups()
+        definicion = {'type': tipo, 'list': bool(lista)}
+        for directiva, argumentos in DIRECTIVA.findall(directivas):
+            if directiva == 'index':
+                definicion['tokenizer'] = tuple(sorted(t.strip() for t in argumentos.split(',')))
+            else:
+                definicion[directiva] = True
+        predicados[nombre] = (_normalizar(definicion), linea.strip())
+    return predicados, tipos
+
+
+def _normalizar(definicion):
+    return (
+        definicion.get('type'),
+        bool(definicion.get('list')),
+        tuple(sorted(definicion.get('tokenizer') or ())),
+        bool(definicion.get('reverse')),
+        bool(definicion.get('upsert')),
+        bool(definicion.get('count')),
+        bool(definicion.get('lang')),
+    )
+
+
+# Schema actual del cluster en el mismo formato que parsear(), sin los predicados dgraph.*.
+def actual(client):
+    txn = client.txn(read_only=True)
+    try:
+        res = metricas.llamar('query', 'schema', txn.query, 'schema {}')
+    finally:
+        txn.discard()
+    data = metricas.decodificar('schema', res)
+    predicados = {
+        p['predicate']: _normalizar(p) for p in data.get('schema', [])
+        if not p['predicate'].startswith('dgraph.')
+    }
+    tipos = {
+        t['name']: tuple(sorted(f['name'] for f in t.get('fields', []))) for t in data.get('types', [])
+        if not t['name'].startswith('dgraph.')
+    }
+    return predicados, tipos
+
+
+# Líneas del schema deseado que no coinciden con el cluster. Lo que sólo existe en el
+# cluster no se toca: un alter nunca borra predicados.
+def diferencias(deseado, cluster):
+    predicados, tipos = deseado
+    predicados_cluster, tipos_cluster = cluster
+    cambios = [linea for nombre, (definicion, linea) in predicados.items()
+               if predicados_cluster.get(nombre) != definicion]
+    cambios += [texto for nombre, (campos, texto) in tipos.items()
+                if tipos_cluster.get(nombre) != campos]
+    return cambios
+
+
+def leer_version(client):
+    txn = client.txn(read_only=True)
+    try:
+        res = metricas.llamar('query', 'version_schema', txn.query,
+                              '{ marcador(func: has(version_schema), first: 1) { version_schema } }')
+        marcadores = metricas.decodificar('version_schema', res).get('marcador', [])
+    finally:
+        txn.discard()
+    return marcadores[0]['version_schema'] if marcadores else None
+
+
+def guardar_version(client, version):
+    txn = client.txn()
+    try:
+        request = txn.create_request(
+            query='{ m as var(func: has(version_schema)) }',
+            mutations=[txn.create_mutation(set_nquads=f'uid(m) <version_schema> "{version}" .')],
+            commit_now=True)
+        metricas.llamar('upsert', 'version_schema', txn.do_request, request)
+    finally:
+        txn.discard()
+
+
+# Mientras se construye un índice en segundo plano el cluster sigue mostrando la definición
+# anterior del predicado, así que se espera hasta que no queden diferencias.
+def esperar(client, deseado, timeout=ESPERA_TIMEOUT, intervalo=ESPERA_INTERVALO):
+    total = len(diferencias(deseado, actual(client)))
+    inicio = time.perf_counter()
+    while True:
+        pendientes = diferencias(deseado, actual(client))
+        if not pendientes:
+            return
+        segundos = time.perf_counter() - inicio
+        print(f"Construyendo índices: {total - len(pendientes)}/{total} listos ({segundos:.0f}s)")
+        if segundos > timeout:
+            raise TimeoutError(f"El schema no terminó de aplicarse en {timeout}s: {pendientes}")
+        time.sleep(intervalo)
+
+
+# Aplica `schema` sólo si cambió desde la última vez (o con `forzar`). Regresa las líneas
+# que se mandaron en el alter.
+def aplicar(client, schema, forzar=False, esperar_indices=True):
+    version = huella(schema)
+    if not forzar and leer_version(client) == version:
+        return []
+
+    deseado = parsear(schema)
+    cambios = diferencias(deseado, actual(client))
+    if cambios:
+        print(f"Aplicando {len(cambios)} cambios de schema.")
+        metricas.llamar('alter', 'schema', client.alter,
+                        pydgraph.Operation(schema='\n'.join(cambios), run_in_background=True))
+        if esperar_indices:
+            esperar(client, deseado)
+    guardar_version(client, version)
+    return cambios
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# Convierte los CSV a archivos RDF comprimidos (.rdf.gz) y un .schema para
+# `dgraph bulk` / `dgraph live`, sin pasar por create_data.
+#
+# i.e.:
+#   python3 exportar_rdf.py --out export
+#   dgraph bulk -f export/ -s export/dgraph.schema
+import argparse
+import gzip
+import json
+import os
+import re
+
+import model
+
+
+# Las etiquetas de blank nodes en RDF no aceptan espacios ni acentos (i.e. categorías
+# como "Camisas Anime"), así que se escapa cada byte fuera de [A-Za-z0-9_] como -XX.
+def etiqueta_rdf(valor):
+    return re.sub(
+        r'[^A-Za-z0-9_]',
+        lambda m: ''.join(f'-{b:02X}' for b in m.group(0).encode('utf-8')),
+        valor,
+    )
+
+
+# `dgraph bulk` / `live` juntan las etiquetas de todos los archivos en un solo espacio, así
+# que se les antepone el tipo (como create_data, que busca por xid y type()): una categoría
+# "user1" y el usuario user1 son nodos distintos. El punto separa sin ambigüedad porque
+# etiqueta_rdf lo escapa.
+def etiqueta_nodo(tipo, xid):
+    return f'_:{etiqueta_rdf(tipo)}.{etiqueta_rdf(xid)}'
+
+
+def literal_rdf(valor):
+    if isinstance(valor, bool):
+        return f'"{str(valor).lower()}"^^<xs:boolean>'
+    if isinstance(valor, int):
+        return f'"{valor}"^^<xs:int>'
+    if isinstance(valor, float):
+        return f'"{valor!r}"^^<xs:float>'
+    # json.dumps produce una cadena entre comillas con los mismos escapes que N-Quads.
+    return json.dumps(valor, ensure_ascii=False)
+
+
+# Convierte el nodo que regresa un mapeo de model (fila_usuario, fila_producto, ...) en N-Quads.
+def nodo_a_nquads(nodo):
+    sujeto = etiqueta_nodo(nodo['dgraph.type'], nodo['uid'][2:])
+    for predicado, valor in nodo.items():
+        if predicado == 'uid':
+            continue
+        yield f'{sujeto} <{predicado}> {literal_rdf(valor)} .\n'
+
+
+def exportar_nodos(archivo_csv, mapear_fila, destino):
+    etiquetas = set()
+    filas = 0
+    with gzip.open(destino, 'wt', encoding='utf-8') as out:
+        for row in model.leer_csv(archivo_csv):
+            nodo = mapear_fila(row)
+            etiquetas.add(nodo['uid'][2:])
+            out.writelines(nodo_a_nquads(nodo))
+            filas += 1
+    return etiquetas, filas
+
+
+# Igual que cargar_aristas: sólo se exportan aristas cuyos dos extremos existen.
+def exportar_aristas(archivo_csv, col_origen, col_destino, predicado, origenes, destinos, destino,
+                     tipo_origen, tipo_destino):
+    aristas = 0
+    with gzip.open(destino, 'wt', encoding='utf-8') as out:
+        for row in model.leer_csv(archivo_csv):
+            origen, final = row[col_origen], row[col_destino]
+            if origen in origenes and final in destinos:
+                sujeto, objeto = etiqueta_nodo(tipo_origen, origen), etiqueta_nodo(tipo_destino, final)
+                out.write(f'{sujeto} <{predicado}> {objeto} .\n')
+                aristas += 1
+    return aristas
+
+
+def nombre_rdf(out_dir, archivo_csv):
+    base = os.path.splitext(os.path.basename(archivo_csv))[0]
+    return os.path.join(out_dir, base + '.rdf.gz')
+
+
+# Las filas se procesan una por una; sólo se guardan en memoria los ids de los nodos
+# para descartar las aristas que create_data también descartaría.
+def exportar(out_dir, csv_dir='.'):
+    os.makedirs(out_dir, exist_ok=True)
+
+    with open(os.path.join(out_dir, 'dgraph.schema'), 'w', encoding='utf-8') as out:
+        out.write(model.SCHEMA)
+
+    ids = {}
+    for nombre, _, archivo, mapear_fila in model.NODOS:
+        ids[nombre], filas = exportar_nodos(
+            os.path.join(csv_dir, archivo), mapear_fila, nombre_rdf(out_dir, archivo))
+        print(f"{nombre}: {filas} nodos exportados")
+
+    for loader, archivo, origen, destino in model.RELACIONES:
+        col_origen, col_destino, predicado = model.COLUMNAS_ARISTAS[loader.__name__]
+        aristas = exportar_aristas(
+            os.path.join(csv_dir, archivo), col_origen, col_destino, predicado,
+            ids[origen], ids[destino], nombre_rdf(out_dir, archivo), model.TIPOS[origen], model.TIPOS[destino])
+        print(f"{predicado}: {aristas} aristas exportadas")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Exporta los CSV a RDF comprimido para dgraph bulk/live.')
+    parser.add_argument('--out', default='export', help='Directorio de salida')
+    parser.add_argument('--csv-dir', default='.', help='Directorio con los CSV')
+    args = parser.parse_args()
+    exportar(args.out, args.csv_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+# Genera un dataset sintético con los mismos CSV (y columnas) que lee create_data, para
+# probar cargas y queries a escala. La popularidad de los productos y de las categorías
+# sigue una ley de potencias (Zipf), así unos pocos productos concentran la mayoría de los
+# favoritos y compras, y el número de favoritos / compras por usuario tiene cola larga.
+#
+# Se escribe por bloques de usuarios, así que la memoria no depende de --usuarios.
+#
+# i.e.:
+#   python3 generar_datos.py --usuarios 100000 --out datos_100k
+#   python3 benchmark.py --datos datos_100k
+import argparse
+import csv
+import os
+
+import numpy as np
+
+import model
+
+
+CATEGORIAS_BASE = [
+    'Camisas', 'Camisas Anime', 'Camisas rock', 'Pantalones', 'Pantalones Cargo', 'Vestidos',
+    'Vestidos Elegantes', 'Faldas', 'Chaquetas', 'Chaquetas de Anime', 'Ropa Interior', 'Lencería',
+    'Ropa Deportiva', 'Calzado', 'Zapatillas Urbanas', 'Botas', 'Gorros', 'Bufandas', 'Carteras',
+    'Ropa Oversize', 'Ropa Formal', 'Ropa Casual', 'Ropa Estilo K-Pop', 'Sudaderas con Estampados',
+    'Playeras con Personajes de Anime', 'Pijamas', 'Accesorios',
+]
+MOTIVOS = [
+    'Cambio de opinion', 'Color diferente al mostrado', 'Costura defectuosa', 'Entrega tardia',
+    'Error en descripcion', 'Mala calidad', 'Material diferente', 'No era lo esperado',
+    'Producto dañado', 'Producto equivocado', 'Talla incorrecta',
+]
+PALABRAS = [
+    'Clasico', 'Urbano', 'Basico', 'Premium', 'Vintage', 'Slim', 'Oversize', 'Estampado',
+    'Liso', 'Deportivo', 'Elegante', 'Casual', 'Retro', 'Moderno', 'Ligero', 'Termico',
+]
+BLOQUE = 100000
+
+
+# Probabilidades p_i ∝ 1 / i^s en un orden aleatorio (el producto más popular no es el primero).
+def popularidad(n, s, rng):
+    pesos = 1.0 / np.arange(1, n + 1) ** s
+    rng.shuffle(pesos)
+    return pesos / pesos.sum()
+
+
+# Número de elementos por usuario con media `media` y cola larga (lognormal).
+def por_usuario(n, media, rng, sigma=1.0):
+    if media <= 0:
+        return np.zeros(n, dtype=np.int64)
+    mu = np.log(media) - sigma ** 2 / 2
+    return np.floor(rng.lognormal(mu, sigma, n)).astype(np.int64)
+
+
+# Pares (usuario, producto) sin repetir para los usuarios [inicio, inicio + n).
+def pares_usuario_producto(inicio, n, media, probabilidades, rng):
+    cantidades = np.minimum(por_usuario(n, media, rng), len(probabilidades))
+    usuarios = np.repeat(np.arange(inicio, inicio + n), cantidades)
+    productos = rng.choice(len(probabilidades), size=len(usuarios), p=probabilidades)
+    llaves = np.unique(usuarios * len(probabilidades) + productos)
+    return llaves // len(probabilidades), llaves % len(probabilidades)
+
+
+def nombres_categorias(n):
+    nombres = list(CATEGORIAS_BASE[:n])
+    for i in range(len(nombres), n):
+        nombres.append(f"{CATEGORIAS_BASE[i % len(CATEGORIAS_BASE)]} {i // len(CATEGORIAS_BASE)}")
+    return nombres
+
+
+# Encabezado de un CSV de relaciones, el mismo que leen los loaders.
+def columnas(loader):
+    return list(model.COLUMNAS_ARISTAS[loader][:2])
+
+
+def escritor(out_dir, archivo, encabezado):
+    f = open(os.path.join(out_dir, archivo), 'w', newline='', encoding='utf-8')
+    w = csv.writer(f)
+    w.writerow(encabezado)
+    return f, w
+
+
+def generar(out_dir, usuarios, productos=None, categorias=None, favoritos_media=5.0,
+            compras_media=3.0, tasa_devolucion=0.05, zipf=1.1, seed=0):
+    productos = productos or max(100, usuarios // 10)
+    categorias = categorias or max(len(CATEGORIAS_BASE), productos // 2000)
+    rng = np.random.default_rng(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    archivos = {archivo: archivo for _, _, archivo, _ in model.NODOS}
+    archivos.update({loader.__name__: archivo for loader, archivo, _, _ in model.RELACIONES})
+
+    # Categorías y productos: cada producto tiene de 1 a 3 categorías, elegidas por popularidad.
+    nombres_cat = nombres_categorias(categorias)
+    f, w = escritor(out_dir, archivos['categorias.csv'], ['categoria'])
+    w.writerows([c] for c in nombres_cat)
+    f.close()
+
+    prob_categoria = popularidad(categorias, zipf, rng)
+    fp, wp = escritor(out_dir, archivos['productos.csv'], ['Productos_id', 'nombre', 'precio', 'descripcion', 'stock'])
+    fc, wc = escritor(out_dir, archivos['tiene_categoria'], columnas('tiene_categoria'))
+    for inicio in range(0, productos, BLOQUE):
+        n = min(BLOQUE, productos - inicio)
+        principales = rng.choice(categorias, size=n, p=prob_categoria)
+        extras = rng.integers(0, 3, size=n)
+        precios = np.round(rng.lognormal(3.5, 0.6, n), 2)
+        stocks = rng.integers(0, 200, size=n)
+        palabras = rng.integers(0, len(PALABRAS), size=(n, 4))
+        for i in range(n):
+            pid = f"producto{inicio + i + 1}"
+            principal = nombres_cat[principales[i]]
+            wp.writerow([pid, f"{principal} {PALABRAS[palabras[i, 0]]} {inicio + i + 1}", precios[i],
+                         ' '.join(PALABRAS[k] for k in palabras[i, 1:]) + '.', stocks[i]])
+            asignadas = {principales[i]}
+            asignadas.update(rng.choice(categorias, size=extras[i], p=prob_categoria).tolist())
+            wc.writerows([pid, nombres_cat[c]] for c in sorted(asignadas))
+    fp.close()
+    fc.close()
+
+    # Usuarios con sus favoritos, compras y devoluciones (una devolución es de algo que compró).
+    prob_producto = popularidad(productos, zipf, rng)
+    fu, wu = escritor(out_dir, archivos['User.csv'], ['user_id', 'username', 'email', 'phone', 'birthdate', 'created_at'])
+    ff, wf = escritor(out_dir, archivos['tiene_favoritos'], columnas('tiene_favoritos'))
+    fh, wh = escritor(out_dir, archivos['ha_comprado'], columnas('ha_comprado'))
+    fd, wd = escritor(out_dir, archivos['devoluciones.csv'], ['devolucion_id', 'motivo'])
+    fhd, whd = escritor(out_dir, archivos['hizo_devolucion'], columnas('hizo_devolucion'))
+    fdp, wdp = escritor(out_dir, archivos['de_producto'], columnas('de_producto'))
+    totales = {'favoritos': 0, 'compras': 0, 'devoluciones': 0}
+    nacimiento = np.datetime64('1960-01-01')
+    alta = np.datetime64('2020-01-01')
+    for inicio in range(0, usuarios, BLOQUE):
+        n = min(BLOQUE, usuarios - inicio)
+        nacimientos = nacimiento + rng.integers(0, 45 * 365, size=n)
+        altas = alta + rng.integers(0, 5 * 365, size=n)
+        for i in range(n):
+            k = inicio + i + 1
+            wu.writerow([f"user{k}", f"user_{k}", f"user{k}@mail.com", f"555-{k:05d}", nacimientos[i], altas[i]])
+
+        u, p = pares_usuario_producto(inicio, n, favoritos_media, prob_producto, rng)
+        wf.writerows(zip((f"user{x + 1}" for x in u), (f"producto{x + 1}" for x in p)))
+        totales['favoritos'] += len(u)
+
+        u, p = pares_usuario_producto(inicio, n, compras_media, prob_producto, rng)
+        wh.writerows(zip((f"user{x + 1}" for x in u), (f"producto{x + 1}" for x in p)))
+        totales['compras'] += len(u)
+
+        devueltas = np.flatnonzero(rng.random(len(u)) < tasa_devolucion)
+        motivos = rng.integers(0, len(MOTIVOS), size=len(devueltas))
+        for d, m in zip(devueltas, motivos):
+            totales['devoluciones'] += 1
+            dev = f"dev_{totales['devoluciones']}"
+            wd.writerow([dev, MOTIVOS[m]])
+            whd.writerow([f"user{u[d] + 1}", dev])
+            wdp.writerow([dev, f"producto{p[d] + 1}"])
+    for f in (fu, ff, fh, fd, fhd, fdp):
+        f.close()
+
+    return dict(usuarios=usuarios, productos=productos, categorias=categorias, **totales)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Genera CSV sintéticos con el formato de create_data.')
+    parser.add_argument('--out', default='datos', help='Directorio de salida')
+    parser.add_argument('--usuarios', type=int, default=10000)
+    parser.add_argument('--productos', type=int, help='Por omisión usuarios / 10')
+    parser.add_argument('--categorias', type=int, help='Por omisión productos / 2000 (mínimo 27)')
+    parser.add_argument('--favoritos-media', type=float, default=5.0, help='Favoritos promedio por usuario')
+    parser.add_argument('--compras-media', type=float, default=3.0, help='Compras promedio por usuario')
+    parser.add_argument('--tasa-devolucion', type=float, default=0.05, help='Fracción de compras devueltas')
+    parser.add_argument('--zipf', type=float, default=1.1, help='Exponente de popularidad de productos y categorías')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    totales = generar(args.out, args.usuarios, args.productos, args.categorias, args.favoritos_media,
+                      args.compras_media, args.tasa_devolucion, args.zipf, args.seed)
+    print(', '.join(f"{k}: {v}" for k, v in totales.items()))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,31 @@
 #!/usr/bin/env python3
 import os
-import pydgraph
+import analitica
+import metricas
 import model
+from pool import PoolClientes
 
 DGRAPH_URI = os.getenv('DGRAPH_URI', 'localhost:9080')
+# Alphas separados por coma, i.e. 'alpha1:9080,alpha2:9080'. Si no se da se usa DGRAPH_URI.
+DGRAPH_ALPHAS = os.getenv('DGRAPH_ALPHAS', '')
+# Canales gRPC por Alpha.
+DGRAPH_CONEXIONES = int(os.getenv('DGRAPH_CONEXIONES', '1'))
+# 'round_robin' o 'menos_ocupado' (el canal con menos transacciones abiertas).
+DGRAPH_ESTRATEGIA = os.getenv('DGRAPH_ESTRATEGIA', 'round_robin')
+# Segundos entre health checks de los canales (0 = sin health checks).
+DGRAPH_SALUD_INTERVALO = int(os.getenv('DGRAPH_SALUD_INTERVALO', '0'))
+# Segundos entre reconstrucciones de las recomendaciones precalculadas (0 = query en vivo).
+RECOMENDACIONES_INTERVALO = int(os.getenv('RECOMENDACIONES_INTERVALO', '0'))
+# Segundos entre reconstrucciones de la analítica de devoluciones (0 = se construye al pedirla).
+AGREGADOS_INTERVALO = int(os.getenv('AGREGADOS_INTERVALO', '0'))
+# JSON donde se escribe el resumen de la analítica en cada reconstrucción (para dashboards).
+AGREGADOS_PATH = os.getenv('AGREGADOS_PATH', '')
+# Con CARGA_COLUMNAR=1 los nodos se cargan por columnas con numpy (ver columnar.py).
+CARGA_COLUMNAR = os.getenv('CARGA_COLUMNAR', '') == '1'
+# Puerto para /metrics, /metrics.json y /perfil (0 = no se sirven las métricas).
+METRICAS_PUERTO = int(os.getenv('METRICAS_PUERTO', '0'))
+# Con PERFILADOR=1 corre el perfilador por muestreo (se ve en /perfil).
+PERFILADOR = os.getenv('PERFILADOR', '') == '1'
 
 def print_menu():
     mm_options = {
@@ -16,36 +38,59 @@ def print_menu():
         7: "recomendacion por categoria",
         8: "Drop All",
         9: "Exit",
+        10: "Actualizar datos (delta)",
+        11: "Cargar relaciones",
+        12: "Buscar productos",
+        13: "Analítica de devoluciones",
+        14: "También compraron / en favoritos",
+        15: "Registrar compra",
     }
     for key in mm_options.keys():
         print(key, '--', mm_options[key])
 
 
-# Conexión directa con el servidor Dgraph usando gRPC.
-def create_client_stub():
-    return pydgraph.DgraphClientStub(DGRAPH_URI)
+# Pool de conexiones gRPC con los Alphas: se usa como cliente en todas las funciones de model.
+def create_client():
+    return PoolClientes(DGRAPH_ALPHAS or DGRAPH_URI, DGRAPH_CONEXIONES, DGRAPH_ESTRATEGIA,
+                        intervalo_salud=DGRAPH_SALUD_INTERVALO)
 
-# Crea el cliente principal de Dgraph: realizar operaciones de alto nivel como queries, mutaciones y transacciones.
-def create_client(client_stub):
-    return pydgraph.DgraphClient(client_stub)
-
-def close_client_stub(client_stub):
-    client_stub.close()
+def close_client(client):
+    client.close()
 
 def main():
-    # Inicializar Client Stub y Dgraph Client
-    client_stub = create_client_stub()
-    client = create_client(client_stub)
+    # Inicializar el pool de clientes de Dgraph
+    client = create_client()
+
+    if METRICAS_PUERTO:
+        metricas.servir(METRICAS_PUERTO)
+    if PERFILADOR:
+        metricas.iniciar_perfilador()
 
     # Crear schema
     model.set_schema(client)
 
+    # Recomendaciones precalculadas (requiere numpy y scipy)
+    if RECOMENDACIONES_INTERVALO:
+        import recomendaciones
+        motor = recomendaciones.MotorRecomendaciones()
+        motor.iniciar(client, RECOMENDACIONES_INTERVALO)
+        model.usar_motor_recomendaciones(motor)
+
+    # Agregados de devoluciones materializados
+    agregados = analitica.AgregadosDevoluciones()
+    model.usar_agregados_devoluciones(agregados)
+    if AGREGADOS_INTERVALO:
+        agregados.iniciar(client, AGREGADOS_INTERVALO, AGREGADOS_PATH or None)
+
     while(True):
         print_menu()
         option = int(input('Enter your choice: '))
 
         if option == 1:
-            model.create_data(client)
+            if len(client) > 1:
+                model.create_data_paralelo(client, columnar=CARGA_COLUMNAR)
+            else:
+                model.create_data(client, columnar=CARGA_COLUMNAR)
 
         elif option == 2:
             username = input("Username: ")
@@ -79,10 +124,55 @@ def main():
 
         elif option == 9:
             model.drop_all(client)
-            close_client_stub(client_stub)
+            close_client(client)
             print("Sesión finalizada.")
             exit(0)
 
+        elif option == 10:
+            model.create_data_delta(client)
+
+        elif option == 11:
+            model.create_relaciones(client)
+
+        elif option == 12:
+            texto = input("Buscar: ")
+            precio_min = input("Precio mínimo (vacío = sin mínimo): ")
+            precio_max = input("Precio máximo (vacío = sin máximo): ")
+            after = None
+            while True:
+                pagina = model.buscar_productos(client, texto, precio_min or None, precio_max or None, after=after)
+                for producto in pagina['productos']:
+                    print(f"{producto['nombre']} - ${producto['precio']}")
+                after = pagina['siguiente']
+                if after is None or input("¿Siguiente página? (s/n): ") != 's':
+                    break
+
+        elif option == 13:
+            if not agregados.listo:
+                agregados.construir(client)
+            print(f"Devoluciones: {agregados.total} (al {agregados.fecha})")
+            for fila in agregados.por_motivo():
+                print(f"  {fila['motivo']}: {fila['devoluciones']} ({100 * fila['tasa']:.1f}%)")
+            for titulo, filas, llave in (("Por categoría", agregados.por_categoria(), 'categoria'),
+                                         ("Productos con más devoluciones", agregados.por_producto(10), 'producto')):
+                print(titulo + ":")
+                for fila in filas:
+                    tasa = '-' if fila['tasa'] is None else f"{100 * fila['tasa']:.1f}%"
+                    print(f"  {fila[llave]}: {fila['devoluciones']} de {fila['compras']} compras ({tasa})")
+
+        elif option == 14:
+            producto = input("Nombre del producto: ")
+            for titulo, productos in (("También compraron", model.tambien_compraron(client, producto)),
+                                      ("También en favoritos", model.tambien_en_favoritos(client, producto))):
+                print(titulo + ":")
+                for p in productos:
+                    print(f"  {p['nombre']} - ${p.get('precio')} ({p['veces']} usuarios)")
+
+        elif option == 15:
+            username = input("Username: ")
+            producto = input("Nombre del producto: ")
+            model.registrar_compra(client, username, producto)
+
 if __name__ == '__main__':
     try:
         main()
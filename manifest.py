@@ -0,0 +1,43 @@
+# Manifest local de la última carga: guarda la huella de cada fila de cada CSV para
+# que la carga incremental (model.create_data_delta) sólo mande lo que cambió.
+import os
+import sqlite3
+
+
+class Manifest:
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS manifest (
+                archivo TEXT NOT NULL,
+                clave TEXT NOT NULL,
+                huella TEXT NOT NULL,
+                PRIMARY KEY (archivo, clave)
+            ) WITHOUT ROWID
+        """)
+
+    @staticmethod
+    def _archivo(file_path):
+        return os.path.basename(file_path)
+
+    # Regresa {clave: huella} de la última corrida para un CSV.
+    def leer(self, file_path):
+        cursor = self.conn.execute(
+            'SELECT clave, huella FROM manifest WHERE archivo = ?', (self._archivo(file_path),))
+        return dict(cursor)
+
+    # Reemplaza las huellas de un CSV en una sola transacción.
+    def guardar(self, file_path, huellas):
+        archivo = self._archivo(file_path)
+        with self.conn:
+            self.conn.execute('DELETE FROM manifest WHERE archivo = ?', (archivo,))
+            self.conn.executemany(
+                'INSERT INTO manifest (archivo, clave, huella) VALUES (?, ?, ?)',
+                ((archivo, clave, huella) for clave, huella in huellas.items()))
+
+    def limpiar(self):
+        with self.conn:
+            self.conn.execute('DELETE FROM manifest')
+
+    def close(self):
+        self.conn.close()
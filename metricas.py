@@ -0,0 +1,258 @@
+# Métricas de las operaciones con Dgraph: tiempo en el cliente, latencia del servidor por
+# fase (parsing / processing / encoding, de res.latency), tiempo de decodificar el JSON,
+# tamaño del request y de la respuesta, aborts, reintentos y número de operaciones por
+# plantilla. Restando la latencia total del servidor al tiempo en el cliente queda la red.
+#
+# Se exponen como histogramas en formato de texto de Prometheus o en JSON, i.e. con
+# servir(9100): http://localhost:9100/metrics y /metrics.json. También hay un perfilador
+# por muestreo opcional (/perfil, en formato de stacks colapsados para flamegraph).
+import bisect
+import json
+import sys
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pydgraph
+
+
+BUCKETS_SEGUNDOS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+BUCKETS_BYTES = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864)
+FASES = ('parsing', 'processing', 'encoding', 'assign_timestamp', 'total')
+
+
+class Histograma:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.conteos = [0] * (len(buckets) + 1)
+        self.suma = 0.0
+        self.total = 0
+        self.maximo = 0.0
+
+    def observar(self, valor):
+        self.conteos[bisect.bisect_left(self.buckets, valor)] += 1
+        self.suma += valor
+        self.total += 1
+        self.maximo = max(self.maximo, valor)
+
+    # Estimación por el límite superior del bucket donde cae el cuantil.
+    def cuantil(self, q):
+        objetivo = q * self.total
+        acumulado = 0
+        for limite, conteo in zip(self.buckets, self.conteos):
+            acumulado += conteo
+            if acumulado >= objetivo:
+                return limite
+        return float('inf')
+
+
+class Registro:
+    def __init__(self):
+        self._histogramas = {}   # (nombre, etiquetas) -> Histograma
+        self._contadores = Counter()
+        self._lock = threading.Lock()
+
+    def observar(self, nombre, etiquetas, valor, buckets=BUCKETS_SEGUNDOS):
+        llave = (nombre, tuple(sorted(etiquetas.items())))
+        with self._lock:
+            histograma = self._histogramas.get(llave)
+            if histograma is None:
+                histograma = self._histogramas[llave] = Histograma(buckets)
+            histograma.observar(valor)
+
+    def contar(self, nombre, etiquetas, n=1):
+        with self._lock:
+            self._contadores[(nombre, tuple(sorted(etiquetas.items())))] += n
+
+    # (etiquetas, total, suma, maximo) de cada histograma con ese nombre.
+    def resumen(self, nombre):
+        with self._lock:
+            return [(dict(etiquetas), h.total, h.suma, h.maximo)
+                    for (n, etiquetas), h in self._histogramas.items() if n == nombre]
+
+    def reiniciar(self):
+        with self._lock:
+            self._histogramas.clear()
+            self._contadores.clear()
+
+    def prometheus(self):
+        lineas = []
+        with self._lock:
+            for (nombre, etiquetas), valor in sorted(self._contadores.items()):
+                if not lineas or not lineas[-1].startswith(nombre + '{'):
+                    lineas.append(f'# TYPE {nombre} counter')
+                lineas.append(f'{nombre}{_etiquetas(etiquetas)} {valor}')
+            anterior = None
+            for (nombre, etiquetas), h in sorted(self._histogramas.items()):
+                if nombre != anterior:
+                    lineas.append(f'# TYPE {nombre} histogram')
+                    anterior = nombre
+                acumulado = 0
+                for limite, conteo in zip(h.buckets + ('+Inf',), h.conteos):
+                    acumulado += conteo
+                    lineas.append(f'{nombre}_bucket{_etiquetas(etiquetas + (("le", limite),))} {acumulado}')
+                lineas.append(f'{nombre}_sum{_etiquetas(etiquetas)} {h.suma}')
+                lineas.append(f'{nombre}_count{_etiquetas(etiquetas)} {h.total}')
+        return '\n'.join(lineas) + '\n'
+
+    def como_json(self):
+        with self._lock:
+            return {
+                'contadores': [
+                    {'nombre': nombre, 'etiquetas': dict(etiquetas), 'valor': valor}
+                    for (nombre, etiquetas), valor in sorted(self._contadores.items())
+                ],
+                'histogramas': [
+                    {
+                        'nombre': nombre,
+                        'etiquetas': dict(etiquetas),
+                        'total': h.total,
+                        'suma': h.suma,
+                        'p50': h.cuantil(0.50),
+                        'p95': h.cuantil(0.95),
+                        'p99': h.cuantil(0.99),
+                        'buckets': dict(zip([str(b) for b in h.buckets] + ['+Inf'], h.conteos)),
+                    }
+                    for (nombre, etiquetas), h in sorted(self._histogramas.items())
+                ],
+            }
+
+
+def _etiquetas(etiquetas):
+    if not etiquetas:
+        return ''
+    return '{' + ','.join(f'{k}={json.dumps(str(v))}' for k, v in etiquetas) + '}'
+
+
+registro = Registro()
+
+
+# Registra una operación ya hecha. `respuesta` es el api.Response de pydgraph si lo hay.
+def registrar(operacion, plantilla, segundos, respuesta=None, bytes_request=0, error=None):
+    etiquetas = {'operacion': operacion, 'plantilla': plantilla}
+    registro.contar('dgraph_operaciones_total', etiquetas)
+    registro.observar('dgraph_cliente_segundos', etiquetas, segundos)
+    if bytes_request:
+        registro.observar('dgraph_request_bytes', etiquetas, bytes_request, BUCKETS_BYTES)
+    if error is not None:
+        tipo = 'aborts' if isinstance(error, pydgraph.AbortedError) else 'errores'
+        registro.contar(f'dgraph_{tipo}_total', etiquetas)
+    if respuesta is None:
+        return
+    latencia = getattr(respuesta, 'latency', None)
+    if latencia is not None and latencia.total_ns:
+        for fase in FASES:
+            registro.observar('dgraph_servidor_segundos', dict(etiquetas, fase=fase),
+                              getattr(latencia, fase + '_ns') / 1e9)
+    if getattr(respuesta, 'json', None):
+        registro.observar('dgraph_respuesta_bytes', etiquetas, len(respuesta.json), BUCKETS_BYTES)
+
+
+# Llama `funcion(*args, **kwargs)` (txn.query, txn.mutate, txn.commit, client.alter, ...)
+# y registra su tiempo, su respuesta y si falló.
+def llamar(operacion, plantilla, funcion, *args, bytes_request=0, **kwargs):
+    inicio = time.perf_counter()
+    try:
+        respuesta = funcion(*args, **kwargs)
+    except Exception as e:
+        registrar(operacion, plantilla, time.perf_counter() - inicio, bytes_request=bytes_request, error=e)
+        raise
+    registrar(operacion, plantilla, time.perf_counter() - inicio, respuesta, bytes_request)
+    return respuesta
+
+
+def decodificar(plantilla, respuesta):
+    inicio = time.perf_counter()
+    data = json.loads(respuesta.json)
+    registro.observar('dgraph_json_segundos', {'plantilla': plantilla}, time.perf_counter() - inicio)
+    return data
+
+
+def reintento(operacion):
+    registro.contar('dgraph_reintentos_total', {'operacion': operacion})
+
+
+# Perfilador por muestreo: cada `intervalo` segundos toma el stack de todos los hilos y
+# cuenta cuántas veces aparece cada uno.
+class Muestreador:
+    def __init__(self, intervalo=0.005):
+        self.intervalo = intervalo
+        self.stacks = Counter()
+        self._detener = threading.Event()
+        self._hilo = None
+
+    def iniciar(self):
+        self._detener.clear()
+        self._hilo = threading.Thread(target=self._correr, name='Muestreador', daemon=True)
+        self._hilo.start()
+
+    def detener(self):
+        self._detener.set()
+        if self._hilo is not None:
+            self._hilo.join()
+            self._hilo = None
+
+    def _correr(self):
+        propio = threading.get_ident()
+        while not self._detener.wait(self.intervalo):
+            for hilo, frame in sys._current_frames().items():
+                if hilo == propio:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(f'{frame.f_code.co_name} ({frame.f_code.co_filename}:{frame.f_lineno})')
+                    frame = frame.f_back
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    # Una línea por stack, "f1;f2;f3 muestras", el formato de entrada de flamegraph.pl.
+    def colapsado(self):
+        return ''.join(f'{stack} {n}\n' for stack, n in self.stacks.most_common())
+
+
+perfilador = None
+
+
+def iniciar_perfilador(intervalo=0.005):
+    global perfilador
+    if perfilador is None:
+        perfilador = Muestreador(intervalo)
+        perfilador.iniciar()
+    return perfilador
+
+
+def detener_perfilador():
+    global perfilador
+    if perfilador is not None:
+        perfilador.detener()
+    resultado, perfilador = perfilador, None
+    return resultado
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == '/metrics':
+            cuerpo, tipo = registro.prometheus(), 'text/plain; version=0.0.4'
+        elif self.path == '/metrics.json':
+            cuerpo, tipo = json.dumps(registro.como_json()), 'application/json'
+        elif self.path == '/perfil' and perfilador is not None:
+            cuerpo, tipo = perfilador.colapsado(), 'text/plain'
+        else:
+            self.send_error(404)
+            return
+        cuerpo = cuerpo.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', tipo)
+        self.send_header('Content-Length', str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def log_message(self, *args):
+        pass
+
+
+# Sirve las métricas en un hilo aparte; regresa el servidor para poder cerrarlo (shutdown()).
+def servir(puerto=9100, host='127.0.0.1'):
+    servidor = ThreadingHTTPServer((host, puerto), _Handler)
+    threading.Thread(target=servidor.serve_forever, name='metricas', daemon=True).start()
+    return servidor
@@ -1,17 +1,81 @@
-# Establish Dgraph client
 import csv
+import functools
+import hashlib
 import json
+import os
 import pydgraph
 import datetime
+import itertools
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, FIRST_COMPLETED, wait
 
+import consultas
+import esquema
+import metricas
+from cache import CacheResultados, LRUCache
+from manifest import Manifest
+from uidmap import UidMap
 
-client_stub = pydgraph.DgraphClientStub('localhost:9080')
-client = pydgraph.DgraphClient(client_stub)
+# No se conecta nada al importar: cada función recibe el cliente (un pydgraph.DgraphClient
+# o un pool.PoolClientes) que armó quien la llama.
 
-def set_schema(client):
-    schema = """
+# username / nombre de producto -> uid para las escrituras. Casi nunca cambian, así que
+# no hace falta consultarlos en cada escritura. Lo invalidan drop_all y los loaders.
+uid_cache = LRUCache(maxsize=100000, ttl=600)
+
+# Resultados de search_users, favoritos_del_usuario y devoluciones_por_usuario por username.
+# guardar_en_favoritos y registrar_devolucion invalidan al usuario que tocan; los loaders y
+# drop_all lo vacían completo.
+resultados_cache = CacheResultados(('search_users', 'favoritos', 'devoluciones'),
+                                   maxsize=10000, ttl=300, max_bytes=64 * 1024 * 1024)
+
+# Páginas de buscar_productos por (texto, rango de precio, página). Las búsquedas populares
+# se quedan en el LRU; los loaders de nodos y drop_all lo vacían.
+busquedas_cache = LRUCache(maxsize=5000, ttl=60)
+
+# "También compraron" / "también en favoritos" por nombre de producto. Una compra o un
+# favorito nuevo invalida su producto; en las listas de otros productos que lo incluyen se
+# nota hasta que vence el ttl. Los loaders y drop_all lo vacían.
+productos_cache = CacheResultados(('tambien_compraron', 'tambien_favoritos'),
+                                  maxsize=10000, ttl=600, max_bytes=16 * 1024 * 1024)
+
+
+# Vacía los caches de lectura después de una carga o un drop_all; cada cache nuevo se agrega
+# aquí. Con nodos=False (sólo cambiaron aristas) los uids y las búsquedas siguen siendo válidos.
+def _invalidar_caches(nodos=True):
+    resultados_cache.clear()
+    productos_cache.clear()
+    if nodos:
+        uid_cache.clear()
+        busquedas_cache.clear()
+
+
+# Motor de recomendaciones precalculadas (recomendaciones.MotorRecomendaciones). Mientras
+# sea None, recomendaciones_por_categoria usa la query en vivo.
+motor_recomendaciones = None
+
+
+def usar_motor_recomendaciones(motor):
+    global motor_recomendaciones
+    motor_recomendaciones = motor
+
+
+# Agregados de devoluciones (analitica.AgregadosDevoluciones) que se actualizan con cada
+# devolución registrada. Con None no se mantiene nada.
+agregados_devoluciones = None
+
+
+def usar_agregados_devoluciones(agregados):
+    global agregados_devoluciones
+    agregados_devoluciones = agregados
+
+SCHEMA = """
     
     type User {
+        xid
         username
         email
         phone
@@ -23,6 +87,7 @@ def set_schema(client):
     }
 
     type Producto {
+        xid
         nombre
         precio
         descripcion
@@ -31,24 +96,28 @@ def set_schema(client):
     }
     
     type Categoria {
+        xid
         categoria
     }
     
     type devolucion {
+        xid
         motivo
         De_producto
     }
 
+    xid: string @index(exact) @upsert .
+
     username: string @index(exact) .
     email: string .
     phone: string .
     birthdate: datetime .
     created_at: datetime .
-    ha_comprado: [uid] .
-    tiene_favoritos: [uid] .
-    hizo_devolucion: [uid] .
+    ha_comprado: [uid] @count @reverse .
+    tiene_favoritos: [uid] @count @reverse .
+    hizo_devolucion: [uid] @count .
     
-    nombre: string @index(fulltext) .
+    nombre: string @index(hash, fulltext) .
     precio: float @index(float) . 
     descripcion: string .
     stock: int .
@@ -58,376 +127,811 @@ def set_schema(client):
     
     motivo: string .
     De_producto: [uid] .
+
+    version_schema: string .
     
     """
-    return client.alter(pydgraph.Operation(schema=schema))
+
+
+# Sólo hace alter de lo que cambió desde el último arranque (ver esquema.py).
+def set_schema(client, forzar=False):
+    return esquema.aplicar(client, SCHEMA, forzar)
 
 
 #Data:
 
-def load_Users(file_path):
-    txn = client.txn()
-    resp = None
+# Número de filas que se mandan por transacción al cargar los CSV.
+CHUNK_SIZE = 5000
+
+
+# Lee el CSV fila por fila, sin cargar el archivo completo en memoria.
+def leer_csv(file_path):
+    with open(file_path, 'r', newline='') as file:
+        reader = csv.DictReader(file)
+        for row in reader:
+            yield row
+
+
+# Agrupa cualquier iterable en listas de tamaño `size`.
+def en_chunks(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def reportar_progreso(etiqueta, cantidad, inicio, unidad='filas'):
+    transcurrido = time.perf_counter() - inicio
+    velocidad = cantidad / transcurrido if transcurrido > 0 else 0.0
+    print(f"{etiqueta}: {cantidad} {unidad} en {transcurrido:.2f}s ({velocidad:.0f} {unidad}/s)")
+
+
+# Mapeo de columnas del CSV a nodos de Dgraph.
+def fila_usuario(row):
+    return {
+        'uid': '_:' + row['user_id'],  # Añadir _: para que Dgraph lo reconozca como un identificador personalizado
+        'xid': row['user_id'],
+        'dgraph.type': 'User',
+        'username': row['username'],
+        'email': row['email'],
+        'phone': row['phone'],
+        'birthdate': row['birthdate'],
+        'created_at': row['created_at']
+    }
+
+
+def fila_producto(row):
+    return {
+        'uid': '_:' + row['Productos_id'],  # Añadir _: para los identificadores personalizados
+        'xid': row['Productos_id'],
+        'dgraph.type': 'Producto',
+        'nombre': row['nombre'],
+        'precio': float(row['precio']),
+        'descripcion': row['descripcion'],
+        'stock': int(row['stock'])
+    }
+
+
+def fila_devolucion(row):
+    return {
+        'uid': '_:' + row['devolucion_id'],  # Añadir _: para los identificadores personalizados
+        'xid': row['devolucion_id'],
+        'dgraph.type': 'devolucion',
+        'motivo': row['motivo'],
+    }
+
+
+def fila_categoria(row):
+    return {
+        'uid': '_:' + row['categoria'],  # Añadir _: para los identificadores personalizados
+        'xid': row['categoria'],
+        'dgraph.type': 'Categoria',
+        'categoria': row['categoria']
+    }
+
+
+# Reparte las transacciones entre varios clientes (uno por stub) en round-robin.
+class Conexiones:
+    def __init__(self, clientes):
+        self.clientes = list(clientes)
+        self._ciclo = itertools.cycle(self.clientes)
+        self._lock = threading.Lock()
+
+    def siguiente(self):
+        with self._lock:
+            return next(self._ciclo)
+
+    def __len__(self):
+        return len(self.clientes)
+
+
+# Los loaders reciben un pool (que ya reparte entre sus canales), unas Conexiones o un
+# cliente suelto.
+def conexiones_de(client):
+    if client is None:
+        raise ValueError('Se necesita un cliente de Dgraph.')
+    if hasattr(client, 'siguiente'):
+        return client
+    return Conexiones([client])
+
+
+# Manda cada chunk con `enviar(cliente, chunk)` y regresa los resultados conforme terminan.
+# Con `executor` los chunks van en paralelo, a lo más dos en vuelo por conexión para que
+# la memoria no dependa del tamaño del CSV.
+def enviar_chunks(chunks, enviar, conexiones, executor=None):
+    if executor is None:
+        for chunk in chunks:
+            yield enviar(conexiones.siguiente(), chunk)
+        return
+
+    en_vuelo = set()
+    max_en_vuelo = 2 * len(conexiones)
+    for chunk in chunks:
+        if len(en_vuelo) >= max_en_vuelo:
+            listos, en_vuelo = wait(en_vuelo, return_when=FIRST_COMPLETED)
+            for futuro in listos:
+                yield futuro.result()
+        en_vuelo.add(executor.submit(enviar, conexiones.siguiente(), chunk))
+    for futuro in en_vuelo:
+        yield futuro.result()
+
+
+# Reintentos cuando Dgraph aborta una transacción por conflicto con otra.
+RETRIES = 3
+
+
+# Nombre de la operación para las métricas; los loaders delta la pasan como functools.partial.
+def _etiqueta(operacion):
+    while isinstance(operacion, functools.partial):
+        operacion = operacion.func
+    return getattr(operacion, '__name__', repr(operacion))
+
+
+# Sólo para operaciones idempotentes: se repite la operación completa si Dgraph la aborta.
+def reintentar(operacion, *args):
+    for intento in range(RETRIES + 1):
+        try:
+            return operacion(*args)
+        except pydgraph.AbortedError:
+            if intento == RETRIES:
+                raise
+            metricas.reintento(_etiqueta(operacion))
+            time.sleep(0.05 * 2 ** intento)
+
+
+# Busca los uids de los nodos de tipo `tipo` que ya existen con los xids dados.
+def resolver_xids(txn, tipo, xids):
+    xids = list(xids)
+    if not xids:
+        return {}
+    query = f"""
+    {{
+        nodos(func: eq(xid, {json.dumps(xids)})) @filter(type({tipo})) {{
+            uid
+            xid
+        }}
+    }}
+    """
+    res = metricas.llamar('query', 'resolver_xids', txn.query, query)
+    return {nodo['xid']: nodo['uid'] for nodo in metricas.decodificar('resolver_xids', res).get('nodos', [])}
+
+
+# Upsert por xid: los nodos que ya existen se actualizan con su uid y el resto se crea con
+# su blank node, así recargar el mismo CSV no duplica nodos. El índice @upsert de xid hace
+# que Dgraph aborte si otra transacción crea el mismo xid al mismo tiempo.
+def _upsert_nodos(dgraph_client, chunk):
+    txn = dgraph_client.txn()
     try:
-        Users = []
-        with open(file_path, 'r') as file:
-            reader = csv.DictReader(file)
-            for row in reader:
-                Users.append({
-                    'uid': '_:' + row['user_id'],  # Añadir _: para que Dgraph lo reconozca como un identificador personalizado
-                    'dgraph.type': 'User',
-                    'username': row['username'],
-                    'email': row['email'],
-                    'phone': row['phone'],  
-                    'birthdate': row['birthdate'],  
-                    'created_at': row['created_at']
-                })
-            print(f"Loading users: {Users}")
-            resp = txn.mutate(set_obj=Users)
-        txn.commit()
+        existentes = resolver_xids(txn, chunk[0]['dgraph.type'], (nodo['xid'] for nodo in chunk))
+        for nodo in chunk:
+            nodo['uid'] = existentes.get(nodo['xid'], '_:' + nodo['xid'])
+        mutation = txn.create_mutation(set_obj=chunk)
+        resp = metricas.llamar('mutate', 'nodos', txn.mutate, mutation, bytes_request=mutation.ByteSize())
+        metricas.llamar('commit', 'nodos', txn.commit)
     finally:
         txn.discard()
-    return resp.uids
-
-
-def load_productos(file_path):
-    txn = client.txn()
-    resp = None
+    existentes.update(resp.uids)
+    return existentes
+
+
+# Con `uidmap` los uids del bloque se guardan en el índice persistente.
+def _commit_nodos(dgraph_client, chunk, uidmap=None):
+    uids = reintentar(_upsert_nodos, dgraph_client, chunk)
+    # Un username o nombre de producto pudo cambiar de nodo, y los perfiles cacheados incluyen productos.
+    _invalidar_caches()
+    if uidmap is not None:
+        uidmap.guardar(chunk[0]['dgraph.type'], uids)
+    return uids, len(chunk)
+
+
+# Carga los nodos de un CSV en bloques de `chunk_size` filas, una transacción por bloque.
+# Con `executor` los bloques se mandan en paralelo sobre las `conexiones`.
+# Regresa el mapa xid -> uid de todos los bloques; con `uidmap` los uids se guardan en el
+# índice persistente en lugar de juntarse en memoria y se regresa la tabla del tipo.
+def cargar_nodos(file_path, mapear_fila, tipo, chunk_size=CHUNK_SIZE, conexiones=None, executor=None, uidmap=None):
+    conexiones = conexiones_de(conexiones)
+    uids = {}
+    filas = 0
+    inicio = time.perf_counter()
+    nodos = (mapear_fila(row) for row in leer_csv(file_path))
+    enviar = functools.partial(_commit_nodos, uidmap=uidmap)
+    for chunk_uids, n in enviar_chunks(en_chunks(nodos, chunk_size), enviar, conexiones, executor):
+        if uidmap is None:
+            uids.update(chunk_uids)
+        filas += n
+        reportar_progreso(tipo, filas, inicio)
+    return uids if uidmap is None else uidmap.tabla(tipo)
+
+
+# Carga columnar (columnar.py, requiere numpy): mismo upsert por xid que _upsert_nodos, pero
+# la mutación son las N-Quads que arma el bloque desde sus columnas.
+def _upsert_bloque(dgraph_client, bloque):
+    txn = dgraph_client.txn()
     try:
-        Producto = []
-        with open(file_path, 'r') as file:
-            reader = csv.DictReader(file)
-            for row in reader:
-                Producto.append({
-                    'uid': '_:' + row['Productos_id'],  # Añadir _: para los identificadores personalizados
-                    'dgraph.type': 'Producto',
-                    'nombre': row['nombre'],
-                    'precio': float(row['precio']),
-                    'descripcion': row['descripcion'],
-                    'stock': int(row['stock'])
-                })
-            print(f"Loading Productos: {Producto}")
-            resp = txn.mutate(set_obj=Producto)
-        txn.commit()
+        existentes = resolver_xids(txn, bloque.tipo, bloque.xids)
+        mutation = txn.create_mutation(set_nquads=bloque.nquads(existentes))
+        resp = metricas.llamar('mutate', 'nodos', txn.mutate, mutation, bytes_request=mutation.ByteSize())
+        metricas.llamar('commit', 'nodos', txn.commit)
     finally:
         txn.discard()
-    return resp.uids
+    existentes.update(bloque.uids_creados(resp.uids))
+    return existentes
 
 
-def load_devolucion(file_path):
-    txn = client.txn()
-    resp = None
+def _commit_bloque(dgraph_client, bloque, uidmap=None):
+    uids = reintentar(_upsert_bloque, dgraph_client, bloque)
+    _invalidar_caches()
+    if uidmap is not None:
+        uidmap.guardar(bloque.tipo, uids)
+    return uids, len(bloque)
+
+
+# Igual que cargar_nodos pero por columnas. Las filas inválidas se escriben en
+# `errores_path` (por omisión <archivo>.errores.csv) en lugar de mandarse.
+def cargar_nodos_columnar(tipo, file_path, chunk_size=CHUNK_SIZE, conexiones=None, executor=None, uidmap=None,
+                          errores_path=None):
+    import columnar
+    conexiones = conexiones_de(conexiones)
+    errores_path = errores_path or os.path.splitext(file_path)[0] + '.errores.csv'
+    uids = {}
+    filas = 0
+    inicio = time.perf_counter()
+    enviar = functools.partial(_commit_bloque, uidmap=uidmap)
+    with columnar.LectorColumnar(file_path, tipo, chunk_size, errores_path) as lector:
+        for chunk_uids, n in enviar_chunks(lector.bloques(), enviar, conexiones, executor):
+            if uidmap is None:
+                uids.update(chunk_uids)
+            filas += n
+            reportar_progreso(tipo, filas, inicio)
+    if lector.rechazadas:
+        print(f"{tipo}: {lector.rechazadas} filas rechazadas, ver {errores_path}")
+    return uids if uidmap is None else uidmap.tabla(tipo)
+
+
+def load_Users(file_path, chunk_size=CHUNK_SIZE, conexiones=None, executor=None, uidmap=None):
+    return cargar_nodos(file_path, fila_usuario, 'User', chunk_size, conexiones, executor, uidmap)
+
+
+def load_productos(file_path, chunk_size=CHUNK_SIZE, conexiones=None, executor=None, uidmap=None):
+    return cargar_nodos(file_path, fila_producto, 'Producto', chunk_size, conexiones, executor, uidmap)
+
+
+def load_devolucion(file_path, chunk_size=CHUNK_SIZE, conexiones=None, executor=None, uidmap=None):
+    return cargar_nodos(file_path, fila_devolucion, 'devolucion', chunk_size, conexiones, executor, uidmap)
+
+
+def load_categoria(file_path, chunk_size=CHUNK_SIZE, conexiones=None, executor=None, uidmap=None):
+    return cargar_nodos(file_path, fila_categoria, 'Categoria', chunk_size, conexiones, executor, uidmap)
+
+
+#Relaciones:
+
+# Número de aristas (líneas N-Quad) por transacción.
+EDGE_BATCH_SIZE = 10000
+
+
+def nquad_arista(origen_uid, predicado, destino_uid):
+    return f'<{origen_uid}> <{predicado}> <{destino_uid}> .'
+
+
+def _mutar_nquads(dgraph_client, set_nquads='', del_nquads=''):
+    txn = dgraph_client.txn()
     try:
-        devoluciones = []
-        with open(file_path, 'r') as file:
-            reader = csv.DictReader(file)
-            for row in reader:
-                devoluciones.append({
-                    'uid': '_:' + row['devolucion_id'],  # Añadir _: para los identificadores personalizados
-                    'dgraph.type': 'devolucion',
-                    'motivo': row['motivo'],
-                })
-            print(f"Loading devoluciones: {devoluciones}")
-            resp = txn.mutate(set_obj=devoluciones)
-        txn.commit()
+        metricas.llamar('mutate', 'aristas', txn.mutate, set_nquads=set_nquads, del_nquads=del_nquads,
+                        commit_now=True, bytes_request=len(set_nquads) + len(del_nquads))
     finally:
         txn.discard()
-    return resp.uids
 
-def load_categoria(file_path):
-    txn = client.txn()
-    resp = None
+
+# Los uids de los extremos pueden venir en un dict (create_data en memoria) o en una
+# tabla del índice persistente (uidmap.TablaUids).
+def buscar_uids(uids, xids):
+    if isinstance(uids, dict):
+        return {xid: uids[xid] for xid in xids if xid in uids}
+    return uids.buscar(xids)
+
+
+# Un lote de aristas es un solo round trip: la mutación lleva commit_now. Las aristas son
+# idempotentes, así que si Dgraph aborta el lote se puede reintentar completo.
+def _commit_aristas(dgraph_client, lote, predicado, uids_origen, uids_destino):
+    origenes = buscar_uids(uids_origen, {origen for origen, _ in lote})
+    destinos = buscar_uids(uids_destino, {destino for _, destino in lote})
+    lineas = [nquad_arista(origenes[o], predicado, destinos[d]) for o, d in lote if o in origenes and d in destinos]
+    if lineas:
+        reintentar(_mutar_nquads, dgraph_client, '\n'.join(lineas))
+        _invalidar_caches(nodos=False)
+    return len(lineas)
+
+
+# Convierte un CSV de relaciones en lotes de N-Quads `<origen> <predicado> <destino> .`
+# de `batch_size` filas y hace commit de cada lote. Sólo se crean aristas cuyos dos
+# extremos existen. Regresa el número de aristas.
+def cargar_aristas(file_path, col_origen, col_destino, predicado, uids_origen, uids_destino,
+                   batch_size=EDGE_BATCH_SIZE, conexiones=None, executor=None):
+    conexiones = conexiones_de(conexiones)
+    aristas = 0
+    inicio = time.perf_counter()
+    pares = ((row[col_origen], row[col_destino]) for row in leer_csv(file_path))
+    enviar = functools.partial(_commit_aristas, predicado=predicado, uids_origen=uids_origen, uids_destino=uids_destino)
+    for n in enviar_chunks(en_chunks(pares, batch_size), enviar, conexiones, executor):
+        aristas += n
+        reportar_progreso(predicado, aristas, inicio, 'aristas')
+    return aristas
+
+
+# Columnas de cada CSV de relaciones: (columna origen, columna destino, predicado).
+# Las comparten los loaders y el exportador RDF.
+COLUMNAS_ARISTAS = {
+    'ha_comprado': ('user_id', 'Productos_id', 'ha_comprado'),
+    'hizo_devolucion': ('user_id', 'devolucion_id', 'hizo_devolucion'),
+    'producto_categoria': ('producto_id', 'categoria', 'tiene_categoria'),
+    'tiene_favoritos': ('user_id', 'Productos_id', 'tiene_favoritos'),
+    'de_producto': ('devolucion_id', 'producto_id', 'De_producto'),
+    'tiene_categoria': ('Productos_id', 'categoria', 'tiene_categoria'),
+}
+
+
+def ha_comprado(file_path, users_uids, productos_uids, batch_size=EDGE_BATCH_SIZE, conexiones=None, executor=None):
+    return cargar_aristas(file_path, *COLUMNAS_ARISTAS['ha_comprado'],
+                          users_uids, productos_uids, batch_size, conexiones, executor)
+
+
+def hizo_devolucion(file_path, users_uids, devoluciones_uids, batch_size=EDGE_BATCH_SIZE, conexiones=None, executor=None):
+    return cargar_aristas(file_path, *COLUMNAS_ARISTAS['hizo_devolucion'],
+                          users_uids, devoluciones_uids, batch_size, conexiones, executor)
+
+
+def producto_categoria(file_path, productos_uids, categorias_uids, batch_size=EDGE_BATCH_SIZE, conexiones=None, executor=None):
+    return cargar_aristas(file_path, *COLUMNAS_ARISTAS['producto_categoria'],
+                          productos_uids, categorias_uids, batch_size, conexiones, executor)
+
+
+def tiene_favoritos(file_path, users_uids, productos_uids, batch_size=EDGE_BATCH_SIZE, conexiones=None, executor=None):
+    return cargar_aristas(file_path, *COLUMNAS_ARISTAS['tiene_favoritos'],
+                          users_uids, productos_uids, batch_size, conexiones, executor)
+
+
+def de_producto(file_path, devoluciones_uids, productos_uids, batch_size=EDGE_BATCH_SIZE, conexiones=None, executor=None):
+    return cargar_aristas(file_path, *COLUMNAS_ARISTAS['de_producto'],
+                          devoluciones_uids, productos_uids, batch_size, conexiones, executor)
+
+
+def tiene_categoria(file_path, productos_uids, categorias_uids, batch_size=EDGE_BATCH_SIZE, conexiones=None, executor=None):
+    return cargar_aristas(file_path, *COLUMNAS_ARISTAS['tiene_categoria'],
+                          productos_uids, categorias_uids, batch_size, conexiones, executor)
+
+
+# Nodos: (nombre, loader, archivo, mapeo de columnas). Ninguno depende de otro.
+NODOS = [
+    ('users', load_Users, 'User.csv', fila_usuario),
+    ('productos', load_productos, 'productos.csv', fila_producto),
+    ('categorias', load_categoria, 'categorias.csv', fila_categoria),
+    ('devoluciones', load_devolucion, 'devoluciones.csv', fila_devolucion),
+]
+
+# Relaciones: (loader, archivo, nodos origen, nodos destino). Necesitan los uids de los nodos.
+RELACIONES = [
+    (tiene_favoritos, 'favoritos.csv', 'users', 'productos'),
+    (ha_comprado, 'ha_comprado.csv', 'users', 'productos'),
+    (hizo_devolucion, 'hizo_devolucion.csv', 'users', 'devoluciones'),
+    (tiene_categoria, 'producto_categoria.csv', 'productos', 'categorias'),
+    (de_producto, 'de_productos.csv', 'devoluciones', 'productos'),
+]
+
+# dgraph.type de cada grupo de nodos.
+TIPOS = {
+    'users': 'User',
+    'productos': 'Producto',
+    'categorias': 'Categoria',
+    'devoluciones': 'devolucion',
+}
+
+
+# (nombre, loader, archivo) de los nodos; con `columnar` todos usan cargar_nodos_columnar.
+def loaders_nodos(columnar=False):
+    if not columnar:
+        return [(nombre, loader, archivo) for nombre, loader, archivo, _ in NODOS]
+    return [(nombre, functools.partial(cargar_nodos_columnar, TIPOS[nombre]), archivo)
+            for nombre, _, archivo, _ in NODOS]
+
+
+# Índice persistente xid -> uid que llenan los loaders de nodos.
+UIDMAP_PATH = '.dgraph_uids.db'
+
+# Índices y manifests abiertos en este proceso (rutas absolutas); drop_all los vacía todos.
+rutas_uidmap = set()
+rutas_manifest = set()
+
+
+def abrir_uidmap(path=UIDMAP_PATH):
+    rutas_uidmap.add(os.path.abspath(path))
+    return UidMap(path)
+
+
+def abrir_manifest(path):
+    rutas_manifest.add(os.path.abspath(path))
+    return Manifest(path)
+
+
+def create_data(client, chunk_size=CHUNK_SIZE, uidmap_path=UIDMAP_PATH, columnar=False):
+    conexiones = conexiones_de(client)
+    uidmap = abrir_uidmap(uidmap_path)
     try:
-        categoria = []
-        with open(file_path, 'r') as file:
-            reader = csv.DictReader(file)
-            for row in reader:
-                categoria.append({
-                    'uid': '_:' + row['categoria'],  # Añadir _: para los identificadores personalizados
-                    'dgraph.type': 'Categoria',
-                    'categoria': row['categoria']
-                })
-            print(f"Loading categorias: {categoria}")
-            resp = txn.mutate(set_obj=categoria)
-        txn.commit()
+        # Cargar nodos
+        uids = {}
+        for nombre, loader, archivo in loaders_nodos(columnar):
+            uids[nombre] = loader(archivo, chunk_size, conexiones, uidmap=uidmap)
+            print(f"{nombre} cargados: {len(uids[nombre])}")
+
+        # Crear relaciones
+        for loader, archivo, origen, destino in RELACIONES:
+            loader(archivo, uids[origen], uids[destino], conexiones=conexiones)
     finally:
-        txn.discard()
-    return resp.uids
+        uidmap.close()
 
+    print("Todos los datos y relaciones fueron creados correctamente.")
 
-#Relaciones:
 
-def ha_comprado(file_path, users_uids, productos_uids):
-    from collections import defaultdict
-    txn = client.txn()
+# Carga sólo las relaciones, leyendo los uids del índice persistente. Sirve para retomar
+# una carga que falló o agregar relaciones de un CSV después. Si el índice no tiene un
+# tipo de nodo (i.e. se borró el archivo) se reconstruye desde el grafo.
+def create_relaciones(client, relaciones=RELACIONES, uidmap_path=UIDMAP_PATH, batch_size=EDGE_BATCH_SIZE):
+    conexiones = conexiones_de(client)
+    uidmap = abrir_uidmap(uidmap_path)
     try:
-        relaciones = defaultdict(list)
-        with open(file_path, 'r') as file:
-            reader = csv.DictReader(file)
-            for row in reader:
-                username = row['user_id']
-                producto_id = row['Productos_id']
-                if username in users_uids and producto_id in productos_uids:
-                    relaciones[users_uids[username]].append({'uid': productos_uids[producto_id]})
-        
-        for user_uid, productos in relaciones.items():
-            mutation = {
-                'uid': user_uid,
-                'ha_comprado': productos
-            }
-            print(f"Relacionando usuario {user_uid} con productos comprados: {[p['uid'] for p in productos]}")
-            txn.mutate(set_obj=mutation)
-        
-        txn.commit()
+        for loader, archivo, origen, destino in relaciones:
+            for nombre in (origen, destino):
+                if uidmap.contar(TIPOS[nombre]) == 0:
+                    print(f"Reconstruyendo uids de {nombre}: {uidmap.reconstruir(client, TIPOS[nombre])}")
+            loader(archivo, uidmap.tabla(TIPOS[origen]), uidmap.tabla(TIPOS[destino]), batch_size, conexiones)
     finally:
-        txn.discard()
+        uidmap.close()
 
 
-def hizo_devolucion(file_path, users_uids, devoluciones_uids):
-    from collections import defaultdict
-    txn = client.txn()
+# Carga en paralelo sobre los canales de `client` (un pool.PoolClientes), un chunk en vuelo
+# por canal. Primero corren todos los loaders de nodos a la vez; cuando terminan todos
+# (barrera), corren todos los loaders de relaciones a la vez.
+def create_data_paralelo(client, chunk_size=CHUNK_SIZE, uidmap_path=UIDMAP_PATH, columnar=False):
+    conexiones = conexiones_de(client)
+    uidmap = abrir_uidmap(uidmap_path)
+    inicio = time.perf_counter()
     try:
-        relaciones = defaultdict(list)
-        with open(file_path, 'r') as file:
-            reader = csv.DictReader(file)
-            for row in reader:
-                user = row['user_id']
-                devolucion_id = row['devolucion_id']
-                if user in users_uids and devolucion_id in devoluciones_uids:
-                    relaciones[users_uids[user]].append({'uid': devoluciones_uids[devolucion_id]})
-        
-        for user_uid, devoluciones in relaciones.items():
-            mutation = {
-                'uid': user_uid,
-                'hizo_devolucion': devoluciones
+        with ThreadPoolExecutor(max_workers=len(conexiones)) as chunks, \
+                ThreadPoolExecutor(max_workers=max(len(NODOS), len(RELACIONES))) as loaders:
+            # Fase 1: nodos
+            futuros = {
+                nombre: loaders.submit(loader, archivo, chunk_size, conexiones, chunks, uidmap)
+                for nombre, loader, archivo in loaders_nodos(columnar)
             }
-            print(f"Relacionando usuario {user_uid} con devoluciones: {[d['uid'] for d in devoluciones]}")
-            txn.mutate(set_obj=mutation)
-        
-        txn.commit()
+            uids = {nombre: futuro.result() for nombre, futuro in futuros.items()}
+            for nombre, nodos in uids.items():
+                print(f"{nombre} cargados: {len(nodos)}")
+
+            # Fase 2: relaciones
+            futuros = [
+                loaders.submit(loader, archivo, uids[origen], uids[destino],
+                               conexiones=conexiones, executor=chunks)
+                for loader, archivo, origen, destino in RELACIONES
+            ]
+            for futuro in futuros:
+                futuro.result()
     finally:
-        txn.discard()
+        uidmap.close()
 
-def producto_categoria(file_path, productos_uids, categorias_uids):
-    txn = client.txn()
+    print(f"Todos los datos y relaciones fueron creados en {time.perf_counter() - inicio:.2f}s "
+          f"usando {len(conexiones)} conexiones.")
+
+
+#Carga incremental (delta):
+
+MANIFEST_PATH = '.dgraph_manifest.db'
+
+
+# Huella de una fila del CSV; si cambia cualquier columna, cambia la huella.
+def huella_fila(row):
+    return hashlib.sha1('\x1f'.join(row.values()).encode('utf-8')).hexdigest()
+
+
+# Busca primero en el índice persistente y sólo pregunta al grafo por los que faltan.
+def resolver_con_uidmap(txn, tipo, xids, uidmap):
+    xids = set(xids)
+    uids = uidmap.buscar(tipo, xids)
+    faltantes = xids.difference(uids)
+    if faltantes:
+        encontrados = resolver_xids(txn, tipo, faltantes)
+        uidmap.guardar(tipo, encontrados)
+        uids.update(encontrados)
+    return uids
+
+
+def _borrar_nodos(dgraph_client, tipo, xids, uidmap):
+    txn = dgraph_client.txn()
     try:
-        relaciones = []
-        with open(file_path, 'r') as file:
-            reader = csv.DictReader(file)
-            for row in reader:
-                producto_id = row['producto_id']
-                categoria = row['categoria']
-                if producto_id in productos_uids and categoria in categorias_uids:
-                    relaciones.append({
-                        'uid': productos_uids[producto_id],
-                        'tiene_categoria': [{'uid': categorias_uids[categoria]}]
-                    })
-
-        for relacion in relaciones:
-            print(f"Relacionando producto {relacion['uid']} con categoría.")
-            txn.mutate(set_obj=relacion)
-
-        txn.commit()
+        uids = resolver_xids(txn, tipo, xids)
+        if uids:
+            lineas = '\n'.join(f'<{uid}> * * .' for uid in uids.values())
+            metricas.llamar('mutate', 'borrar_nodos', txn.mutate, del_nquads=lineas, bytes_request=len(lineas))
+        metricas.llamar('commit', 'borrar_nodos', txn.commit)
     finally:
         txn.discard()
-
-def tiene_favoritos(file_path, users_uids, productos_uids):
-    from collections import defaultdict
-    txn = client.txn()
+    uidmap.borrar(tipo, xids)
+    _invalidar_caches()
+    return len(uids)
+
+
+# Manda sólo las filas nuevas o modificadas desde la última corrida según el manifest.
+# Regresa las huellas nuevas y los xids que ya no están en el CSV (se borran al final,
+# después de quitar las aristas que apuntan a ellos).
+def cargar_nodos_delta(file_path, mapear_fila, manifest, uidmap, chunk_size=CHUNK_SIZE, conexiones=None):
+    conexiones = conexiones_de(conexiones)
+    anteriores = manifest.leer(file_path)
+    huellas = {}
+
+    def cambiados():
+        for row in leer_csv(file_path):
+            nodo = mapear_fila(row)
+            # Un xid repetido en el CSV ya sacó su huella de anteriores; se queda la primera fila.
+            if nodo['xid'] in huellas:
+                continue
+            huellas[nodo['xid']] = huella_fila(row)
+            if anteriores.pop(nodo['xid'], None) != huellas[nodo['xid']]:
+                yield nodo
+
+    filas = 0
+    inicio = time.perf_counter()
+    enviar = functools.partial(_commit_nodos, uidmap=uidmap)
+    for _, n in enviar_chunks(en_chunks(cambiados(), chunk_size), enviar, conexiones):
+        filas += n
+        reportar_progreso(f"{file_path} (nuevas o modificadas)", filas, inicio)
+    return huellas, list(anteriores)
+
+
+def _aplicar_aristas_delta(dgraph_client, lote, predicado, tipo_origen, tipo_destino, uidmap, borrar):
+    txn = dgraph_client.txn()
     try:
-        relaciones = defaultdict(list)
-        with open(file_path, 'r') as file:
-            reader = csv.DictReader(file)
-            for row in reader:
-                user = row['user_id']
-                prod = row['Productos_id']
-                if user in users_uids and prod in productos_uids:
-                    relaciones[users_uids[user]].append({'uid': productos_uids[prod]})
-
-        for user_uid, productos in relaciones.items():
-            mutation = {
-                'uid': user_uid,
-                'tiene_favoritos': productos
-            }
-            print(f"Relacionando {user_uid} con favoritos: {[p['uid'] for p in productos]}")
-            txn.mutate(set_obj=mutation)
-
-        txn.commit()
+        origenes = resolver_con_uidmap(txn, tipo_origen, (origen for origen, _ in lote), uidmap)
+        destinos = resolver_con_uidmap(txn, tipo_destino, (destino for _, destino in lote), uidmap)
+        aplicadas = [(o, d) for o, d in lote if o in origenes and d in destinos]
+        lineas = '\n'.join(nquad_arista(origenes[o], predicado, destinos[d]) for o, d in aplicadas)
+        if lineas:
+            if borrar:
+                metricas.llamar('mutate', 'aristas_delta', txn.mutate, del_nquads=lineas, bytes_request=len(lineas))
+            else:
+                metricas.llamar('mutate', 'aristas_delta', txn.mutate, set_nquads=lineas, bytes_request=len(lineas))
+        metricas.llamar('commit', 'aristas_delta', txn.commit)
     finally:
         txn.discard()
+    if aplicadas:
+        _invalidar_caches(nodos=False)
+    return aplicadas
+
+
+# Agrega las aristas nuevas del CSV y borra las que ya no están. Regresa las claves que
+# quedan en el manifest; las aristas cuyos extremos aún no existen no se guardan para
+# volver a intentarlas en la siguiente corrida.
+def cargar_aristas_delta(file_path, col_origen, col_destino, predicado, tipo_origen, tipo_destino,
+                         manifest, uidmap, batch_size=EDGE_BATCH_SIZE, conexiones=None):
+    conexiones = conexiones_de(conexiones)
+    anteriores = manifest.leer(file_path)
+    huellas = {}
+    vistas = set()
+
+    def nuevas():
+        for row in leer_csv(file_path):
+            clave = row[col_origen] + '\t' + row[col_destino]
+            # Una fila repetida en el CSV ya se vio en esta corrida (y su clave ya salió de anteriores).
+            if clave in vistas:
+                continue
+            vistas.add(clave)
+            if anteriores.pop(clave, None) is None:
+                yield row[col_origen], row[col_destino]
+            else:
+                huellas[clave] = ''
+
+    inicio = time.perf_counter()
+    agregadas = 0
+    aplicar = functools.partial(_aplicar_aristas_delta, predicado=predicado, tipo_origen=tipo_origen,
+                                tipo_destino=tipo_destino, uidmap=uidmap, borrar=False)
+    for aplicadas in enviar_chunks(en_chunks(nuevas(), batch_size), functools.partial(reintentar, aplicar), conexiones):
+        agregadas += len(aplicadas)
+        huellas.update((o + '\t' + d, '') for o, d in aplicadas)
+    reportar_progreso(f"{predicado} (nuevas)", agregadas, inicio, 'aristas')
+
+    borradas = 0
+    quitar = functools.partial(_aplicar_aristas_delta, predicado=predicado, tipo_origen=tipo_origen,
+                               tipo_destino=tipo_destino, uidmap=uidmap, borrar=True)
+    lotes = en_chunks((tuple(clave.split('\t', 1)) for clave in anteriores), batch_size)
+    for aplicadas in enviar_chunks(lotes, functools.partial(reintentar, quitar), conexiones):
+        borradas += len(aplicadas)
+    print(f"{predicado}: {borradas} aristas borradas")
+    return huellas
+
+
+# Recarga incremental: compara cada fila con el manifest de la última corrida y sólo
+# manda lo que es nuevo, cambió o se borró. La primera corrida (sin manifest) carga todo.
+# El manifest de cada archivo se guarda sólo después de aplicar sus cambios, así que una
+# corrida que falla a la mitad se puede repetir.
+def create_data_delta(client, manifest_path=MANIFEST_PATH, chunk_size=CHUNK_SIZE, uidmap_path=UIDMAP_PATH):
+    conexiones = conexiones_de(client)
+    manifest = abrir_manifest(manifest_path)
+    uidmap = abrir_uidmap(uidmap_path)
+    try:
+        # Fase 1: nodos nuevos o modificados
+        pendientes = {}
+        for nombre, _, archivo, mapear_fila in NODOS:
+            pendientes[nombre] = (archivo,) + cargar_nodos_delta(archivo, mapear_fila, manifest, uidmap,
+                                                                    chunk_size, conexiones)
+
+        # Fase 2: aristas nuevas o borradas
+        for loader, archivo, origen, destino in RELACIONES:
+            huellas = cargar_aristas_delta(archivo, *COLUMNAS_ARISTAS[loader.__name__], TIPOS[origen], TIPOS[destino],
+                                           manifest, uidmap, conexiones=conexiones)
+            manifest.guardar(archivo, huellas)
+
+        # Fase 3: nodos que ya no están en los CSV
+        for nombre, (archivo, huellas, borrados) in pendientes.items():
+            total = 0
+            for chunk in en_chunks(borrados, chunk_size):
+                total += reintentar(_borrar_nodos, conexiones.siguiente(), TIPOS[nombre], chunk, uidmap)
+            print(f"{nombre}: {total} nodos borrados")
+            manifest.guardar(archivo, huellas)
+    finally:
+        manifest.close()
+        uidmap.close()
 
+    print("Recarga incremental terminada.")
 
 
-def de_producto(file_path, devoluciones_uids, productos_uids):
-    txn = client.txn()
+#Buscar usuario:
+
+# Lee del cache de resultados o corre la query registrada y guarda lo que regresa. La versión
+# se toma antes de consultar para no guardar un resultado que una escritura ya invalidó.
+def _leer_usuario(client, funcion, nombre_query, bloque, username):
+    resultado = resultados_cache.get(funcion, username)
+    if resultado is not None:
+        return resultado
+
+    version = resultados_cache.version(username)
+    txn = client.txn(read_only=True)
     try:
-        relaciones = []
-        with open(file_path, 'r') as file:
-            reader = csv.DictReader(file)
-            for row in reader:
-                devolucion_id = row['devolucion_id']
-                producto_id = row['producto_id']
-                if devolucion_id in devoluciones_uids and producto_id in productos_uids:
-                    relaciones.append({
-                        'uid': devoluciones_uids[devolucion_id],
-                        'De_producto': [{'uid': productos_uids[producto_id]}]
-                    })
-
-        for relacion in relaciones:
-            print(f"Relacionando devolución {relacion['uid']} con producto devuelto.")
-            txn.mutate(set_obj=relacion)
-
-        txn.commit()
+        resultado = consultas.query(txn, nombre_query, {'$username': username}).get(bloque, [])
     finally:
         txn.discard()
+    resultados_cache.put(funcion, username, resultado, version)
+    return resultado
 
 
-def tiene_categoria(file_path, productos_uids, categorias_uids):
-    txn = client.txn()
+def search_users(client, username):
+    usuarios = _leer_usuario(client, 'search_users', 'search_user', 'search_user', username)
+
+    if not usuarios:
+        print(f"Usuario '{username}' no encontrado.")
+        return None
+
+    usuario = usuarios[0]
+    print(f"Usuario encontrado:\n{json.dumps(usuario, indent=2)}")
+    return usuario
+
+
+#Lecturas por lote:
+
+LOTE_USUARIOS = 500
+HILOS_LOTE = 8
+
+
+def _leer_lote(client, lote, nombre_query):
+    txn = client.txn(read_only=True)
     try:
-        relaciones = []
-        with open(file_path, 'r') as file:
-            reader = csv.DictReader(file)
-            for row in reader:
-                producto_id = row['Productos_id']
-                categoria = row['categoria']
-                if producto_id in productos_uids and categoria in categorias_uids:
-                    relaciones.append({
-                        'uid': productos_uids[producto_id],
-                        'tiene_categoria': [{'uid': categorias_uids[categoria]}]
-                    })
-
-        for relacion in relaciones:
-            print(f"Relacionando producto {relacion['uid']} con categoría {relacion['tiene_categoria'][0]['uid']}.")
-            txn.mutate(set_obj=relacion)
-
-        txn.commit()
+        return consultas.query_lote(txn, nombre_query, lote)
     finally:
         txn.discard()
 
 
+# Como _leer_usuario pero para muchos usernames: los que no están en el cache se piden con
+# una query eq(username, [...]) por lote, con varios lotes en paralelo. Regresa
+# {username: [nodos]} con el mismo contenido que regresaría la query de un solo usuario.
+def _leer_usuarios(client, funcion, nombre_query, usernames, lote=LOTE_USUARIOS, hilos=HILOS_LOTE):
+    resultados = {}
+    pendientes = []
+    for username in dict.fromkeys(usernames):
+        resultado = resultados_cache.get(funcion, username)
+        if resultado is None:
+            pendientes.append(username)
+        else:
+            resultados[username] = resultado
 
-def create_data(client):
-    # Cargar usuarios
-    users_uids = load_Users('User.csv')
-    print(f"Usuarios cargados: {users_uids}")
+    versiones = {username: resultados_cache.version(username) for username in pendientes}
+    conexiones = conexiones_de(client)
+    lotes = list(en_chunks(pendientes, lote))
+    with ThreadPoolExecutor(max_workers=max(1, min(hilos, len(lotes)))) as executor:
+        nodos_por_lote = executor.map(lambda l: _leer_lote(conexiones.siguiente(), l, nombre_query), lotes)
+        encontrados = {}
+        for nodos in nodos_por_lote:
+            for nodo in nodos:
+                encontrados.setdefault(nodo.get('username'), []).append(nodo)
 
-    # Cargar productos
-    productos_uids = load_productos('productos.csv')
-    print(f"Productos cargados: {productos_uids}")
+    for username in pendientes:
+        resultados[username] = encontrados.get(username, [])
+        resultados_cache.put(funcion, username, resultados[username], versiones[username])
+    return resultados
 
-    # Cargar categorías
-    categorias_uids = load_categoria('categorias.csv')
-    print(f"Categorías cargadas: {categorias_uids}")
 
-    # Cargar devoluciones
-    devoluciones_uids = load_devolucion('devoluciones.csv')
-    print(f"Devoluciones cargadas: {devoluciones_uids}")
+# Versiones por lote de search_users, favoritos_del_usuario y devoluciones_por_usuario para
+# jobs que leen muchos usuarios. Regresan {username: resultado}, con None si no hay datos.
+def search_users_lote(client, usernames, lote=LOTE_USUARIOS, hilos=HILOS_LOTE):
+    resultados = _leer_usuarios(client, 'search_users', 'search_user_lote', usernames, lote, hilos)
+    return {username: usuarios[0] if usuarios else None for username, usuarios in resultados.items()}
 
-    # Crear relaciones
-    tiene_favoritos('favoritos.csv', users_uids, productos_uids)
-    ha_comprado('ha_comprado.csv', users_uids, productos_uids)
-    hizo_devolucion('hizo_devolucion.csv', users_uids, devoluciones_uids)
-    tiene_categoria('producto_categoria.csv', productos_uids, categorias_uids)
-    de_producto('de_productos.csv', devoluciones_uids, productos_uids)
 
-    print("Todos los datos y relaciones fueron creados correctamente.")
+def favoritos_del_usuario_lote(client, usernames, lote=LOTE_USUARIOS, hilos=HILOS_LOTE):
+    resultados = _leer_usuarios(client, 'favoritos', 'favoritos_usuario_lote', usernames, lote, hilos)
+    return {username: favoritos or None for username, favoritos in resultados.items()}
 
 
-#Buscar usuario:
+def devoluciones_por_usuario_lote(client, usernames, lote=LOTE_USUARIOS, hilos=HILOS_LOTE):
+    resultados = _leer_usuarios(client, 'devoluciones', 'devoluciones_usuario_lote', usernames, lote, hilos)
+    return {username: devoluciones or None for username, devoluciones in resultados.items()}
 
-def search_users(client, username):
-    query = f"""
-    {{
-        search_user(func: eq(username, "{username}")) @filter(type(User)) {{
-            username
-            email
-            phone
-            birthdate
-            created_at
-            ha_comprado{{
-                nombre
-                precio
-            }} 
-            tiene_favoritos{{
-                nombre
-                precio
-            }}
-            hizo_devolucion {{
-                motivo
-                De_producto {{
-                    nombre 
-                    precio
-                }}
-            }}
-            
-        }}
-    }}
-    """
+
+#Cache de uids:
+
+def _consultar_uid(client, nombre_query, variables, bloque):
     txn = client.txn(read_only=True)
     try:
-        res = txn.query(query)
-        data = json.loads(res.json)
-        usuarios = data.get("search_user", [])
-        
-        if not usuarios:
-            print(f"Usuario '{username}' no encontrado.")
-            return None
-
-        usuario = usuarios[0]
-        print(f"Usuario encontrado:\n{json.dumps(usuario, indent=2)}")
-        return usuario
+        encontrados = consultas.query(txn, nombre_query, variables).get(bloque, [])
     finally:
         txn.discard()
+    return encontrados[0]['uid'] if encontrados else None
+
+
+# Los nombres que no existen no se guardan en el cache.
+def uid_de_producto(client, nombre):
+    uid = uid_cache.get(('Producto', nombre))
+    if uid is None:
+        uid = _consultar_uid(client, 'uid_producto', {'$nombre': nombre}, 'search_producto')
+        if uid is not None:
+            uid_cache.put(('Producto', nombre), uid)
+    return uid
+
+
+def uid_de_usuario(client, username):
+    uid = uid_cache.get(('User', username))
+    if uid is None:
+        uid = _consultar_uid(client, 'uid_usuario', {'$username': username}, 'search_user')
+        if uid is not None:
+            uid_cache.put(('User', username), uid)
+    return uid
+
+
+def estadisticas_cache():
+    return {'uids': uid_cache.stats(), 'resultados': resultados_cache.stats(), 'busquedas': busquedas_cache.stats(),
+            'productos': productos_cache.stats()}
+
+
+# Tiempo por query registrada (consultas.QUERIES), de la más costosa a la menos.
+def estadisticas_queries():
+    return consultas.estadisticas_queries()
 
 
 # Queries guardar en favoritos:
 def guardar_en_favoritos(client, username, productoNombre):
     # 1. Buscar el UID del producto por nombre
-    query_producto = f"""
-    {{
-        search_producto(func: eq(nombre, "{productoNombre}")) @filter(type(Producto)) {{
-            uid
-            nombre
-        }}
-    }}
-    """
-    txn = client.txn(read_only=True)
-    try:
-        res = txn.query(query_producto)
-        data = json.loads(res.json)
-        productos = data.get("search_producto", [])
-        
-        if not productos:
-            print(f"Producto '{productoNombre}' no encontrado.")
-            return
-        producto_uid = productos[0]["uid"]
-        print(f"Producto encontrado: {productoNombre} -> UID: {producto_uid}")
-    finally:
-        txn.discard()
+    producto_uid = uid_de_producto(client, productoNombre)
+    if not producto_uid:
+        print(f"Producto '{productoNombre}' no encontrado.")
+        return
+    print(f"Producto encontrado: {productoNombre} -> UID: {producto_uid}")
 
     # 2. Buscar el UID del usuario por username
-    query_user = f"""
-    {{
-        search_user(func: eq(username, "{username}")) @filter(type(User)) {{
-            uid
-            username
-        }}
-    }}
-    """
-    txn = client.txn(read_only=True)
-    try:
-        res = txn.query(query_user)
-        data = json.loads(res.json)
-        usuarios = data.get("search_user", [])
-        
-        if not usuarios:
-            print(f"Usuario '{username}' no encontrado.")
-            return
-        user_uid = usuarios[0]["uid"]
-        print(f"Usuario encontrado: {username} -> UID: {user_uid}")
-    finally:
-        txn.discard()
+    user_uid = uid_de_usuario(client, username)
+    if not user_uid:
+        print(f"Usuario '{username}' no encontrado.")
+        return
+    print(f"Usuario encontrado: {username} -> UID: {user_uid}")
 
     # 3. Agregar el producto a favoritos del usuario
     txn = client.txn()
@@ -436,189 +940,472 @@ def guardar_en_favoritos(client, username, productoNombre):
             'uid': user_uid,
             'tiene_favoritos': [{'uid': producto_uid}]
         }
-        txn.mutate(set_obj=mutation, commit_now=True)
+        mutation = txn.create_mutation(set_obj=mutation)
+        metricas.llamar('mutate', 'guardar_favorito', txn.mutate, mutation, commit_now=True,
+                        bytes_request=mutation.ByteSize())
         print(f"Producto '{productoNombre}' agregado a favoritos del usuario '{username}'.")
     finally:
         txn.discard()
+    resultados_cache.invalidar(username)
+    productos_cache.invalidar(productoNombre)
+    if motor_recomendaciones is not None:
+        motor_recomendaciones.agregar_favorito(username, productoNombre)
 
 
-# Query para hacer la devolucion de un producto.
-def registrar_devolucion(client, nombreProducto, motivo, username):
-    # 1. Buscar UID del producto
-    query_producto = f"""
-    {{
-        producto(func: eq(nombre, "{nombreProducto}")) @filter(type(Producto)) {{
-            uid
+# Favoritos por request en guardar_en_favoritos_bulk.
+FAVORITOS_BATCH_SIZE = 500
+
+
+# Un upsert para todo el lote. Los bloques `usuarios` y `productos` sólo sirven para
+# saber cuáles pares existían. Regresa True/False por cada par.
+def _upsert_favoritos(client, lote):
+    usuarios, productos, query, variables = _variables_upsert(lote)
+    query += f"""
+
+        usuarios(func: uid({', '.join(usuarios.values())})) {{
+            username
+        }}
+        productos(func: uid({', '.join(productos.values())})) {{
             nombre
         }}
     }}
     """
-    txn = client.txn(read_only=True)
+    txn = client.txn()
     try:
-        res = txn.query(query_producto)
-        data = json.loads(res.json)
-        productos = data.get("producto", [])
-        if not productos:
-            print(f"Producto '{nombreProducto}' no encontrado.")
-            return
-        producto_uid = productos[0]["uid"]
+        mutaciones = [
+            txn.create_mutation(set_nquads=f'uid({usuarios[u]}) <tiene_favoritos> uid({productos[p]}) .',
+                                cond=f'@if(eq(len({usuarios[u]}), 1) AND eq(len({productos[p]}), 1))')
+            for u, p in dict.fromkeys(lote)
+        ]
+        res = consultas.upsert(txn, 'guardar_favoritos', variables, mutaciones, texto=query)
     finally:
         txn.discard()
+    for username in usuarios:
+        resultados_cache.invalidar(username)
+    for nombre in productos:
+        productos_cache.invalidar(nombre)
+    data = json.loads(res.json)
+    encontrados_u = {usuario['username'] for usuario in data.get('usuarios', [])}
+    encontrados_p = {producto['nombre'] for producto in data.get('productos', [])}
+    resultados = [u in encontrados_u and p in encontrados_p for u, p in lote]
+    if motor_recomendaciones is not None:
+        motor_recomendaciones.agregar_favoritos([par for par, guardado in zip(lote, resultados) if guardado])
+    return resultados
+
+
+# Guarda muchos favoritos (pares (username, nombreProducto)) con un upsert por lote.
+# Regresa True/False por cada par en el mismo orden.
+def guardar_en_favoritos_bulk(client, pares, batch_size=FAVORITOS_BATCH_SIZE):
+    resultados = []
+    for lote in en_chunks(pares, batch_size):
+        resultados.extend(reintentar(_upsert_favoritos, client, lote))
+    return resultados
+
+
+# Junta los favoritos que llegan dentro de una ventana corta (o hasta `max_items`) y los
+# guarda juntos con un solo upsert, en lugar de un commit por click. Cada llamada a
+# guardar() regresa un Future que se resuelve con True/False para ese favorito, o con la
+# excepción si el lote falló después de los reintentos.
+class FavoritosWriter:
+    def __init__(self, client, ventana=0.01, max_items=FAVORITOS_BATCH_SIZE):
+        self.client = client
+        self.ventana = ventana
+        self.max_items = max_items
+        self._cola = queue.Queue()
+        self._hilo = threading.Thread(target=self._correr, name='FavoritosWriter', daemon=True)
+        self._hilo.start()
+
+    def guardar(self, username, productoNombre):
+        futuro = Future()
+        self._cola.put((username, productoNombre, futuro))
+        return futuro
+
+    # Espera a que se escriba todo lo pendiente y detiene el hilo.
+    def close(self):
+        self._cola.put(None)
+        self._hilo.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _correr(self):
+        cerrar = False
+        while not cerrar:
+            item = self._cola.get()
+            if item is None:
+                break
+            lote = [item]
+            limite = time.monotonic() + self.ventana
+            while len(lote) < self.max_items:
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    break
+                try:
+                    item = self._cola.get(timeout=restante)
+                except queue.Empty:
+                    break
+                if item is None:
+                    cerrar = True
+                    break
+                lote.append(item)
+            self._escribir(lote)
+
+    def _escribir(self, lote):
+        try:
+            resultados = reintentar(_upsert_favoritos, self.client, [(u, p) for u, p, _ in lote])
+        except Exception as e:
+            for _, _, futuro in lote:
+                futuro.set_exception(e)
+            return
+        for (_, _, futuro), resultado in zip(lote, resultados):
+            futuro.set_result(resultado)
 
-    # 2. Buscar UID del usuario
-    query_user = f"""
-    {{
-        user(func: eq(username, "{username}")) @filter(type(User)) {{
-            uid
-            username
-        }}
-    }}
+
+# Query para hacer la devolucion de un producto.
+
+# N-Quads de una devolución nueva ligada al usuario de la variable `u` y al producto de `p`.
+def _nquads_devolucion(blank, motivo, u, p):
+    return f"""
+        _:{blank} <dgraph.type> "devolucion" .
+        _:{blank} <motivo> {json.dumps(motivo, ensure_ascii=False)} .
+        _:{blank} <De_producto> uid({p}) .
+        uid({u}) <hizo_devolucion> _:{blank} .
     """
-    txn = client.txn(read_only=True)
+
+
+# Condición de los upserts que ligan un usuario con un producto: que existan los dos.
+def _condicion_usuario_producto(u, p):
+    return f'@if(eq(len({u}), 1) AND eq(len({p}), 1))'
+
+
+# Un solo upsert: busca usuario y producto, crea la devolución y la liga a los dos en el
+# mismo commit. Si falta alguno la condición no se cumple y no se escribe nada.
+def _upsert_devolucion(client, nombreProducto, motivo, username):
+    txn = client.txn()
     try:
-        res = txn.query(query_user)
-        data = json.loads(res.json)
-        usuarios = data.get("user", [])
-        if not usuarios:
-            print(f"Usuario '{username}' no encontrado.")
-            return
-        user_uid = usuarios[0]["uid"]
+        mutation = txn.create_mutation(set_nquads=_nquads_devolucion('devolucion', motivo, 'u', 'p'),
+                                       cond=_condicion_usuario_producto('u', 'p'))
+        res = consultas.upsert(txn, 'registrar_devolucion',
+                               {'$username': username, '$nombre': nombreProducto}, [mutation])
     finally:
         txn.discard()
+    resultados_cache.invalidar(username)
+    return res
+
+
+def registrar_devolucion(client, nombreProducto, motivo, username):
+    res = reintentar(_upsert_devolucion, client, nombreProducto, motivo, username)
+    data = json.loads(res.json)
+    if not data.get('producto'):
+        print(f"Producto '{nombreProducto}' no encontrado.")
+        return
+    if not data.get('usuario'):
+        print(f"Usuario '{username}' no encontrado.")
+        return
+
+    devolucion_uid = res.uids.get('devolucion')
+    if not devolucion_uid:
+        print("Error al crear la devolución.")
+        return
+    print(f"Devolución creada con UID: {devolucion_uid}, "
+          f"relacionada con usuario {username} y producto '{nombreProducto}'.")
+    if agregados_devoluciones is not None:
+        agregados_devoluciones.registrar(nombreProducto, motivo)
+    return devolucion_uid
+
+
+# Devoluciones por request en registrar_devoluciones.
+DEVOLUCIONES_BATCH_SIZE = 500
+
+
+# Variables de un upsert por lote: una por cada usuario y producto distintos de los pares
+# (username, nombreProducto). Regresa {username: 'u0'}, {nombre: 'p0'}, la cabecera
+# `query lote($u0: string, ...)` con los bloques var, y los valores de las $variables.
+def _variables_upsert(pares):
+    usuarios = {}
+    productos = {}
+    bloques = []
+    variables = {}
+    for username, nombreProducto in pares:
+        if username not in usuarios:
+            u = usuarios[username] = f'u{len(usuarios)}'
+            variables[f'${u}'] = username
+            bloques.append(f'{u} as var(func: eq(username, ${u}), first: 1) @filter(type(User))')
+        if nombreProducto not in productos:
+            p = productos[nombreProducto] = f'p{len(productos)}'
+            variables[f'${p}'] = nombreProducto
+            bloques.append(f'{p} as var(func: eq(nombre, ${p}), first: 1) @filter(type(Producto))')
+    cabecera = 'query lote(' + ', '.join(f'{v}: string' for v in variables) + ')'
+    return usuarios, productos, cabecera + ' {\n' + '\n'.join(bloques), variables
+
+
+# Un upsert para todo el lote: una variable por usuario y producto distintos y una mutación
+# condicional por devolución. Regresa el uid de cada devolución o None si no se creó.
+def _upsert_devoluciones(client, lote):
+    usuarios, productos, query, variables = _variables_upsert((username, nombre) for username, nombre, _ in lote)
+    query += '\n}'
 
-    # 3. Crear el nodo de devolución
     txn = client.txn()
     try:
-        devolucion_node = {
-            'uid': '_:devolucion',
-            'dgraph.type': 'devolucion',
-            'motivo': motivo
-        }
-        res = txn.mutate(set_obj=devolucion_node, commit_now=True)
-        devolucion_uid = res.uids.get('devolucion')
-        if not devolucion_uid:
-            print("Error al crear la devolución.")
-            return
-        print(f"Devolución creada con UID: {devolucion_uid}")
+        mutaciones = []
+        for i, (username, nombreProducto, motivo) in enumerate(lote):
+            u, p = usuarios[username], productos[nombreProducto]
+            mutaciones.append(txn.create_mutation(set_nquads=_nquads_devolucion(f'dev{i}', motivo, u, p),
+                                                  cond=_condicion_usuario_producto(u, p)))
+        res = consultas.upsert(txn, 'registrar_devoluciones', variables, mutaciones, texto=query)
     finally:
         txn.discard()
-
-    # 4. Relacionar usuario con devolución
+    for username in usuarios:
+        resultados_cache.invalidar(username)
+    uids = [res.uids.get(f'dev{i}') for i in range(len(lote))]
+    if agregados_devoluciones is not None:
+        for uid, (_, nombreProducto, motivo) in zip(uids, lote):
+            if uid:
+                agregados_devoluciones.registrar(nombreProducto, motivo)
+    return uids
+
+
+# Registra muchas devoluciones con pocos requests. `devoluciones` es una lista de
+# (username, nombreProducto, motivo) o la ruta de un CSV con columnas username,producto,motivo.
+# Regresa el uid de cada devolución en el mismo orden (None si no existe el usuario o el producto).
+def registrar_devoluciones(client, devoluciones, batch_size=DEVOLUCIONES_BATCH_SIZE):
+    if isinstance(devoluciones, str):
+        devoluciones = ((row['username'], row['producto'], row['motivo']) for row in leer_csv(devoluciones))
+
+    uids = []
+    inicio = time.perf_counter()
+    for lote in en_chunks(devoluciones, batch_size):
+        uids.extend(reintentar(_upsert_devoluciones, client, lote))
+        reportar_progreso('Devoluciones registradas', len(uids), inicio)
+    fallidas = uids.count(None)
+    if fallidas:
+        print(f"{fallidas} devoluciones sin usuario o producto existente.")
+    return uids
+
+
+#Compras:
+
+def _upsert_compra(client, nombreProducto, username):
     txn = client.txn()
     try:
-        relacion1 = {
-            'uid': user_uid,
-            'hizo_devolucion': [{'uid': devolucion_uid}]
-        }
-        txn.mutate(set_obj=relacion1, commit_now=True)
-        print(f"Relacionada devolución con usuario {username}.")
+        mutation = txn.create_mutation(set_nquads='uid(u) <ha_comprado> uid(p) .',
+                                       cond=_condicion_usuario_producto('u', 'p'))
+        res = consultas.upsert(txn, 'registrar_compra', {'$username': username, '$nombre': nombreProducto}, [mutation])
     finally:
         txn.discard()
-
-    # 5. Relacionar devolución con producto
-    txn = client.txn()
+    resultados_cache.invalidar(username)
+    productos_cache.invalidar(nombreProducto)
+    return res
+
+
+# Liga la compra al usuario en un solo upsert; volver a registrarla no duplica la arista.
+def registrar_compra(client, username, nombreProducto):
+    data = json.loads(reintentar(_upsert_compra, client, nombreProducto, username).json)
+    if not data.get('producto'):
+        print(f"Producto '{nombreProducto}' no encontrado.")
+        return False
+    if not data.get('usuario'):
+        print(f"Usuario '{username}' no encontrado.")
+        return False
+    # La query ve el grafo de antes de la mutación: si ya la tenía no cuenta como compra nueva.
+    if data['usuario'][0].get('comprado'):
+        print(f"El usuario '{username}' ya había comprado '{nombreProducto}'.")
+        return True
+    print(f"Compra de '{nombreProducto}' registrada para el usuario '{username}'.")
+    if agregados_devoluciones is not None:
+        agregados_devoluciones.registrar_compra(nombreProducto)
+    return True
+
+
+#También compraron:
+
+# Usuarios del producto (y productos de cada usuario) que se recorren como máximo, para que
+# la latencia no crezca con el historial de un producto muy popular.
+FANOUT_TAMBIEN = 1000
+# Productos que se calculan y se guardan en el cache por producto (más si piden más).
+TOP_TAMBIEN = 20
+
+
+# El cache guarda (límite, productos): se calculan al menos TOP_TAMBIEN y sólo se vuelve a
+# consultar si piden más de los que tiene la entrada.
+def _leer_producto(client, funcion, nombreProducto, first):
+    entrada = productos_cache.get(funcion, nombreProducto)
+    if entrada is not None and entrada[0] >= first:
+        return entrada[1][:first]
+
+    limite = max(first, TOP_TAMBIEN)
+    version = productos_cache.version(nombreProducto)
+    variables = {'$nombre': nombreProducto, '$fanout': str(FANOUT_TAMBIEN), '$first': str(limite)}
+    txn = client.txn(read_only=True)
     try:
-        relacion2 = {
-            'uid': devolucion_uid,
-            'De_producto': [{'uid': producto_uid}]
-        }
-        txn.mutate(set_obj=relacion2, commit_now=True)
-        print(f"Relacionada devolución con producto '{nombreProducto}'.")
+        resultado = consultas.query(txn, funcion, variables).get('productos', [])
     finally:
         txn.discard()
+    productos_cache.put(funcion, nombreProducto, (limite, resultado), version)
+    return resultado[:first]
 
 
-# Query historial de devolucion 
+# Productos que más compraron quienes compraron `nombreProducto`, con `veces` = cuántos de
+# ellos (entre los primeros FANOUT_TAMBIEN compradores).
+def tambien_compraron(client, nombreProducto, first=10):
+    return _leer_producto(client, 'tambien_compraron', nombreProducto, first)
 
-def devoluciones_por_usuario(client, username):
-    query = f"""
-    {{
-        devoluciones_usuario(func: eq(username, "{username}")) @filter(type(User)) {{
-            username
-            hizo_devolucion @filter(type(devolucion)) {{
-                motivo
-                De_producto @filter(type(Producto)) {{
-                    nombre
-                    precio
-                }}
-            }}
-        }}
-    }}
-    """
+
+def tambien_en_favoritos(client, nombreProducto, first=10):
+    return _leer_producto(client, 'tambien_favoritos', nombreProducto, first)
+
+
+#Buscar productos:
+
+PAGINA_BUSQUEDA = 20
+
+
+# Búsqueda de productos por nombre con el índice fulltext (stemming y stop words), con
+# filtro opcional de precio. Con `todas` el producto debe tener todas las palabras
+# (alloftext); si no, basta con alguna (anyoftext). La paginación es por cursor: se pasa
+# `siguiente` de la página anterior como `after`.
+def buscar_productos(client, texto, precio_min=None, precio_max=None, first=PAGINA_BUSQUEDA, after=None, todas=False):
+    nombre_query = 'buscar_productos_todas' if todas else 'buscar_productos'
+    llave = (nombre_query, ' '.join(texto.lower().split()), precio_min, precio_max, first, after)
+    pagina = busquedas_cache.get(llave)
+    if pagina is not None:
+        return pagina
+
+    variables = {
+        '$texto': texto,
+        '$min': str(-sys.float_info.max if precio_min is None else float(precio_min)),
+        '$max': str(sys.float_info.max if precio_max is None else float(precio_max)),
+        '$first': str(first),
+        '$after': after or '0x0',
+    }
     txn = client.txn(read_only=True)
     try:
-        res = txn.query(query)
-        data = json.loads(res.json)
-        devoluciones = data.get("devoluciones_usuario", [])
+        productos = consultas.query(txn, nombre_query, variables).get('productos', [])
+    finally:
+        txn.discard()
+    pagina = {
+        'productos': productos,
+        'siguiente': productos[-1]['uid'] if len(productos) == first else None,
+    }
+    busquedas_cache.put(llave, pagina)
+    return pagina
 
-        if not devoluciones:
-            print(f"No se encontraron devoluciones para el usuario '{username}'.")
-            return
 
-        print(f"Devoluciones del usuario '{username}':\n{json.dumps(devoluciones, indent=2)}")
+#Lecturas por páginas:
+
+PAGINA_ARISTAS = 1000
+
+
+# Versiones por páginas de favoritos_del_usuario / devoluciones_por_usuario y de las compras
+# de search_users: regresan un registro a la vez sin traer toda la lista en una respuesta.
+def iterar_favoritos(client, username, pagina=PAGINA_ARISTAS):
+    return consultas.paginar(client, 'favoritos_pagina', 'usuario', pagina, {'$username': username}, 'tiene_favoritos')
+
+
+def iterar_compras(client, username, pagina=PAGINA_ARISTAS):
+    return consultas.paginar(client, 'compras_pagina', 'usuario', pagina, {'$username': username}, 'ha_comprado')
+
+
+def iterar_devoluciones(client, username, pagina=PAGINA_ARISTAS):
+    return consultas.paginar(client, 'devoluciones_pagina', 'usuario', pagina, {'$username': username}, 'hizo_devolucion')
+
+
+# Sólo los totales de favoritos, compras y devoluciones; None si el usuario no existe.
+def contar_interacciones(client, username):
+    txn = client.txn(read_only=True)
+    try:
+        usuarios = consultas.query(txn, 'conteos_usuario', {'$username': username}).get('usuario', [])
     finally:
         txn.discard()
+    if not usuarios:
+        return None
+    return {k: usuarios[0].get(k, 0) for k in ('favoritos', 'compras', 'devoluciones')}
 
-        
-# obtener los favoritos del usuario.
-def favoritos_del_usuario(client, username):
+
+# Cuántos usuarios tienen al menos `minimo` aristas `predicado` (tiene_favoritos,
+# ha_comprado o hizo_devolucion). Usa el índice @count del predicado.
+def contar_usuarios_con(client, predicado, minimo=1):
+    if predicado not in ('tiene_favoritos', 'ha_comprado', 'hizo_devolucion'):
+        raise ValueError(f"Predicado sin índice @count: {predicado}")
     query = f"""
-    {{
-        usuario_favoritos(func: eq(username, "{username}")) @filter(type(User)) {{
-            username
-            tiene_favoritos @filter(type(Producto)) {{
-                nombre
-                precio
-                descripcion
-                stock
-            }}
+    query contar_usuarios_con($minimo: int) {{
+        usuarios(func: ge(count({predicado}), $minimo)) @filter(type(User)) {{
+            total: count(uid)
         }}
     }}
     """
     txn = client.txn(read_only=True)
     try:
-        res = txn.query(query)
-        data = json.loads(res.json)
-        favoritos = data.get("usuario_favoritos", [])
-
-        if not favoritos:
-            print(f"No se encontraron productos favoritos para el usuario '{username}'.")
-            return
-
-        print(f"Favoritos del usuario '{username}':\n{json.dumps(favoritos, indent=2)}")
+        res = metricas.llamar('query', 'contar_usuarios_con', txn.query, query, variables={'$minimo': str(minimo)})
+        usuarios = metricas.decodificar('contar_usuarios_con', res).get('usuarios', [])
     finally:
         txn.discard()
+    return usuarios[0]['total'] if usuarios else 0
+
+
+# Query historial de devolucion 
+
+def devoluciones_por_usuario(client, username):
+    devoluciones = _leer_usuario(client, 'devoluciones', 'devoluciones_usuario', 'devoluciones_usuario', username)
+
+    if not devoluciones:
+        print(f"No se encontraron devoluciones para el usuario '{username}'.")
+        return
+
+    print(f"Devoluciones del usuario '{username}':\n{json.dumps(devoluciones, indent=2)}")
+    return devoluciones
+
+        
+# obtener los favoritos del usuario.
+def favoritos_del_usuario(client, username):
+    favoritos = _leer_usuario(client, 'favoritos', 'favoritos_usuario', 'usuario_favoritos', username)
+
+    if not favoritos:
+        print(f"No se encontraron productos favoritos para el usuario '{username}'.")
+        return
+
+    print(f"Favoritos del usuario '{username}':\n{json.dumps(favoritos, indent=2)}")
+    return favoritos
 
 # Recomendacion de productos.
+# Con el motor activo se leen las recomendaciones precalculadas; si el usuario todavía no
+# está en el motor se usa la query en vivo.
 def recomendaciones_por_categoria(client, username):
-    query = f"""
-    {{
-        var(func: eq(username, "{username}")) @filter(type(User)) {{
-            fav as tiene_favoritos @filter(type(Producto)) {{
-                cat as tiene_categoria
-            }}
-        }}
+    if motor_recomendaciones is not None:
+        data = motor_recomendaciones.recomendar(username)
+        if data is not None:
+            print(f"Recomendaciones para usuario '{username}':\n{json.dumps(data, indent=2)}")
+            return data
 
-        recomendaciones(func: uid(cat)) @filter(type(Categoria)) {{
-            categoria
-            recomendaciones: ~tiene_categoria @filter(type(Producto) AND NOT uid(fav)) (first: 2) {{
-                uid
-                nombre
-                precio
-                descripcion
-                stock
-            }}
-        }}
-    }}
-    """
     txn = client.txn(read_only=True)
     try:
-        res = txn.query(query)
-        data = json.loads(res.json)
+        data = consultas.query(txn, 'recomendaciones_categoria', {'$username': username})
         print(f"Recomendaciones para usuario '{username}':\n{json.dumps(data, indent=2)}")
     finally:
         txn.discard()
+    return data
 
     
 def drop_all(client):
-    return client.alter(pydgraph.Operation(drop_all=True))
+    resp = metricas.llamar('alter', 'drop_all', client.alter, pydgraph.Operation(drop_all=True))
+    _invalidar_caches()
+    if agregados_devoluciones is not None:
+        agregados_devoluciones.limpiar()
+    # Los uids de los índices persistentes ya no existen y la siguiente carga delta debe mandar
+    # todo: se vacían los de las rutas por defecto y los de cualquier otra ruta que se usó.
+    for path in rutas_uidmap | {os.path.abspath(UIDMAP_PATH)}:
+        if os.path.exists(path):
+            uidmap = UidMap(path)
+            uidmap.limpiar()
+            uidmap.close()
+    for path in rutas_manifest | {os.path.abspath(MANIFEST_PATH)}:
+        if os.path.exists(path):
+            manifest = Manifest(path)
+            manifest.limpiar()
+            manifest.close()
+    # drop_all también borra el schema, y las cargas dependen de xid @index(exact) @upsert.
+    set_schema(client, forzar=True)
+    return resp
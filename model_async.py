@@ -0,0 +1,193 @@
+# Versión asyncio de las funciones públicas de model.py, para servicios que atienden muchos
+# usuarios a la vez en un solo proceso.
+#
+# Las lecturas usan las queries asíncronas de pydgraph (txn.async_query regresa un future de
+# gRPC) y no ocupan un hilo mientras esperan, así que cientos pueden estar en vuelo sobre el
+# mismo canal. Las escrituras encadenan búsquedas de uid, upserts y reintentos, así que se
+# mandan a un ThreadPoolExecutor compartido con las funciones de model.py tal cual.
+#
+# Usan los mismos caches que model.py (uids y resultados por usuario) y el mismo motor de
+# recomendaciones. A diferencia de model.py no imprimen nada, sólo regresan los datos.
+#
+# i.e.:
+#   usuario, favoritos = await asyncio.gather(
+#       model_async.search_users(client, 'user_1'),
+#       model_async.favoritos_del_usuario(client, 'user_1'))
+import asyncio
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pydgraph
+
+import consultas
+import metricas
+import model
+
+
+# Hilos para las escrituras; las lecturas no usan hilos.
+MAX_HILOS = 32
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=MAX_HILOS, thread_name_prefix='model_async')
+        return _executor
+
+
+def cerrar():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=True)
+            _executor = None
+
+
+# Corre una función síncrona de model.py en el executor compartido.
+async def _en_executor(funcion, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor(), functools.partial(funcion, *args))
+
+
+# Convierte un future de gRPC en uno de asyncio. El callback corre en un hilo de gRPC.
+def _esperar(futuro_grpc):
+    loop = asyncio.get_running_loop()
+    futuro = loop.create_future()
+
+    def listo(f):
+        loop.call_soon_threadsafe(_resolver, futuro, f)
+
+    futuro_grpc.add_done_callback(listo)
+    return futuro
+
+
+def _resolver(futuro, futuro_grpc):
+    if futuro.cancelled():
+        return
+    try:
+        futuro.set_result(pydgraph.Txn.handle_query_future(futuro_grpc))
+    except Exception as e:
+        futuro.set_exception(e)
+
+
+# Igual que consultas.query pero sin bloquear; se registra en metricas.
+async def query(client, nombre, variables=None):
+    txn = client.txn(read_only=True)
+    inicio = time.perf_counter()
+    res = error = None
+    try:
+        res = await _esperar(txn.async_query(consultas.QUERIES[nombre], variables=variables))
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        metricas.registrar('query', nombre, time.perf_counter() - inicio, res, error=error)
+        txn.discard()
+    return metricas.decodificar(nombre, res)
+
+
+# Mismo protocolo de versión que model._leer_usuario.
+async def _leer_usuario(client, funcion, nombre_query, bloque, username):
+    resultado = model.resultados_cache.get(funcion, username)
+    if resultado is not None:
+        return resultado
+
+    version = model.resultados_cache.version(username)
+    resultado = (await query(client, nombre_query, {'$username': username})).get(bloque, [])
+    model.resultados_cache.put(funcion, username, resultado, version)
+    return resultado
+
+
+#Lecturas:
+
+async def search_users(client, username):
+    usuarios = await _leer_usuario(client, 'search_users', 'search_user', 'search_user', username)
+    return usuarios[0] if usuarios else None
+
+
+async def favoritos_del_usuario(client, username):
+    favoritos = await _leer_usuario(client, 'favoritos', 'favoritos_usuario', 'usuario_favoritos', username)
+    return favoritos or None
+
+
+async def devoluciones_por_usuario(client, username):
+    devoluciones = await _leer_usuario(client, 'devoluciones', 'devoluciones_usuario', 'devoluciones_usuario', username)
+    return devoluciones or None
+
+
+async def recomendaciones_por_categoria(client, username):
+    if model.motor_recomendaciones is not None:
+        data = model.motor_recomendaciones.recomendar(username)
+        if data is not None:
+            return data
+    return await query(client, 'recomendaciones_categoria', {'$username': username})
+
+
+# Mismo protocolo de versión y de límite que model._leer_producto.
+async def _leer_producto(client, funcion, nombreProducto, first):
+    entrada = model.productos_cache.get(funcion, nombreProducto)
+    if entrada is not None and entrada[0] >= first:
+        return entrada[1][:first]
+
+    limite = max(first, model.TOP_TAMBIEN)
+    version = model.productos_cache.version(nombreProducto)
+    variables = {'$nombre': nombreProducto, '$fanout': str(model.FANOUT_TAMBIEN), '$first': str(limite)}
+    resultado = (await query(client, funcion, variables)).get('productos', [])
+    model.productos_cache.put(funcion, nombreProducto, (limite, resultado), version)
+    return resultado[:first]
+
+
+async def tambien_compraron(client, nombreProducto, first=10):
+    return await _leer_producto(client, 'tambien_compraron', nombreProducto, first)
+
+
+async def tambien_en_favoritos(client, nombreProducto, first=10):
+    return await _leer_producto(client, 'tambien_favoritos', nombreProducto, first)
+
+
+async def uid_de_usuario(client, username):
+    uid = model.uid_cache.get(('User', username))
+    if uid is None:
+        encontrados = (await query(client, 'uid_usuario', {'$username': username})).get('search_user', [])
+        if encontrados:
+            uid = encontrados[0]['uid']
+            model.uid_cache.put(('User', username), uid)
+    return uid
+
+
+async def uid_de_producto(client, nombre):
+    uid = model.uid_cache.get(('Producto', nombre))
+    if uid is None:
+        encontrados = (await query(client, 'uid_producto', {'$nombre': nombre})).get('search_producto', [])
+        if encontrados:
+            uid = encontrados[0]['uid']
+            model.uid_cache.put(('Producto', nombre), uid)
+    return uid
+
+
+#Escrituras:
+
+async def guardar_en_favoritos(client, username, productoNombre):
+    return await _en_executor(model.guardar_en_favoritos, client, username, productoNombre)
+
+
+async def guardar_en_favoritos_bulk(client, pares, batch_size=model.FAVORITOS_BATCH_SIZE):
+    return await _en_executor(model.guardar_en_favoritos_bulk, client, list(pares), batch_size)
+
+
+async def registrar_devolucion(client, nombreProducto, motivo, username):
+    return await _en_executor(model.registrar_devolucion, client, nombreProducto, motivo, username)
+
+
+async def registrar_devoluciones(client, devoluciones, batch_size=model.DEVOLUCIONES_BATCH_SIZE):
+    return await _en_executor(model.registrar_devoluciones, client, devoluciones, batch_size)
+
+
+async def registrar_compra(client, username, nombreProducto):
+    return await _en_executor(model.registrar_compra, client, username, nombreProducto)
@@ -0,0 +1,148 @@
+# Pool de conexiones a Dgraph: varios Alphas, N canales gRPC por Alpha, selección en
+# round-robin o por el canal con menos transacciones abiertas, y health checks.
+#
+# Se usa igual que un pydgraph.DgraphClient (txn(), alter(), check_version()), así que se
+# puede pasar a cualquier función de model.py. Los loaders además lo usan como Conexiones
+# (siguiente() / len()) para repartir los chunks entre los canales.
+#
+# i.e.:
+#   pool = PoolClientes(['alpha1:9080', 'alpha2:9080'], canales_por_endpoint=2)
+#   model.search_users(pool, 'user_1')
+import itertools
+import threading
+
+import pydgraph
+
+
+ROUND_ROBIN = 'round_robin'
+MENOS_OCUPADO = 'menos_ocupado'
+TIMEOUT_SALUD = 2.0
+
+
+# Un canal: un stub con su cliente y cuántas transacciones tiene abiertas.
+class Canal:
+    def __init__(self, endpoint, credenciales=None, opciones=None):
+        self.endpoint = endpoint
+        self.stub = pydgraph.DgraphClientStub(endpoint, credenciales, opciones)
+        self.cliente = pydgraph.DgraphClient(self.stub)
+        self.en_vuelo = 0
+        self.sano = True
+        self._lock = threading.Lock()
+
+    def txn(self, read_only=False, best_effort=False, **kwargs):
+        txn = TxnContada(self.cliente.txn(read_only=read_only, best_effort=best_effort, **kwargs), self)
+        with self._lock:
+            self.en_vuelo += 1
+        return txn
+
+    def _liberar(self):
+        with self._lock:
+            self.en_vuelo -= 1
+
+    def alter(self, operacion, *args, **kwargs):
+        return self.cliente.alter(operacion, *args, **kwargs)
+
+    def check_version(self, timeout=TIMEOUT_SALUD):
+        return self.cliente.check_version(timeout=timeout)
+
+    def close(self):
+        self.stub.close()
+
+
+# Envuelve un pydgraph.Txn para descontarla del canal cuando se llama discard(). En
+# model.py todas las transacciones terminan con discard() en un finally.
+class TxnContada:
+    def __init__(self, txn, canal):
+        self._txn = txn
+        self._canal = canal
+        self._abierta = True
+
+    def __getattr__(self, nombre):
+        return getattr(self._txn, nombre)
+
+    def discard(self, *args, **kwargs):
+        try:
+            return self._txn.discard(*args, **kwargs)
+        finally:
+            if self._abierta:
+                self._abierta = False
+                self._canal._liberar()
+
+
+class PoolClientes:
+    def __init__(self, endpoints, canales_por_endpoint=1, estrategia=ROUND_ROBIN,
+                 credenciales=None, opciones=None, intervalo_salud=None):
+        if isinstance(endpoints, str):
+            endpoints = [e.strip() for e in endpoints.split(',') if e.strip()]
+        if not endpoints:
+            raise ValueError('Se necesita al menos un endpoint.')
+        if estrategia not in (ROUND_ROBIN, MENOS_OCUPADO):
+            raise ValueError(f"Estrategia desconocida: {estrategia}")
+        # Los canales de un mismo Alpha quedan separados en el orden para que el
+        # round-robin alterne entre Alphas.
+        self.canales = [Canal(endpoint, credenciales, opciones)
+                        for _ in range(canales_por_endpoint) for endpoint in endpoints]
+        self.estrategia = estrategia
+        self._ciclo = itertools.cycle(self.canales)
+        self._lock = threading.Lock()
+        self._detener = threading.Event()
+        self._hilo = None
+        if intervalo_salud:
+            self.iniciar_salud(intervalo_salud)
+
+    # Si ningún canal está sano se usan todos: es mejor intentar que no mandar nada.
+    def siguiente(self):
+        with self._lock:
+            sanos = [c for c in self.canales if c.sano] or self.canales
+            if self.estrategia == MENOS_OCUPADO:
+                return min(sanos, key=lambda c: c.en_vuelo)
+            for canal in self._ciclo:
+                if canal in sanos:
+                    return canal
+
+    def txn(self, read_only=False, best_effort=False, **kwargs):
+        return self.siguiente().txn(read_only=read_only, best_effort=best_effort, **kwargs)
+
+    def alter(self, operacion, *args, **kwargs):
+        return self.siguiente().alter(operacion, *args, **kwargs)
+
+    def check_version(self, timeout=TIMEOUT_SALUD):
+        return self.siguiente().check_version(timeout)
+
+    # Revisa cada canal con check_version y regresa {endpoint: [sano, ...]}.
+    def verificar(self, timeout=TIMEOUT_SALUD):
+        estado = {}
+        for canal in self.canales:
+            try:
+                canal.check_version(timeout)
+                canal.sano = True
+            except Exception:
+                canal.sano = False
+            estado.setdefault(canal.endpoint, []).append(canal.sano)
+        return estado
+
+    def iniciar_salud(self, intervalo=10):
+        def correr():
+            while not self._detener.wait(intervalo):
+                self.verificar()
+
+        self._detener.clear()
+        self._hilo = threading.Thread(target=correr, name='PoolClientes-salud', daemon=True)
+        self._hilo.start()
+
+    def __len__(self):
+        return len(self.canales)
+
+    def close(self):
+        self._detener.set()
+        if self._hilo is not None:
+            self._hilo.join()
+            self._hilo = None
+        for canal in self.canales:
+            canal.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
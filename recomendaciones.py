@@ -0,0 +1,351 @@
+# Motor de recomendaciones precalculadas. Periódicamente arma las matrices usuario x producto
+# de tiene_favoritos y ha_comprado (scipy.sparse), calcula los puntajes de co-favorito /
+# co-compra de forma vectorizada y guarda el top-K de cada usuario por categoría, así
+# servir una recomendación es buscar en un dict.
+#
+# Puntaje del producto j para el usuario u: sum_i X[u, i] * C[i, j], con C = X^T X (cuántos
+# usuarios tienen a i y a j a la vez). Los favoritos del usuario no se recomiendan.
+#
+# Requiere numpy y scipy; model.py sólo lo usa si se activa con model.usar_motor_recomendaciones.
+import itertools
+import threading
+
+import numpy as np
+from scipy import sparse
+
+import consultas
+
+
+PAGINA = 10000
+# Peso de una compra contra un favorito (1.0).
+PESO_COMPRA = 1.0
+# Usuarios por bloque al calcular puntajes, para no materializar toda la matriz de puntajes.
+BLOQUE_USUARIOS = 2048
+
+
+class MotorRecomendaciones:
+    def __init__(self, top_k=10, top_k_categoria=2, peso_compra=PESO_COMPRA):
+        self.top_k = top_k
+        self.top_k_categoria = top_k_categoria
+        self.peso_compra = peso_compra
+        self._lock = threading.RLock()
+        self._detener = threading.Event()
+        self._hilos = []
+        # Favoritos nuevos (username, nombre) que aún no están en las matrices. Se aplican por
+        # lote en aplicar_pendientes, en el hilo de iniciar() o al leer a uno de esos usuarios.
+        self._pendientes = {}
+        self._usuarios_pendientes = set()
+        self._hay_pendientes = threading.Event()
+        self._aplicando = threading.Lock()
+        # Cada construcción completa la incrementa; un lote calculado sobre matrices viejas se
+        # vuelve a encolar en lugar de aplicarse.
+        self._generacion = 0
+        # Mientras hay construcciones en curso se anotan los favoritos que se aplican: la
+        # construcción pudo leer el grafo antes que ellos, así que al cambiar las matrices se
+        # vuelven a encolar los que llegaron después de su marca.
+        self._construcciones = 0
+        self._aplicados = []
+        # Si llega un favorito de un usuario o producto que no está en las matrices, sólo
+        # se puede incorporar en la siguiente construcción completa.
+        self.pendiente = False
+        self._vaciar()
+
+    def _vaciar(self):
+        self.productos = []             # índice -> {uid, nombre, precio, descripcion, stock}
+        self.categorias_producto = []   # índice -> [categoria, ...]
+        self.col_producto = {}          # nombre -> índice
+        self.fila_usuario = {}          # username -> índice
+        self.X = sparse.csr_matrix((0, 0))
+        self.F = sparse.csr_matrix((0, 0))
+        self.normas = np.zeros(0)       # diagonal de C = X^T X (suma de X[:, j]^2)
+        self.populares_categoria = {}   # categoria -> [índices de producto por popularidad]
+        self._por_usuario = {}          # username -> [(categoria, [índices])]
+        self._top_usuario = {}          # username -> [índices]
+
+    @property
+    def listo(self):
+        return bool(self.fila_usuario)
+
+    def construir(self, client, pagina=PAGINA):
+        return self._reconstruir(self._leer_grafo, client, pagina)
+
+    # Igual que construir() pero desde un snapshot.Snapshot, sin queries al cluster.
+    def construir_desde_snapshot(self, snap):
+        return self._reconstruir(self._leer_snapshot, snap)
+
+    # La marca se toma antes de leer los datos; ver _aplicados.
+    def _reconstruir(self, leer, *args):
+        with self._lock:
+            self._construcciones += 1
+            marca = len(self._aplicados)
+        try:
+            return self._calcular(*leer(*args), marca=marca)
+        finally:
+            with self._lock:
+                self._construcciones -= 1
+                if not self._construcciones:
+                    self._aplicados = []
+
+    def _leer_grafo(self, client, pagina):
+        productos, categorias, col_uid, col_nombre = [], [], {}, {}
+        for nodo in consultas.paginar(client, 'productos_recomendacion', 'productos', pagina):
+            col_uid[nodo['uid']] = col_nombre[nodo.get('nombre')] = len(productos)
+            categorias.append([c['categoria'] for c in nodo.get('tiene_categoria', []) if 'categoria' in c])
+            productos.append({k: nodo.get(k) for k in ('uid', 'nombre', 'precio', 'descripcion', 'stock')})
+
+        usernames, filas_x, cols_x, vals_x, filas_f, cols_f = [], [], [], [], [], []
+        for nodo in consultas.paginar(client, 'interacciones_usuarios', 'usuarios', pagina):
+            u = len(usernames)
+            usernames.append(nodo.get('username'))
+            for producto in nodo.get('tiene_favoritos', []):
+                if producto['uid'] in col_uid:
+                    filas_f.append(u)
+                    cols_f.append(col_uid[producto['uid']])
+            for producto in nodo.get('ha_comprado', []):
+                if producto['uid'] in col_uid:
+                    filas_x.append(u)
+                    cols_x.append(col_uid[producto['uid']])
+                    vals_x.append(self.peso_compra)
+
+        forma = (len(usernames), len(productos))
+        F = sparse.csr_matrix((np.ones(len(filas_f)), (filas_f, cols_f)), shape=forma)
+        P = sparse.csr_matrix((vals_x, (filas_x, cols_x)), shape=forma)
+        return usernames, productos, categorias, col_nombre, F, P
+
+    def _leer_snapshot(self, snap):
+        columnas = {k: snap.columna('Producto', k) for k in ('uid', 'nombre', 'descripcion', 'precio', 'stock')}
+        productos = [
+            {
+                'uid': columnas['uid'][j],
+                'nombre': columnas['nombre'][j],
+                'precio': None if np.isnan(columnas['precio'][j]) else float(columnas['precio'][j]),
+                'descripcion': columnas['descripcion'][j],
+                'stock': int(columnas['stock'][j]),
+            }
+            for j in range(snap.n('Producto'))
+        ]
+        nombres_categoria = snap.columna('Categoria', 'categoria')
+        categorias = [[nombres_categoria[k] for k in snap.vecinos('tiene_categoria', j)] for j in range(len(productos))]
+        col_nombre = {p['nombre']: j for j, p in enumerate(productos)}
+        return (list(snap.columna('User', 'username')), productos, categorias, col_nombre,
+                snap.matriz('tiene_favoritos'), snap.matriz('ha_comprado'))
+
+    def _calcular(self, usernames, productos, categorias, col_nombre, F, P, marca=0):
+        forma = F.shape
+        F = F.tocsr(copy=True)
+        F.data[:] = 1.0  # un favorito repetido cuenta una vez
+        P = P.tocsr(copy=True)
+        P.data[:] = self.peso_compra
+        X = (F + P).tocsr()
+
+        populares = np.asarray(X.sum(axis=0)).ravel()
+        populares_categoria = {}
+        for j in np.argsort(-populares, kind='stable'):
+            for categoria in categorias[j]:
+                populares_categoria.setdefault(categoria, []).append(int(j))
+
+        nuevo = MotorRecomendaciones(self.top_k, self.top_k_categoria, self.peso_compra)
+        nuevo.productos, nuevo.categorias_producto, nuevo.col_producto = productos, categorias, col_nombre
+        nuevo.fila_usuario = {username: u for u, username in enumerate(usernames)}
+        nuevo.X, nuevo.F, nuevo.populares_categoria = X, F, populares_categoria
+        nuevo.normas = np.asarray(X.multiply(X).sum(axis=0)).ravel()
+
+        C = (X.T @ X).tocsr()
+        C.setdiag(0)
+        C.eliminate_zeros()
+        for inicio in range(0, forma[0], BLOQUE_USUARIOS):
+            puntajes = _sin_favoritos(X[inicio:inicio + BLOQUE_USUARIOS] @ C, F[inicio:inicio + BLOQUE_USUARIOS])
+            for i in range(puntajes.shape[0]):
+                u = inicio + i
+                nuevo._por_usuario[usernames[u]], nuevo._top_usuario[usernames[u]] = \
+                    nuevo._materializar(_fila(F, u), _ordenar_fila(puntajes, i))
+
+        # Se cambian todas las estructuras a la vez para que recomendar() nunca vea una mezcla.
+        # La cola de favoritos se queda, y se le suman los que se aplicaron después de la marca;
+        # los que esta construcción ya incluye se saltan al aplicarlos.
+        with self._lock:
+            self.__dict__.update({k: v for k, v in nuevo.__dict__.items() if k in ESTRUCTURAS})
+            self._generacion += 1
+            self.pendiente = False
+            aplicados = self._aplicados[marca:]
+            if aplicados:
+                self._pendientes.update(dict.fromkeys(aplicados))
+                self._usuarios_pendientes.update(u for u, _ in aplicados)
+                self._hay_pendientes.set()
+        return len(usernames)
+
+    # Top-K general y top `top_k_categoria` en cada categoría de los favoritos del usuario.
+    # Las categorías que no se llenan con puntajes se completan con los más populares.
+    def _materializar(self, favoritos, candidatos):
+        favoritos = set(favoritos.tolist())
+        categorias = list(dict.fromkeys(c for j in sorted(favoritos) for c in self.categorias_producto[j]))
+        por_categoria = {categoria: [] for categoria in categorias}
+        pendientes = len(categorias)
+        for j in itertools.chain(candidatos, *(self.populares_categoria.get(c, []) for c in categorias)):
+            if pendientes == 0:
+                break
+            if j in favoritos:
+                continue
+            for categoria in self.categorias_producto[j]:
+                lista = por_categoria.get(categoria)
+                if lista is not None and len(lista) < self.top_k_categoria and j not in lista:
+                    lista.append(j)
+                    if len(lista) == self.top_k_categoria:
+                        pendientes -= 1
+        return list(por_categoria.items()), [int(j) for j in candidatos[:self.top_k]]
+
+    # Mismo formato que la query en vivo de model.recomendaciones_por_categoria.
+    # Regresa None si el usuario no está en el índice.
+    def recomendar(self, username):
+        self._aplicar_si_pendiente(username)
+        with self._lock:
+            por_categoria = self._por_usuario.get(username)
+            if por_categoria is None:
+                return None
+            return {
+                'recomendaciones': [
+                    {'categoria': categoria, 'recomendaciones': [self.productos[j] for j in indices]}
+                    for categoria, indices in por_categoria if indices
+                ]
+            }
+
+    def top_productos(self, username):
+        self._aplicar_si_pendiente(username)
+        with self._lock:
+            return [self.productos[j] for j in self._top_usuario.get(username, [])]
+
+    # Refresco incremental: sólo encola el favorito, así quien escribe no espera el cálculo.
+    def agregar_favorito(self, username, nombreProducto):
+        return self.agregar_favoritos([(username, nombreProducto)]) == 1
+
+    # Encola varios favoritos; regresa cuántos son de usuarios y productos conocidos.
+    def agregar_favoritos(self, pares):
+        encolados = 0
+        with self._lock:
+            for username, nombreProducto in pares:
+                if username not in self.fila_usuario or nombreProducto not in self.col_producto:
+                    self.pendiente = True
+                    continue
+                self._pendientes[(username, nombreProducto)] = None
+                self._usuarios_pendientes.add(username)
+                encolados += 1
+        if encolados:
+            self._hay_pendientes.set()
+        return encolados
+
+    # Lectura de un usuario con favoritos en cola: se aplica la cola antes de responder.
+    def _aplicar_si_pendiente(self, username):
+        if username in self._usuarios_pendientes:
+            self.aplicar_pendientes()
+
+    # Aplica toda la cola como un solo delta: F y X se suman una vez, las normas de columna
+    # se actualizan sólo en los productos tocados, y los usuarios afectados se recalculan
+    # juntos como (X_U X^T) X, que es exacto con las matrices nuevas. El cálculo corre fuera
+    # de _lock, así recomendar() sigue respondiendo con lo anterior mientras tanto.
+    def aplicar_pendientes(self):
+        with self._aplicando:
+            with self._lock:
+                pares, self._pendientes = list(self._pendientes), {}
+                generacion = self._generacion
+            lote = self._calcular_lote(pares) if pares else None
+
+            with self._lock:
+                if self._generacion != generacion:
+                    # Hubo una construcción completa mientras tanto: se intenta sobre la nueva.
+                    self._pendientes.update(dict.fromkeys(pares))
+                    self._hay_pendientes.set()
+                    lote = None
+                elif lote is not None:
+                    self.F, self.X, self.normas, resultados = lote
+                    if self._construcciones:
+                        self._aplicados.extend(pares)
+                    for username, (por_categoria, top) in resultados.items():
+                        self._por_usuario[username], self._top_usuario[username] = por_categoria, top
+                # Hasta aquí un lector de estos usuarios espera el lote en lugar de leer lo anterior.
+                self._usuarios_pendientes = {u for u, _ in self._pendientes}
+            return len(lote[3]) if lote is not None else 0
+
+    def _calcular_lote(self, pares):
+        with self._lock:
+            F, X, normas = self.F, self.X, self.normas
+            nombres = {self.fila_usuario[u]: u for u, _ in pares if u in self.fila_usuario}
+            indices = [(self.fila_usuario.get(u), self.col_producto.get(p)) for u, p in pares]
+        indices = [(u, j) for u, j in indices if u is not None and j is not None]
+        if not indices:
+            return None
+        us, js = (np.array(v, dtype=np.int64) for v in zip(*indices))
+        # Los que ya están en F (i.e. una construcción completa ya los leyó) no se suman.
+        nuevos = np.asarray(F[us, js]).ravel() == 0
+        us, js = us[nuevos], js[nuevos]
+        if not len(us):
+            return None
+        anteriores = np.asarray(X[us, js]).ravel()
+        delta = sparse.csr_matrix((np.ones(len(us)), (us, js)), shape=X.shape)
+        F = (F + delta).tocsr()
+        X = (X + delta).tocsr()
+        normas = normas.copy()
+        np.add.at(normas, js, 2 * anteriores + 1)  # (v + 1)^2 - v^2
+
+        usuarios = np.unique(us)
+        X_u = X[usuarios]
+        # Quitar la co-ocurrencia de cada producto consigo mismo (la diagonal de C).
+        puntajes = _sin_favoritos((X_u @ X.T) @ X - X_u.multiply(normas), F[usuarios])
+        resultados = {nombres[u]: self._materializar(_fila(F, u), _ordenar_fila(puntajes, i))
+                      for i, u in enumerate(usuarios.tolist())}
+        return F, X, normas, resultados
+
+    # Reconstruye todo cada `intervalo` segundos en un hilo aparte, y en otro aplica los
+    # favoritos encolados conforme llegan.
+    def iniciar(self, client, intervalo=3600):
+        def correr():
+            while not self._detener.is_set():
+                try:
+                    self.construir(client)
+                except Exception as e:
+                    print(f"Error al construir recomendaciones: {e}")
+                self._detener.wait(intervalo)
+
+        def aplicar():
+            while not self._detener.is_set():
+                self._hay_pendientes.wait()
+                self._hay_pendientes.clear()
+                try:
+                    self.aplicar_pendientes()
+                except Exception as e:
+                    print(f"Error al aplicar favoritos a las recomendaciones: {e}")
+
+        self._detener.clear()
+        self._hilos = [threading.Thread(target=correr, name='MotorRecomendaciones', daemon=True),
+                       threading.Thread(target=aplicar, name='MotorRecomendaciones-favoritos', daemon=True)]
+        for hilo in self._hilos:
+            hilo.start()
+
+    def detener(self):
+        self._detener.set()
+        self._hay_pendientes.set()
+        for hilo in self._hilos:
+            hilo.join()
+
+
+# Lo que construir() reemplaza; la cola, los hilos y los locks se quedan.
+ESTRUCTURAS = ('productos', 'categorias_producto', 'col_producto', 'fila_usuario', 'X', 'F', 'normas',
+               'populares_categoria', '_por_usuario', '_top_usuario')
+
+
+def _fila(matriz, i):
+    return matriz.indices[matriz.indptr[i]:matriz.indptr[i + 1]]
+
+
+def _sin_favoritos(puntajes, favoritos):
+    puntajes = sparse.csr_matrix(puntajes)
+    puntajes = puntajes - puntajes.multiply(favoritos.astype(bool))
+    puntajes.eliminate_zeros()
+    return puntajes
+
+
+# Índices de producto de la fila `i` ordenados de mayor a menor puntaje; los empates se
+# ordenan por índice para que el refresco incremental dé lo mismo que el completo.
+def _ordenar_fila(puntajes, i):
+    inicio, fin = puntajes.indptr[i], puntajes.indptr[i + 1]
+    indices = puntajes.indices[inicio:fin]
+    return indices[np.lexsort((indices, -puntajes.data[inicio:fin]))]
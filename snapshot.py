@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+# Snapshot del grafo en arreglos de numpy para análisis, sin competir con el tráfico del
+# cluster. Exporta los nodos User / Producto / Categoria / devolucion con ids densos (0..n-1
+# por tipo, en orden de uid) y cada arista en formato CSR: los destinos del nodo i son
+# indices[indptr[i]:indptr[i + 1]]. Los arreglos se guardan como .npy y se abren con memmap,
+# así un análisis sobre millones de aristas no necesita cargarlas en memoria.
+#
+# Formato del directorio (`<directorio>` es un symlink a la versión actual, ver exportar):
+#   snapshot.json               número de nodos por tipo y origen / destino de cada arista
+#   <Tipo>.json                 columnas de texto por id denso (uid, xid, nombre, ...)
+#   <Tipo>.<atributo>.npy       columnas numéricas (precio, stock)
+#   <arista>.indptr.npy         int64, n_origen + 1
+#   <arista>.indices.npy        int32, ids densos del tipo destino
+#
+# i.e.:
+#   python3 snapshot.py exportar --out snap
+#   python3 snapshot.py analizar snap
+#
+#   snap = snapshot.Snapshot('snap')
+#   favoritos = snap.matriz('tiene_favoritos')   # scipy.sparse, usuarios x productos
+import argparse
+import array
+import datetime
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+from scipy import sparse
+
+import consultas
+from pool import PoolClientes
+
+
+# tipo -> (atributos de texto, atributos numéricos con su dtype, aristas salientes -> tipo destino).
+# Cada tipo se lee con la query 'snapshot_<tipo>' de consultas.py.
+TIPOS = {
+    'User': (('uid', 'xid', 'username'), {},
+             {'ha_comprado': 'Producto', 'tiene_favoritos': 'Producto', 'hizo_devolucion': 'devolucion'}),
+    'Producto': (('uid', 'xid', 'nombre', 'descripcion'), {'precio': np.float64, 'stock': np.int64},
+                 {'tiene_categoria': 'Categoria'}),
+    'Categoria': (('uid', 'xid', 'categoria'), {}, {}),
+    'devolucion': (('uid', 'xid', 'motivo'), {}, {'De_producto': 'Producto'}),
+}
+PAGINA = 10000
+MANIFIESTO = 'snapshot.json'
+
+
+#Exportar:
+
+# Lee todos los nodos de un tipo. Regresa los uids en orden, las columnas de texto, las
+# numéricas y, por arista, el grado de cada nodo y los uids destino concatenados.
+def _leer_tipo(client, tipo, pagina):
+    textos, numeros, aristas = TIPOS[tipo]
+    uids = array.array('Q')
+    columnas = {c: [] for c in textos}
+    valores = {a: [] for a in numeros}
+    grados = {a: array.array('q') for a in aristas}
+    destinos = {a: array.array('Q') for a in aristas}
+    for nodo in consultas.paginar(client, 'snapshot_' + tipo, 'nodos', pagina):
+        uids.append(int(nodo['uid'], 16))
+        for c in textos:
+            columnas[c].append(nodo.get(c))
+        for a in numeros:
+            valores[a].append(nodo.get(a))
+        for a in aristas:
+            vecinos = nodo.get(a, [])
+            grados[a].append(len(vecinos))
+            destinos[a].extend(int(v['uid'], 16) for v in vecinos)
+    numericas = {
+        a: np.array([(np.nan if dtype is np.float64 else 0) if v is None else v for v in valores[a]], dtype=dtype)
+        for a, dtype in numeros.items()
+    }
+    return np.frombuffer(uids, dtype=np.uint64), columnas, numericas, grados, destinos
+
+
+# Convierte los uids destino a ids densos del tipo destino. Las aristas a nodos que no son
+# de ese tipo (o que ya no existen) se descartan.
+def _csr(grados, destinos, uids_destino):
+    grados = np.frombuffer(grados, dtype=np.int64)
+    destinos = np.frombuffer(destinos, dtype=np.uint64)
+    ids = np.searchsorted(uids_destino, destinos)
+    if len(uids_destino):
+        validos = (ids < len(uids_destino)) & (uids_destino[np.minimum(ids, len(uids_destino) - 1)] == destinos)
+    else:
+        validos = np.zeros(len(destinos), dtype=bool)
+    filas = np.repeat(np.arange(len(grados)), grados)
+    indptr = np.zeros(len(grados) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(filas[validos], minlength=len(grados)), out=indptr[1:])
+    return indptr, ids[validos].astype(np.int32)
+
+
+# Cada exportación se escribe en su propio directorio `directorio`.v<fecha> y `directorio` es
+# un symlink a la versión actual que se cambia con un solo os.replace, así un análisis nunca
+# abre un snapshot a medias ni una mezcla de dos. Se conservan la versión nueva y la anterior
+# (la que pueden estar leyendo otros procesos); las más viejas se borran.
+def exportar(client, directorio, pagina=PAGINA):
+    inicio = time.perf_counter()
+    directorio = directorio.rstrip(os.sep)
+    version = f"{directorio}.v{datetime.datetime.now().strftime('%Y%m%d%H%M%S%f')}"
+    temporal = version + '.tmp'
+    shutil.rmtree(temporal, ignore_errors=True)
+    os.makedirs(temporal)
+
+    manifiesto = {'fecha': datetime.datetime.now().isoformat(timespec='seconds'), 'tipos': {}, 'aristas': {}}
+    uids, pendientes = {}, []
+    for tipo, (_, _, aristas) in TIPOS.items():
+        uids[tipo], columnas, numericas, grados, destinos = _leer_tipo(client, tipo, pagina)
+        manifiesto['tipos'][tipo] = len(uids[tipo])
+        with open(os.path.join(temporal, f'{tipo}.json'), 'w', encoding='utf-8') as f:
+            json.dump(columnas, f)
+        for atributo, valores in numericas.items():
+            np.save(os.path.join(temporal, f'{tipo}.{atributo}.npy'), valores)
+        pendientes += [(arista, tipo, destino, grados[arista], destinos[arista]) for arista, destino in aristas.items()]
+        print(f"{tipo}: {len(uids[tipo])} nodos")
+
+    for arista, origen, destino, grados, destinos in pendientes:
+        indptr, indices = _csr(grados, destinos, uids[destino])
+        np.save(os.path.join(temporal, f'{arista}.indptr.npy'), indptr)
+        np.save(os.path.join(temporal, f'{arista}.indices.npy'), indices)
+        manifiesto['aristas'][arista] = {'origen': origen, 'destino': destino, 'aristas': len(indices)}
+        print(f"{arista}: {len(indices)} aristas")
+
+    manifiesto['segundos'] = time.perf_counter() - inicio
+    with open(os.path.join(temporal, MANIFIESTO), 'w', encoding='utf-8') as f:
+        json.dump(manifiesto, f, indent=2)
+
+    os.replace(temporal, version)
+    _publicar(directorio, version)
+    print(f"Snapshot en {directorio} -> {os.path.basename(version)} ({manifiesto['segundos']:.1f}s)")
+    return manifiesto
+
+
+# Apunta el symlink `directorio` a `version` (ruta relativa, así se puede mover el padre).
+def _publicar(directorio, version):
+    # Un snapshot de antes de los symlinks es un directorio normal: se vuelve una versión más.
+    if os.path.isdir(directorio) and not os.path.islink(directorio):
+        os.replace(directorio, f'{directorio}.v0')
+    enlace = f'{directorio}.enlace.tmp'
+    if os.path.lexists(enlace):
+        os.remove(enlace)
+    os.symlink(os.path.basename(version), enlace)
+    os.replace(enlace, directorio)
+
+    # Las .tmp que quedan son de exportaciones que fallaron a la mitad.
+    padre, nombre = os.path.split(directorio)
+    versiones = sorted(v for v in os.listdir(padre or '.') if v.startswith(nombre + '.v'))
+    completas = [v for v in versiones if not v.endswith('.tmp')]
+    for vieja in completas[:-2] + [v for v in versiones if v.endswith('.tmp')]:
+        shutil.rmtree(os.path.join(padre, vieja), ignore_errors=True)
+
+
+#Leer:
+
+class Snapshot:
+    # El symlink se resuelve una vez: todos los arreglos se leen de la misma versión aunque
+    # mientras tanto se publique otra.
+    def __init__(self, directorio):
+        self.directorio = os.path.realpath(directorio)
+        with open(self._ruta(MANIFIESTO), encoding='utf-8') as f:
+            self.manifiesto = json.load(f)
+        self._columnas = {}
+        self._csr = {}
+
+    def _ruta(self, nombre):
+        return os.path.join(self.directorio, nombre)
+
+    def n(self, tipo):
+        return self.manifiesto['tipos'][tipo]
+
+    # Columna de un tipo por id denso: las de texto son listas y las numéricas memmaps.
+    def columna(self, tipo, atributo):
+        llave = (tipo, atributo)
+        if llave not in self._columnas:
+            if atributo in TIPOS[tipo][1]:
+                self._columnas[llave] = np.load(self._ruta(f'{tipo}.{atributo}.npy'), mmap_mode='r')
+            else:
+                with open(self._ruta(f'{tipo}.json'), encoding='utf-8') as f:
+                    for nombre, valores in json.load(f).items():
+                        self._columnas[(tipo, nombre)] = valores
+        return self._columnas[llave]
+
+    # {valor: id denso} de un atributo, i.e. ids('User', 'username')['user_1'].
+    def ids(self, tipo, atributo):
+        return {valor: i for i, valor in enumerate(self.columna(tipo, atributo))}
+
+    def csr(self, arista):
+        if arista not in self._csr:
+            self._csr[arista] = (np.load(self._ruta(f'{arista}.indptr.npy'), mmap_mode='r'),
+                                 np.load(self._ruta(f'{arista}.indices.npy'), mmap_mode='r'))
+        return self._csr[arista]
+
+    def vecinos(self, arista, i):
+        indptr, indices = self.csr(arista)
+        return indices[indptr[i]:indptr[i + 1]]
+
+    def grados(self, arista):
+        return np.diff(self.csr(arista)[0])
+
+    # Veces que cada nodo destino aparece en la arista (i.e. favoritos por producto).
+    def entrantes(self, arista):
+        return np.bincount(self.csr(arista)[1], minlength=self.n(self.manifiesto['aristas'][arista]['destino']))
+
+    # Matriz dispersa origen x destino con 1.0 en cada arista.
+    def matriz(self, arista):
+        indptr, indices = self.csr(arista)
+        info = self.manifiesto['aristas'][arista]
+        return sparse.csr_matrix((np.ones(len(indices)), indices, indptr),
+                                 shape=(self.n(info['origen']), self.n(info['destino'])))
+
+
+#Análisis:
+
+def mas_favoritos(snap, n=10):
+    conteos = snap.entrantes('tiene_favoritos')
+    nombres = snap.columna('Producto', 'nombre')
+    return [(nombres[j], int(conteos[j])) for j in np.argsort(-conteos, kind='stable')[:n] if conteos[j]]
+
+
+# Devoluciones / compras de los productos de cada categoría.
+def tasa_devolucion_por_categoria(snap):
+    categorias = snap.matriz('tiene_categoria')
+    devoluciones = categorias.T @ snap.entrantes('De_producto')
+    compras = categorias.T @ snap.entrantes('ha_comprado')
+    resultado = [
+        {
+            'categoria': nombre,
+            'devoluciones': int(devoluciones[k]),
+            'compras': int(compras[k]),
+            'tasa': float(devoluciones[k] / compras[k]) if compras[k] else None,
+        }
+        for k, nombre in enumerate(snap.columna('Categoria', 'categoria'))
+    ]
+    return sorted(resultado, key=lambda c: -1 if c['tasa'] is None else c['tasa'], reverse=True)
+
+
+# Productos que más compraron los compradores de `nombre`, con cuántos compradores en común.
+def compras_en_comun(snap, nombre, n=10):
+    j = snap.ids('Producto', 'nombre').get(nombre)
+    if j is None:
+        return []
+    compras = snap.matriz('ha_comprado')
+    compradores = compras[:, j].nonzero()[0]
+    conteos = np.asarray(compras[compradores].sum(axis=0)).ravel()
+    conteos[j] = 0
+    nombres = snap.columna('Producto', 'nombre')
+    return [(nombres[k], int(conteos[k])) for k in np.argsort(-conteos, kind='stable')[:n] if conteos[k]]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Snapshot del grafo en arreglos de numpy.')
+    sub = parser.add_subparsers(dest='comando', required=True)
+    exportar_args = sub.add_parser('exportar', help='Leer el cluster y escribir el snapshot')
+    exportar_args.add_argument('--out', default='snapshot', help='Directorio del snapshot')
+    exportar_args.add_argument('--pagina', type=int, default=PAGINA, help='Nodos por query')
+    exportar_args.add_argument('--alphas', default=os.getenv('DGRAPH_ALPHAS') or os.getenv('DGRAPH_URI', 'localhost:9080'),
+                               help='Alphas separados por coma')
+    analizar_args = sub.add_parser('analizar', help='Resumen de un snapshot')
+    analizar_args.add_argument('directorio', nargs='?', default='snapshot')
+    analizar_args.add_argument('--producto', help='Producto para compras en común')
+    args = parser.parse_args()
+
+    if args.comando == 'exportar':
+        with PoolClientes(args.alphas) as client:
+            exportar(client, args.out, args.pagina)
+        return
+
+    snap = Snapshot(args.directorio)
+    print(f"Snapshot del {snap.manifiesto['fecha']}: {snap.manifiesto['tipos']}")
+    print("Productos con más favoritos:")
+    for nombre, conteo in mas_favoritos(snap):
+        print(f"  {conteo:8d}  {nombre}")
+    print("Tasa de devolución por categoría:")
+    for c in tasa_devolucion_por_categoria(snap):
+        tasa = '-' if c['tasa'] is None else f"{100 * c['tasa']:.1f}%"
+        print(f"  {tasa:>7}  {c['categoria']} ({c['devoluciones']}/{c['compras']})")
+    if args.producto:
+        print(f"Comprado junto con '{args.producto}':")
+        for nombre, conteo in compras_en_comun(snap, args.producto):
+            print(f"  {conteo:8d}  {nombre}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,235 @@
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import analitica
+import metricas
+import model
+from recomendaciones import MotorRecomendaciones
+from dgraph_memoria import DgraphMemoria, ClienteMemoria
+
+DIRECTORIO = os.path.dirname(os.path.abspath(__file__))
+
+
+# Nodos y aristas por predicado, para comparar dos grafos cuyos uids no coinciden.
+def resumen(db):
+    nodos = sum(1 for nodo in db.nodos.values() if nodo.get('dgraph.type'))
+    aristas = {predicado: sum(len(hijos) for hijos in por_destino.values())
+               for predicado, por_destino in db.reversas.items()}
+    return nodos, aristas
+
+
+# Corre en el directorio de los CSV del repo, con un directorio temporal para índices y
+# manifests y sin la salida de las funciones de model.
+class CasoModel(unittest.TestCase):
+    def setUp(self):
+        self._cwd = os.getcwd()
+        os.chdir(DIRECTORIO)
+        self.tmp = tempfile.mkdtemp()
+        self._retries = model.RETRIES
+        self._top = model.TOP_TAMBIEN
+        model.productos_cache.clear()
+        metricas.registro.reiniciar()
+
+    def tearDown(self):
+        model.RETRIES = self._retries
+        model.TOP_TAMBIEN = self._top
+        model.productos_cache.clear()
+        model.usar_motor_recomendaciones(None)
+        model.usar_agregados_devoluciones(None)
+        os.chdir(self._cwd)
+        shutil.rmtree(self.tmp)
+
+    def ruta(self, nombre):
+        return os.path.join(self.tmp, nombre)
+
+    def callado(self):
+        return contextlib.redirect_stdout(io.StringIO())
+
+    # Una base en memoria con el schema aplicado.
+    def base(self, **kwargs):
+        db = DgraphMemoria(**kwargs)
+        with self.callado():
+            model.set_schema(ClienteMemoria(db))
+        return db, ClienteMemoria(db)
+
+    # Una base con los CSV del repo cargados con create_data.
+    def base_cargada(self, uidmap='uids.db'):
+        db, client = self.base()
+        with self.callado():
+            model.create_data(client, uidmap_path=self.ruta(uidmap))
+        return db, client
+
+
+class TestCargaDelta(CasoModel):
+    def cargar_delta(self, prob_abort, nombre, db=None):
+        if db is None:
+            db, _ = self.base(seed=7)
+        db.prob_abort = prob_abort
+        with self.callado():
+            model.create_data_delta(ClienteMemoria(db), manifest_path=self.ruta(nombre + '.manifest'),
+                                    uidmap_path=self.ruta(nombre + '.uids'))
+        return db
+
+    def test_delta_reintenta_los_aborts(self):
+        model.RETRIES = 50
+        con_aborts = self.cargar_delta(0.3, 'aborts')
+        sin_aborts = self.cargar_delta(0.0, 'normal')
+
+        self.assertEqual(resumen(con_aborts), resumen(sin_aborts))
+        reintentos = {dict(etiquetas)['operacion']
+                      for (nombre, etiquetas) in metricas.registro._contadores
+                      if nombre == 'dgraph_reintentos_total'}
+        self.assertIn('_aplicar_aristas_delta', reintentos)
+
+    # producto_categoria.csv tiene filas repetidas; no deben contar como aristas nuevas. Se
+    # agrega además un usuario repetido con otro contenido.
+    def test_delta_sin_cambios_no_escribe(self):
+        csv_dir = self.ruta('csv')
+        shutil.copytree(DIRECTORIO, csv_dir, ignore=lambda _, archivos: [a for a in archivos if not a.endswith('.csv')])
+        with open(os.path.join(csv_dir, 'User.csv'), encoding='utf-8') as f:
+            filas = f.read().splitlines()
+        with open(os.path.join(csv_dir, 'User.csv'), 'w', encoding='utf-8') as f:
+            f.write('\n'.join(filas + [filas[1].replace('@', '+otro@')]) + '\n')
+        os.chdir(csv_dir)
+
+        db = self.cargar_delta(0.0, 'delta')
+        db.llamadas.clear()
+        self.cargar_delta(0.0, 'delta', db)
+
+        self.assertEqual(db.llamadas['mutate'], 0)
+        self.assertEqual(db.llamadas['commit'], 0)
+
+
+class TestDropAll(CasoModel):
+    # Con un índice en otra ruta, create_relaciones después de un drop_all no debe ligar
+    # aristas a uids que ya no existen.
+    def test_drop_all_limpia_indices_en_otras_rutas(self):
+        db, client = self.base_cargada()
+        with self.callado():
+            model.drop_all(client)
+            model.create_data(client, uidmap_path=self.ruta('otro.db'))
+            antes = resumen(db)
+            model.create_relaciones(client, uidmap_path=self.ruta('uids.db'))
+
+        self.assertEqual(resumen(db), antes)
+        self.assertTrue(all(uid in db.nodos for hijos in db.reversas['ha_comprado'].values() for uid in hijos))
+
+    # drop_all borra el schema en Dgraph; la carga de después necesita el índice de xid.
+    def test_drop_all_y_cargar(self):
+        db, client = self.base_cargada()
+        antes = resumen(db)
+        with self.callado():
+            model.drop_all(client)
+            model.create_data(client, uidmap_path=self.ruta('uids.db'))
+            model.create_data_delta(client, manifest_path=self.ruta('delta.manifest'),
+                                    uidmap_path=self.ruta('uids.db'))
+
+        self.assertEqual(resumen(db), antes)
+        self.assertIn('@upsert', db.predicados['xid'][1])
+
+
+class TestTambien(CasoModel):
+    # Pedir más productos de los que tiene la entrada del cache vuelve a consultar.
+    def test_first_mayor_que_el_cache(self):
+        model.TOP_TAMBIEN = 2
+        _, client = self.base_cargada()
+        self.assertEqual(len(model.tambien_en_favoritos(client, 'Chaquetas Book', 1)), 1)
+        todos = model.tambien_en_favoritos(client, 'Chaquetas Book', 100)
+
+        self.assertGreater(len(todos), 2)
+        self.assertEqual(model.tambien_en_favoritos(client, 'Chaquetas Book', 3), todos[:3])
+
+
+class TestEstadisticas(CasoModel):
+    # Las estadísticas por query salen del mismo histograma que /metrics.
+    def test_estadisticas_de_metricas(self):
+        _, client = self.base_cargada()
+        metricas.registro.reiniciar()
+        model.tambien_en_favoritos(client, 'Chaquetas Book', 3)
+
+        estadisticas = {e['query']: e for e in model.estadisticas_queries()}
+        self.assertEqual(estadisticas['tambien_favoritos']['llamadas'], 1)
+        suma = sum(suma for etiquetas, _, suma, _ in metricas.registro.resumen('dgraph_cliente_segundos')
+                   if etiquetas['plantilla'] == 'tambien_favoritos')
+        self.assertEqual(estadisticas['tambien_favoritos']['total_s'], suma)
+
+
+class TestMotorRecomendaciones(CasoModel):
+    # Un favorito aplicado después de que construir() leyó el grafo no debe perderse al
+    # cambiar las matrices.
+    def test_favorito_durante_construir(self):
+        _, client = self.base_cargada()
+        motor = MotorRecomendaciones()
+        motor.construir(client)
+        model.usar_motor_recomendaciones(motor)
+        fila = motor.fila_usuario['user_1']
+        nombre = next(nombre for nombre, j in motor.col_producto.items() if not motor.F[fila, j])
+
+        calcular = motor._calcular
+
+        def favorito_y_calcular(*args, **kwargs):
+            with self.callado():
+                model.guardar_en_favoritos(client, 'user_1', nombre)
+            self.assertEqual(motor.aplicar_pendientes(), 1)
+            return calcular(*args, **kwargs)
+
+        motor._calcular = favorito_y_calcular
+        motor.construir(client)
+        self.assertIn(('user_1', nombre), motor._pendientes)
+
+        recomendados = motor.recomendar('user_1')['recomendaciones']
+        self.assertTrue(motor.F[fila, motor.col_producto[nombre]])
+        self.assertNotIn(nombre, [p for c in recomendados for p in c['recomendaciones']])
+        self.assertEqual(motor._aplicados, [])
+
+
+class TestAgregadosDevoluciones(CasoModel):
+    # Una devolución o compra registrada después de que construir() leyó el grafo debe
+    # seguir contando después del cambio.
+    def test_delta_durante_construir(self):
+        _, client = self.base_cargada()
+        agregados = analitica.AgregadosDevoluciones()
+        agregados.construir(client)
+        model.usar_agregados_devoluciones(agregados)
+        total = agregados.total
+
+        leer = agregados._leer
+
+        def leer_y_registrar(*args):
+            datos = leer(*args)
+            with self.callado():
+                model.registrar_devolucion(client, 'Chaquetas Book', 'Mala calidad', 'user_1')
+                model.registrar_compra(client, 'user_2', 'Chaquetas Book')
+            return datos
+
+        agregados._leer = leer_y_registrar
+        self.assertEqual(agregados.construir(client), total + 1)
+
+        nuevos = analitica.AgregadosDevoluciones()
+        nuevos.construir(client)
+        self.assertEqual(agregados.por_producto(), nuevos.por_producto())
+        self.assertEqual(agregados.por_categoria(), nuevos.por_categoria())
+        self.assertEqual(agregados.por_motivo(), nuevos.por_motivo())
+        self.assertEqual(agregados._deltas, [])
+
+
+class TestDgraphMemoria(CasoModel):
+    # Como en Dgraph, las funciones en la raíz necesitan el índice que les corresponde.
+    def test_raiz_sin_indice(self):
+        _, client = self.base()
+        txn = client.txn(read_only=True)
+        for query in ('{ q(func: eq(email, "a")) { uid } }',          # sin índice
+                      '{ q(func: ge(nombre, "a")) { uid } }',         # hash no sirve para ge
+                      '{ q(func: anyofterms(nombre, "a")) { uid } }',  # fulltext no es term
+                      '{ q(func: ge(count(tiene_categoria), 1)) { uid } }'):  # sin @count
+            with self.assertRaises(ValueError):
+                txn.query(query)
+        txn.query('{ q(func: eq(nombre, "a")) @filter(eq(email, "a")) { uid } }')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+# Índice persistente xid -> uid en SQLite. Los loaders de nodos lo llenan y los de
+# relaciones lo leen, así las aristas se pueden cargar en otro proceso, retomar una
+# carga que falló o agregar relaciones nuevas después sin tener los uids en memoria.
+import sqlite3
+import threading
+
+import metricas
+
+# SQLite limita el número de parámetros por sentencia.
+LOTE_SQL = 500
+PAGINA_REBUILD = 10000
+
+
+class UidMap:
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS uids (
+                    tipo TEXT NOT NULL,
+                    xid TEXT NOT NULL,
+                    uid TEXT NOT NULL,
+                    PRIMARY KEY (tipo, xid)
+                ) WITHOUT ROWID
+            """)
+
+    def guardar(self, tipo, uids):
+        with self._lock, self.conn:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO uids (tipo, xid, uid) VALUES (?, ?, ?)',
+                ((tipo, xid, uid) for xid, uid in uids.items()))
+
+    # Regresa {xid: uid} sólo de los xids que están en el índice.
+    def buscar(self, tipo, xids):
+        xids = list(xids)
+        encontrados = {}
+        with self._lock:
+            for i in range(0, len(xids), LOTE_SQL):
+                lote = xids[i:i + LOTE_SQL]
+                cursor = self.conn.execute(
+                    f"SELECT xid, uid FROM uids WHERE tipo = ? AND xid IN ({','.join('?' * len(lote))})",
+                    [tipo] + lote)
+                encontrados.update(cursor)
+        return encontrados
+
+    def borrar(self, tipo, xids):
+        xids = list(xids)
+        with self._lock, self.conn:
+            for i in range(0, len(xids), LOTE_SQL):
+                lote = xids[i:i + LOTE_SQL]
+                self.conn.execute(
+                    f"DELETE FROM uids WHERE tipo = ? AND xid IN ({','.join('?' * len(lote))})",
+                    [tipo] + lote)
+
+    def contar(self, tipo):
+        with self._lock:
+            return self.conn.execute('SELECT COUNT(*) FROM uids WHERE tipo = ?', (tipo,)).fetchone()[0]
+
+    # Después de un drop_all los uids guardados ya no existen.
+    def limpiar(self):
+        with self._lock, self.conn:
+            self.conn.execute('DELETE FROM uids')
+
+    # Vuelve a llenar el índice de un tipo desde el grafo, paginando por uid.
+    def reconstruir(self, client, tipo, pagina=PAGINA_REBUILD):
+        total = 0
+        despues = ''
+        while True:
+            query = f"""
+            {{
+                nodos(func: type({tipo}), first: {pagina}{despues}) @filter(has(xid)) {{
+                    uid
+                    xid
+                }}
+            }}
+            """
+            txn = client.txn(read_only=True)
+            try:
+                res = metricas.llamar('query', 'reconstruir_uids', txn.query, query)
+                nodos = metricas.decodificar('reconstruir_uids', res).get('nodos', [])
+            finally:
+                txn.discard()
+            if not nodos:
+                break
+            self.guardar(tipo, {nodo['xid']: nodo['uid'] for nodo in nodos})
+            total += len(nodos)
+            despues = f", after: {nodos[-1]['uid']}"
+        return total
+
+    def tabla(self, tipo):
+        return TablaUids(self, tipo)
+
+    def close(self):
+        self.conn.close()
+
+
+# Vista de un solo tipo de nodo; los loaders de relaciones la usan igual que un dict de uids.
+class TablaUids:
+    def __init__(self, uidmap, tipo):
+        self.uidmap = uidmap
+        self.tipo = tipo
+
+    def buscar(self, xids):
+        return self.uidmap.buscar(self.tipo, xids)
+
+    def __len__(self):
+        return self.uidmap.contar(self.tipo)